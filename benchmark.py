@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+
+""" Benchmarks puzzle generation on a fixed set of positions
+
+    Prints the time, number of engine searches and nodes used for each
+    position, and the puzzle that was generated so that the output of
+    different versions or settings can be compared
+
+    With --scan, benchmarks the two-stage scan (--shallow-depth) against
+    the full-depth scan on the games of PGN fixtures instead, and prints
+    how many of the full scan's candidates it found (recall) and how much
+    faster it was
+
+    With --deepening, --exclusion or --mate-lines, generates the puzzles with
+    and without progressive deepening, exclusion searches or the forced-mate
+    fast path, and prints the time saved and the puzzles that changed
+
+    With --scan-orders, scans the games in both orders (see --reverse-scan)
+    with each hash policy (see --clear-hash) and prints what each one took
+
+    With --prefilter, checks the fixed positions and the candidates found in
+    the games of PGN fixtures for tactical motifs, generates all of them, and
+    prints how many of the puzzles the prefilter keeps (recall), how many of
+    the candidates it keeps become puzzles (precision) and the generation
+    time of the candidates it would drop
+"""
+
+import argparse
+import logging
+import os
+import time
+
+from chess import Board
+import chess.pgn
+
+from puzzlemaker.puzzle_finder import find_puzzle_candidates
+from puzzlemaker.pgn_files import pgn_file_paths, read_pgn_games
+from puzzlemaker.pgn_reader import read_mainline_game
+
+from puzzlemaker.puzzle import Puzzle
+from puzzlemaker.logger import configure_logging
+from puzzlemaker.analysis import AnalysisEngine, HASH_POLICIES, HASH_POLICY_NEVER, HASH_POLICY_GAME
+from puzzlemaker.analysis_cache import AnalysisCache
+from puzzlemaker.tactics import check_motifs
+from puzzlemaker.constants import ANALYSIS_CACHE_SIZE, SCAN_DEPTH, SHALLOW_SCAN_DEPTH, SCAN_MARGIN
+
+FIXTURES_PGN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test", "fixtures")
+
+# (FEN, initial move) pairs from the integration tests
+BENCHMARK_POSITIONS = [
+    ('6k1/R4p2/1r3npp/2N5/P1b2P2/6P1/3r2BP/4R1K1 w - - 0 34', 'Rb7'),
+    ('r1b3kr/ppp1Bp1p/1b6/n2P4/2p3q1/2Q2N2/P4PPP/RN2R1K1 w - - 1 0', None),
+    ('r2n1rk1/1ppb2pp/1p1p4/3Ppq1n/2B3P1/2P4P/PP1N1P1K/R2Q1RN1 b - - 0 1', 'Qxf2+'),
+    ('3q1r1k/2p4p/1p1pBrp1/p2Pp3/2PnP3/5PP1/PP1Q2K1/5R1R w - - 1 0', 'Rxh7+'),
+    ('r1b2r1k/ppp2p1p/8/P3p2p/2PqP3/3P1Q1P/6PK/5R2 b - - 3 21', 'Be6'),
+    ('3rr1k1/ppq2pp1/2p1b2p/8/3P2n1/2N3P1/PP3PBP/R2QR1K1 w - - 0 1', None),
+    ('1k6/p7/1p1prrB1/7P/4R3/2P3K1/PP3P2/8 b - - 0 1', None),
+    ('8/1p6/p3pk2/5nR1/8/P3rN2/1P3KP1/8 w - - 0 1', None),
+    ('6rk/p3qp2/1np5/2b1pP2/4P1nr/1BN2Q2/PP3P2/3R1K1R w - - 0 1', None),
+    ('r2qr3/2pp1pkp/b1p3p1/p7/P7/1PnBPQ2/2PN1PPP/R4RK1 w - - 0 1', None),
+    ('8/p6P/R7/2q5/1p1b4/1kp5/5PP1/3Q2K1 b - - 9 44', 'Kc4'),
+    ('2Q5/k7/5B2/2P5/5RK1/6P1/8/8 w - - 1 57', 'Bd4'),
+]
+
+parser = argparse.ArgumentParser(
+    description=__doc__,
+    formatter_class=argparse.RawDescriptionHelpFormatter
+)
+parser.add_argument("--depth", metavar="DEPTH", type=int, default=16,
+                    help="search depth used to generate puzzles")
+parser.add_argument("--threads", metavar="THREADS", type=int, default=1,
+                    help="number of engine threads")
+parser.add_argument("--memory", metavar="MEMORY", type=int, default=256,
+                    help="memory in MB to use for engine hashtables")
+parser.add_argument("--cache", default=False, action="store_true",
+                    help="reuse engine analyses across positions")
+parser.add_argument("--scan", default=False, action="store_true",
+                    help="benchmark the two-stage scan against the full scan instead")
+parser.add_argument("--scan-orders", default=False, action="store_true",
+                    help="benchmark the scan orders and hash policies instead")
+parser.add_argument("--clear-hash", metavar="POLICY", choices=HASH_POLICIES,
+                    default=HASH_POLICY_NEVER,
+                    help="hash policy used to generate puzzles (%s)" % ", ".join(HASH_POLICIES))
+parser.add_argument("--pgn", metavar="PGN", type=str, default=FIXTURES_PGN,
+                    help="PGN games to scan with --scan, --scan-orders and --prefilter")
+parser.add_argument("--scan-depth", metavar="DEPTH", type=int, default=SCAN_DEPTH,
+                    help="depth of the full scan")
+parser.add_argument("--shallow-depth", metavar="DEPTH", type=int, default=SHALLOW_SCAN_DEPTH,
+                    help="depth of the first pass of the two-stage scan")
+parser.add_argument("--scan-margin", metavar="CP", type=int, default=SCAN_MARGIN,
+                    help="safety margin of the two-stage scan")
+parser.add_argument("--deepening", default=False, action="store_true",
+                    help="compare puzzle generation with and without progressive deepening")
+parser.add_argument("--exclusion", default=False, action="store_true",
+                    help="compare puzzle generation with and without exclusion searches")
+parser.add_argument("--mate-lines", default=False, action="store_true",
+                    help="compare puzzle generation with and without following mating lines")
+parser.add_argument("--prefilter", default=False, action="store_true",
+                    help="benchmark the tactical prefilter against full puzzle generation")
+parser.add_argument("--verbose", default=False, action="store_true",
+                    help="log the analysis of each position")
+
+
+def benchmark_generation(settings, **options) -> list:
+    """ Returns the time and output of each position
+        options - options of Puzzle.generate()
+    """
+    print("%-4s %8s %9s %12s  %-8s %s" % ("#", "time", "searches", "nodes", "category", "moves"))
+    total_time = 0.0
+    total_searches = 0
+    total_nodes = 0
+    results = []
+    for i, (fen, move_san) in enumerate(BENCHMARK_POSITIONS):
+        board = Board(fen)
+        puzzle = Puzzle(board, board.parse_san(move_san) if move_san else None)
+        searches = AnalysisEngine.stats.searches
+        nodes = AnalysisEngine.stats.nodes
+        start_time = time.time()
+        puzzle.generate(settings.depth, **options)
+        elapsed = time.time() - start_time
+        searches = AnalysisEngine.stats.searches - searches
+        nodes = AnalysisEngine.stats.nodes - nodes
+        total_time += elapsed
+        total_searches += searches
+        total_nodes += nodes
+        category = puzzle.category() if puzzle.is_complete() else "-"
+        moves = " ".join(str(p.initial_move) for p in puzzle.positions)
+        print("%-4d %7.2fs %9d %12d  %-8s %s" % (i, elapsed, searches, nodes, category, moves))
+        results.append((elapsed, category, moves))
+    print("%-4s %7.2fs %9d %12d" % ("all", total_time, total_searches, total_nodes))
+    return results
+
+
+def benchmark_option(settings, option):
+    """ Generates the puzzles with and without an option of Puzzle.generate(),
+        each time with empty hashtables, and prints the time saved and the
+        puzzles that changed
+    """
+    results = []
+    for enabled in [False, True]:
+        print("\n%s: %s" % (option.replace("_", " ").capitalize(), "on" if enabled else "off"))
+        AnalysisEngine.cache = AnalysisCache(ANALYSIS_CACHE_SIZE if settings.cache else 0)
+        AnalysisEngine.clear_hash()
+        results.append(benchmark_generation(settings, **{option: enabled}))
+    time_off = sum(result[0] for result in results[0])
+    time_on = sum(result[0] for result in results[1])
+    changed = [i for i, (off, on) in enumerate(zip(*results)) if off[1:] != on[1:]]
+    print()
+    print("time saved: %.2fs (%.1f%%)" % (
+        time_off - time_on, 100 * (time_off - time_on) / time_off if time_off else 0.0
+    ))
+    print("changed:    %d of %d puzzles %s" % (
+        len(changed), len(BENCHMARK_POSITIONS), " ".join(str(i) for i in changed)
+    ))
+
+
+def benchmark_scan(settings):
+    """ The two-stage scan runs first on each game, so any warm engine
+        hashtables only favor the full scan
+    """
+    print("%-4s %5s %9s %9s %9s %8s %8s %8s" % (
+        "game", "plies", "searches", "2-stage", "found", "missed", "time", "2-stage"
+    ))
+    totals = {"full_time": 0.0, "cascade_time": 0.0, "full_searches": 0, "cascade_searches": 0,
+              "full_nodes": 0, "cascade_nodes": 0, "candidates": 0, "found": 0, "extra": 0}
+    games = read_pgn_games(pgn_file_paths(settings.pgn), read_mainline_game, chess.pgn.skip_game)
+    for game_id, game in games:
+        if game is None:
+            break
+        cascade = _measure_scan(game, settings.scan_depth, settings.shallow_depth,
+                                settings.scan_margin)
+        full = _measure_scan(game, settings.scan_depth, 0, settings.scan_margin)
+        found = full["candidates"] & cascade["candidates"]
+        missed = full["candidates"] - cascade["candidates"]
+        for mode, result in [("full", full), ("cascade", cascade)]:
+            totals[mode + "_time"] += result["time"]
+            totals[mode + "_searches"] += result["searches"]
+            totals[mode + "_nodes"] += result["nodes"]
+        totals["candidates"] += len(full["candidates"])
+        totals["found"] += len(found)
+        totals["extra"] += len(cascade["candidates"] - full["candidates"])
+        print("%-4d %5d %9d %9d %9d %8s %7.2fs %7.2fs" % (
+            game_id, len(game.moves), full["searches"], cascade["searches"], len(found),
+            ",".join(str(ply) for ply in sorted(missed)) or "-",
+            full["time"], cascade["time"]
+        ))
+    recall = totals["found"] / totals["candidates"] if totals["candidates"] else 1.0
+    speedup = totals["full_time"] / totals["cascade_time"] if totals["cascade_time"] else 0.0
+    print()
+    print("searches: %d full, %d two-stage" % (totals["full_searches"], totals["cascade_searches"]))
+    print("nodes:    %d full, %d two-stage" % (totals["full_nodes"], totals["cascade_nodes"]))
+    print("recall:   %d of %d candidates (%.1f%%), %d not found by the full scan" % (
+        totals["found"], totals["candidates"], 100 * recall, totals["extra"]
+    ))
+    print("speedup:  %.2fx (%.2fs full, %.2fs two-stage)" % (
+        speedup, totals["full_time"], totals["cascade_time"]
+    ))
+
+
+def _measure_scan(game, scan_depth, shallow_depth, margin, reverse=False) -> dict:
+    """ The plies of the candidates found by a scan and what it cost
+    """
+    searches = AnalysisEngine.stats.searches
+    nodes = AnalysisEngine.stats.nodes
+    start_time = time.time()
+    puzzles = find_puzzle_candidates(game, scan_depth, shallow_depth=shallow_depth, margin=margin,
+                                     reverse=reverse)
+    plies = {len(puzzle.initial_board.move_stack) for puzzle in puzzles}
+    return {
+        "candidates": plies,
+        "time": time.time() - start_time,
+        "searches": AnalysisEngine.stats.searches - searches,
+        "nodes": AnalysisEngine.stats.nodes - nodes,
+    }
+
+
+def benchmark_scan_orders(settings):
+    """ Each configuration starts with empty hashtables and scans all the
+        games. The candidates are compared with the first configuration's
+    """
+    games = [game for _, game in read_pgn_games(
+        pgn_file_paths(settings.pgn), read_mainline_game, chess.pgn.skip_game
+    ) if game is not None]
+    print("%-8s %-7s %8s %12s %10s  %s" % ("order", "hash", "time", "nodes", "candidates", "same"))
+    baseline = None
+    for reverse in [False, True]:
+        for hash_policy in [HASH_POLICY_NEVER, HASH_POLICY_GAME]:
+            AnalysisEngine.cache = AnalysisCache(ANALYSIS_CACHE_SIZE if settings.cache else 0)
+            AnalysisEngine.hash_policy = hash_policy
+            AnalysisEngine.clear_hash()
+            results = [_measure_scan(game, settings.scan_depth, 0, settings.scan_margin, reverse)
+                       for game in games]
+            candidates = [result["candidates"] for result in results]
+            if baseline is None:
+                baseline = candidates
+            print("%-8s %-7s %7.2fs %12d %10d  %s" % (
+                "reverse" if reverse else "forward",
+                hash_policy,
+                sum(result["time"] for result in results),
+                sum(result["nodes"] for result in results),
+                sum(len(plies) for plies in candidates),
+                "yes" if candidates == baseline else "no",
+            ))
+
+
+def benchmark_prefilter(settings):
+    """ Generates every candidate regardless of its motifs, so that the
+        candidates the prefilter would drop can be checked for puzzles
+    """
+    puzzles = []
+    for fen, move_san in BENCHMARK_POSITIONS:
+        board = Board(fen)
+        puzzles.append(Puzzle(board, board.parse_san(move_san) if move_san else None))
+    games = read_pgn_games(pgn_file_paths(settings.pgn), read_mainline_game, chess.pgn.skip_game)
+    for _, game in games:
+        if game is None:
+            break
+        puzzles.extend(find_puzzle_candidates(game, settings.scan_depth))
+    print("%-4s %-8s %8s %8s  %s" % ("#", "puzzle", "time", "check", "motifs"))
+    totals = {"kept": 0, "kept_puzzles": 0, "puzzles": 0, "check_time": 0.0,
+              "time": 0.0, "dropped_time": 0.0}
+    for i, puzzle in enumerate(puzzles):
+        start_time = time.time()
+        motifs = check_motifs(puzzle)
+        check_time = time.time() - start_time
+        start_time = time.time()
+        puzzle.generate(settings.depth)
+        elapsed = time.time() - start_time
+        is_puzzle = puzzle.is_complete()
+        totals["check_time"] += check_time
+        totals["time"] += elapsed
+        totals["puzzles"] += is_puzzle
+        if motifs:
+            totals["kept"] += 1
+            totals["kept_puzzles"] += is_puzzle
+        else:
+            totals["dropped_time"] += elapsed
+        print("%-4d %-8s %7.2fs %7.3fs  %s" % (
+            i, "yes" if is_puzzle else "no", elapsed, check_time, ", ".join(motifs) or "-"
+        ))
+    recall = totals["kept_puzzles"] / totals["puzzles"] if totals["puzzles"] else 1.0
+    precision = totals["kept_puzzles"] / totals["kept"] if totals["kept"] else 0.0
+    print()
+    print("recall:    %d of %d puzzles (%.1f%%)" % (
+        totals["kept_puzzles"], totals["puzzles"], 100 * recall
+    ))
+    print("precision: %d of %d candidates kept (%.1f%%), %d dropped" % (
+        totals["kept_puzzles"], totals["kept"], 100 * precision, len(puzzles) - totals["kept"]
+    ))
+    print("time:      %.2fs prefilter, %.2fs of %.2fs generating dropped candidates" % (
+        totals["check_time"], totals["dropped_time"], totals["time"]
+    ))
+
+
+def main():
+    settings = parser.parse_args()
+    configure_logging(level=logging.DEBUG if settings.verbose else logging.INFO)
+    AnalysisEngine.configure(1, {
+        'Threads': settings.threads,
+        'Hash': settings.memory,
+        'Contempt': 0,
+    })
+    AnalysisEngine.cache = AnalysisCache(ANALYSIS_CACHE_SIZE if settings.cache else 0)
+    AnalysisEngine.hash_policy = settings.clear_hash
+    print(AnalysisEngine.name())
+    if settings.scan_orders:
+        benchmark_scan_orders(settings)
+    elif settings.scan:
+        benchmark_scan(settings)
+    elif settings.prefilter:
+        benchmark_prefilter(settings)
+    elif settings.deepening:
+        benchmark_option(settings, "deepening")
+    elif settings.exclusion:
+        benchmark_option(settings, "exclusion")
+    elif settings.mate_lines:
+        benchmark_option(settings, "mate_lines")
+    else:
+        benchmark_generation(settings)
+    AnalysisEngine.quit()
+
+
+if __name__ == "__main__":
+    main()
@@ -5,7 +5,10 @@
 
 import argparse
 import logging
+import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional, Tuple, Union
 
 from chess import Board
 import chess.pgn
@@ -14,8 +17,24 @@ from puzzlemaker.colors import Color
 from puzzlemaker.puzzle import Puzzle
 from puzzlemaker.logger import configure_logging, log
 from puzzlemaker.puzzle_finder import find_puzzle_candidates
-from puzzlemaker.analysis import AnalysisEngine
-from puzzlemaker.constants import SCAN_DEPTH, SEARCH_DEPTH
+from puzzlemaker.analysis import AnalysisEngine, HASH_POLICIES, HASH_POLICY_NEVER
+from puzzlemaker.workers import GameWorkers
+from puzzlemaker.pipeline import PuzzlePipeline
+from puzzlemaker.analysis_cache import AnalysisCache
+from puzzlemaker.analysis_store import AnalysisStore
+from puzzlemaker.tablebase import Tablebase, missing_directories
+from puzzlemaker.opening_book import open_book
+from puzzlemaker.search_limit import SearchLimit
+from puzzlemaker.budget import Budget, BudgetLimit, CandidateQueue, SharedBudget
+from puzzlemaker.tactics import PREFILTER_MODES, prefilter
+from puzzlemaker.pgn_files import pgn_file_paths, unsupported_reason, read_pgn_games, read_game_text
+from puzzlemaker.pgn_reader import MainlineGame, read_mainline_game
+from puzzlemaker.game_filter import GameFilter
+from puzzlemaker.constants import SCAN_DEPTH, SEARCH_DEPTH, ANALYSIS_CACHE_SIZE, ANALYSIS_DB_SIZE
+from puzzlemaker.constants import PREFETCH_PLIES, SHALLOW_SCAN_DEPTH, SCAN_MARGIN
+
+def comma_separated_list(values: str) -> List[str]:
+    return [value.strip() for value in values.split(",") if value.strip()]
 
 parser = argparse.ArgumentParser(
     description=__doc__,
@@ -27,112 +46,464 @@ group = parser.add_mutually_exclusive_group(required=True)
 group.add_argument("--fen", metavar="FEN", type=str,
                     help="A FEN position from which to generate a puzzle")
 group.add_argument("--pgn", metavar="PGN", type=str,
-                    help="A PGN file with games to scan for puzzles")
+                    help="PGN games to scan for puzzles: a file (optionally compressed with "
+                         "gzip, bz2, xz or zstd), a directory or glob of files, or - for stdin")
 
 # Chess engine settings
 group = parser.add_argument_group('chess engine settings')
+group.add_argument("--engines", metavar="ENGINES", nargs="?",
+                    type=int, default=1,
+                    help="number of engines used to generate puzzles concurrently")
 group.add_argument("--threads", metavar="THREADS", nargs="?",
                     type=int, default=2,
-                    help="number of engine threads")
+                    help="number of threads per engine")
 group.add_argument("--memory", metavar="MEMORY", nargs="?",
                     type=int, default=2048,
-                    help="memory in MB to use for engine hashtables")
+                    help="memory in MB to use for each engine's hashtables")
+group.add_argument("--cache-size", metavar="SIZE", type=int,
+                    default=ANALYSIS_CACHE_SIZE,
+                    help="number of engine analyses to keep in memory for reuse (0 to disable)")
+group.add_argument("--analysis-db", metavar="PATH", type=str,
+                    help="SQLite database that keeps engine analyses across runs")
+group.add_argument("--analysis-db-size", metavar="SIZE", type=int,
+                    default=ANALYSIS_DB_SIZE,
+                    help="maximum number of engine analyses to keep in the analysis database")
+group.add_argument("--syzygy-path", metavar="PATH", type=str,
+                    help="directory of Syzygy tablebases, probed instead of searching "
+                         "positions with few enough pieces")
 group.add_argument("--scan-depth", metavar="DEPTH", nargs="?",
                     type=int, default=SCAN_DEPTH,
-                    help="depth for scanning a game for candidate puzzles")
+                    help="depth for scanning a game for candidate puzzles (0 for no depth "
+                         "limit with --scan-nodes or --scan-time). If it's at least the "
+                         "search depth, the best moves found by the scan are reused")
+group.add_argument("--scan-nodes", metavar="NODES", type=int,
+                    help="also stop each scan search after this many nodes")
+group.add_argument("--scan-time", metavar="SECONDS", type=float,
+                    help="also stop each scan search after this many seconds")
+group.add_argument("--shallow-depth", metavar="DEPTH", nargs="?", type=int,
+                    default=0, const=SHALLOW_SCAN_DEPTH,
+                    help="scan every move at this depth first, then only search the moves "
+                         "around the swings it finds at the scan depth")
+group.add_argument("--scan-margin", metavar="CP", type=int, default=SCAN_MARGIN,
+                    help="how far (in centipawns) the --shallow-depth scores may be off "
+                         "without missing a swing")
+group.add_argument("--reverse-scan", default=False, action="store_true",
+                    help="scan each game from its last move to its first, so that the "
+                         "engine's hashtables already hold the positions that follow")
+group.add_argument("--clear-hash", metavar="POLICY", choices=HASH_POLICIES,
+                    default=HASH_POLICY_NEVER,
+                    help="when to clear the engines' hashtables: never, before each game, "
+                         "or before each game and puzzle (%s)" % ", ".join(HASH_POLICIES))
 group.add_argument("--search-depth", metavar="DEPTH", nargs="?",
                     type=int, default=SEARCH_DEPTH,
-                    help="depth for searching a position for candidate moves")
+                    help="depth for searching a position for candidate moves (0 for no depth "
+                         "limit with --search-nodes or --search-time)")
+group.add_argument("--search-nodes", metavar="NODES", type=int,
+                    help="also stop each puzzle search after this many nodes")
+group.add_argument("--search-time", metavar="SECONDS", type=float,
+                    help="also stop each puzzle search after this many seconds")
+group.add_argument("--use-evals", default=False, action="store_true",
+                    help="scan games with their [%%eval] comments (e.g. from Lichess exports) "
+                         "and only search the positions without one")
+group.add_argument("--book", metavar="PATH", type=str,
+                    help="Polyglot opening book. The opening moves of a game that are in it "
+                         "aren't searched by the scan")
+group.add_argument("--book-plies", metavar="PLIES", type=int, default=0,
+                    help="don't search the first PLIES plies of each game when scanning it")
+group.add_argument("--deepening", default=False, action="store_true",
+                    help="search the puzzle positions at increasing depths, so that ambiguous "
+                         "positions are rejected before a search at the full depth")
+group.add_argument("--exclusion-search", default=False, action="store_true",
+                    help="check if a puzzle's moves are ambiguous with a search for the best "
+                         "move and one for the next best move (capped at half its nodes), "
+                         "instead of a multipv 3 search")
+group.add_argument("--mate-lines", default=False, action="store_true",
+                    help="once the player mates by force, fill in the rest of the puzzle from "
+                         "the engine's mating line instead of searching each position")
+group.add_argument("--prefilter", metavar="MODE", choices=PREFILTER_MODES,
+                    help="check the candidates for tactical motifs (hanging pieces, winning "
+                         "captures, checks, mate threats) before generating them, and drop "
+                         "the ones without any or generate them last within a budget "
+                         "(%s)" % ", ".join(PREFILTER_MODES))
+group.add_argument("--prefetch", metavar="PLIES", nargs="?", type=int,
+                    default=0, const=PREFETCH_PLIES,
+                    help="analyze this many plies of the engine's predicted line ahead of "
+                         "time with the spare engines when generating a puzzle from --fen")
+
+# Budgets, checked between searches
+group = parser.add_argument_group('budgets')
+group.add_argument("--candidate-time", metavar="SECONDS", type=float,
+                    help="abandon a candidate puzzle after this many seconds")
+group.add_argument("--candidate-nodes", metavar="NODES", type=int,
+                    help="abandon a candidate puzzle after searching this many nodes")
+group.add_argument("--game-time", metavar="SECONDS", type=float,
+                    help="end the scan and skip the remaining candidates of a game after "
+                         "this many seconds, including its scan. Candidates with the largest swings are "
+                         "generated first")
+group.add_argument("--game-nodes", metavar="NODES", type=int,
+                    help="end the scan and skip the remaining candidates of a game after "
+                         "searching this many nodes, including its scan. Candidates with the largest swings are "
+                         "generated first")
+group.add_argument("--run-time", metavar="SECONDS", type=float,
+                    help="stop scanning games and skip the remaining candidates after this "
+                         "many seconds")
+group.add_argument("--run-nodes", metavar="NODES", type=int,
+                    help="stop scanning games and skip the remaining candidates after "
+                         "searching this many nodes")
+
+# Game filters, checked from the PGN headers before a game's moves are read
+group = parser.add_argument_group('game filters')
+group.add_argument("--min-elo", metavar="ELO", type=int,
+                    help="skip games with a player rated below ELO")
+group.add_argument("--max-elo", metavar="ELO", type=int,
+                    help="skip games with a player rated above ELO")
+group.add_argument("--time-controls", metavar="TIME_CONTROLS", type=comma_separated_list,
+                    help="only scan games with these time controls or categories "
+                         "(e.g. blitz,rapid,classical,correspondence or 300+3)")
+group.add_argument("--variants", metavar="VARIANTS", type=comma_separated_list,
+                    help="only scan games of these variants (e.g. standard,chess960)")
+group.add_argument("--terminations", metavar="TERMINATIONS", type=comma_separated_list,
+                    help="only scan games with these terminations (e.g. normal,\"time forfeit\")")
+group.add_argument("--min-plies", metavar="PLIES", type=int, default=0,
+                    help="skip games with fewer moves (half-moves)")
 
 # Misc settings
 parser.add_argument("--start-index", metavar="INDEX", type=int, default=0,
                     help="Start at the n-th game in a PGN (starting at 0)")
+parser.add_argument("--end-index", metavar="INDEX", type=int,
+                    help="Stop before the n-th game in a PGN")
+parser.add_argument("--game-ids", metavar="IDS", type=lambda ids: [int(i) for i in ids.split(",")],
+                    help="Only process these games of a PGN (comma-separated indexes, "
+                         "processed in order)")
 parser.add_argument("--quiet", default=False, action="store_true",
                     help="substantially reduce the number of logged messages")
 parser.add_argument("--scan-only", default=False, action="store_true",
                     help="Only scan for possible puzzles. Don't analyze positions")
+parser.add_argument("--workers", metavar="WORKERS", type=int, default=0,
+                    help="Process the games of a PGN in this many worker processes, "
+                         "each with its own engine")
+parser.add_argument("--pipeline", default=False, action="store_true",
+                    help="Parse, scan and generate puzzles in concurrent stages. "
+                         "One engine scans while the others generate puzzles")
 
-if len(sys.argv) < 2:
-    parser.print_usage()
-    sys.exit(0)
-
-settings = parser.parse_args()
-try:
-    # Optionally fix colors on Windows and in journals if the colorama module
-    # is available.
-    import colorama
-    wrapper = colorama.AnsiToWin32(sys.stdout)
-    if wrapper.should_wrap():
-        sys.stdout = wrapper.stream
-except ImportError:
-    pass
-
-engine = AnalysisEngine.instance()
-engine.configure({
-  'Threads': settings.threads,
-  'Hash': settings.memory,
-  'Contempt': 0,
-})
-
-if settings.quiet:
-    configure_logging(level=logging.INFO)
-else:
-    configure_logging(level=logging.DEBUG)
 
 def print_puzzle_pgn(puzzle, pgn_headers=None):
-    puzzle_pgn = puzzle.to_pgn(pgn_headers=pgn_headers)
+    print_pgn(puzzle.to_pgn(pgn_headers=pgn_headers))
+
+def print_pgn(puzzle_pgn):
     log(Color.MAGENTA, "NEW PUZZLE GENERATED\n")
     print(Color.CYAN + puzzle_pgn + "\n\n" + Color.ENDC)
 
+def generate_options(settings) -> dict:
+    """ Options of Puzzle.generate() besides the search depth
+    """
+    return {
+        "deepening": settings.deepening,
+        "exclusion": settings.exclusion_search,
+        "mate_lines": settings.mate_lines,
+    }
 
-# load a FEN and try to create a puzzle from it
+def settings_limit(depth, nodes, time) -> Union[int, SearchLimit]:
+    """ The search limit of a phase from its settings. A plain depth unless
+        nodes or time are limited too, and a depth of 0 means no depth limit
+    """
+    if nodes is None and time is None:
+        return depth
+    return SearchLimit(depth or None, nodes, time)
 
-if settings.fen:
-    log(Color.DIM, AnalysisEngine.name())
-    puzzle = Puzzle(Board(settings.fen))
-    puzzle.generate(depth=settings.search_depth)
-    if puzzle.is_complete():
-        print_puzzle_pgn(puzzle)
-    engine.quit()
-    exit(0)
+def budget_limits(settings) -> Tuple[BudgetLimit, BudgetLimit, BudgetLimit]:
+    """ The candidate, game and run budget limits
+    """
+    return (
+        BudgetLimit(settings.candidate_time, settings.candidate_nodes),
+        BudgetLimit(settings.game_time, settings.game_nodes),
+        BudgetLimit(settings.run_time, settings.run_nodes),
+    )
 
+def generate_candidate(candidates: CandidateQueue, depth, options,
+                       candidate_limit: BudgetLimit) -> Optional[int]:
+    """ Generates the next candidate of the queue, and returns its index
+        None if the queue is empty or over budget
+    """
+    i = candidates.next()
+    if i is None:
+        return None
+    log(Color.MAGENTA, "\nConsidering position %d of %d..." % (i+1, len(candidates.puzzles)))
+    budget = candidate_limit.start()
+    with AnalysisEngine.checkout(), AnalysisEngine.charging(candidates.budgets + [budget]):
+        candidates.puzzles[i].generate(depth, budget=budget, **options)
+    return i
 
-# load games from a PGN and scan them for puzzles
+def within_budget(games: Iterator, run_budget: Budget) -> Iterator:
+    """ yields games until the run budget is exhausted
+    """
+    for game in games:
+        if run_budget.is_exhausted():
+            log(Color.YELLOW, "Out of budget, not reading more games: %s" % run_budget)
+            return
+        yield game
 
-n_positions = 0   # number of positions considered
-n_puzzles = 0     # number of puzzles generated
-game_id = 0
-pgn = open(settings.pgn, "r")
+def log_summary(n_puzzles, n_positions, n_games, n_over_budget=0, failed_games=()):
+    log(
+        Color.MAGENTA,
+        "\nGenerated %d puzzles from %d positions in %d games" % (n_puzzles, n_positions, n_games)
+    )
+    if n_over_budget:
+        log(Color.YELLOW, "%d candidates were skipped or abandoned over budget" % n_over_budget)
+    if failed_games:
+        log(Color.RED, "Gave up on %d games: %s" % (
+            len(failed_games), " ".join(str(game_id) for game_id in failed_games)
+        ))
+    log(Color.DIM, "Engine: %s" % AnalysisEngine.stats)
+    log(Color.DIM, "Analysis cache: %s" % AnalysisEngine.cache.stats())
+    if AnalysisEngine.store:
+        log(Color.DIM, "Analysis database: %s" % AnalysisEngine.store.stats())
+    if AnalysisEngine.tablebase:
+        log(Color.DIM, "Tablebase: %s" % AnalysisEngine.tablebase.stats())
 
-while game_id < settings.start_index:
-    game = chess.pgn.read_game(pgn)
-    if game == None:
-        exit(0)
-    game_id += 1
-
-log(Color.DIM, AnalysisEngine.name())
-while True:
-    game = chess.pgn.read_game(pgn)
-    if game == None:
-        break
-    log(Color.MAGENTA, "\nGame index: %d" % game_id)
-    log(Color.DARK_BLUE, str(game))
-    puzzles = find_puzzle_candidates(game, scan_depth=settings.scan_depth)
-    n = len(puzzles)
-    log(Color.YELLOW, "# positions to consider: %d" % n)
-    if settings.scan_only:
-        continue
-    for i, puzzle in enumerate(puzzles):
-        log(Color.MAGENTA, "\nConsidering position %d of %d..." % (i+1, n))
-        puzzle.generate(settings.search_depth)
+def game_filter(settings) -> Optional[GameFilter]:
+    game_filter = GameFilter(
+        min_elo=settings.min_elo,
+        max_elo=settings.max_elo,
+        time_controls=settings.time_controls,
+        variants=settings.variants,
+        terminations=settings.terminations,
+        min_plies=settings.min_plies,
+    )
+    return game_filter if game_filter.is_active() else None
+
+def read_games(settings, pgn_paths) -> Iterator[Tuple[int, MainlineGame]]:
+    """ yields the headers and mainline of the selected games with their index
+        Games rejected by the game filters are skipped
+    """
+    selected_filter = game_filter(settings)
+    games = read_pgn_games(
+        pgn_paths,
+        lambda pgn: read_mainline_game(pgn, settings.use_evals, selected_filter),
+        chess.pgn.skip_game,
+        settings.start_index, settings.end_index, settings.game_ids
+    )
+    for game_id, game in games:
+        if game.rejected:
+            log(Color.DIM, "Skipping game %d: %s" % (game_id, game.rejected))
+            continue
+        yield game_id, game
+
+def read_game_pgns(settings, pgn_paths) -> Iterator[Tuple[int, str]]:
+    """ yields the PGN text of the selected games with their index,
+        without parsing the games
+    """
+    return read_pgn_games(
+        pgn_paths, read_game_text, read_game_text,
+        settings.start_index, settings.end_index, settings.game_ids
+    )
+
+
+def main():
+    if len(sys.argv) < 2:
+        parser.print_usage()
+        sys.exit(0)
+
+    settings = parser.parse_args()
+    settings.scan_limit = settings_limit(
+        settings.scan_depth, settings.scan_nodes, settings.scan_time
+    )
+    settings.search_limit = settings_limit(
+        settings.search_depth, settings.search_nodes, settings.search_time
+    )
+    for phase, limit in (("scan", settings.scan_limit), ("search", settings.search_limit)):
+        if not limit:
+            parser.error("--%s-depth 0 needs --%s-nodes or --%s-time" % (phase, phase, phase))
+    try:
+        # Optionally fix colors on Windows and in journals if the colorama module
+        # is available.
+        import colorama
+        wrapper = colorama.AnsiToWin32(sys.stdout)
+        if wrapper.should_wrap():
+            sys.stdout = wrapper.stream
+    except ImportError:
+        pass
+
+    engine_options = {
+      'Threads': settings.threads,
+      'Hash': settings.memory,
+      'Contempt': 0,
+    }
+    n_engines = settings.engines
+    if settings.pipeline:
+        # the scan stage needs an engine of its own
+        n_engines = max(2, n_engines)
+    AnalysisEngine.configure(n_engines, engine_options)
+    AnalysisEngine.cache = AnalysisCache(settings.cache_size)
+    AnalysisEngine.hash_policy = settings.clear_hash
+    if settings.analysis_db:
+        AnalysisEngine.store = AnalysisStore(settings.analysis_db, settings.analysis_db_size)
+    if settings.syzygy_path:
+        if missing_directories(settings.syzygy_path):
+            parser.error("%s doesn't exist" % ", ".join(missing_directories(settings.syzygy_path)))
+        AnalysisEngine.tablebase = Tablebase(settings.syzygy_path)
+
+    if settings.quiet:
+        log_level = logging.INFO
+    else:
+        log_level = logging.DEBUG
+    configure_logging(level=log_level)
+
+
+    # load a FEN and try to create a puzzle from it
+
+    candidate_limit, game_limit, run_limit = budget_limits(settings)
+
+    if settings.fen:
+        log(Color.DIM, AnalysisEngine.name())
+        puzzle = Puzzle(Board(settings.fen))
+        budget = candidate_limit.start()
+        with AnalysisEngine.charging([budget]):
+            puzzle.generate(depth=settings.search_limit, prefetch_plies=settings.prefetch,
+                            budget=budget, **generate_options(settings))
         if puzzle.is_complete():
-            print_puzzle_pgn(puzzle, pgn_headers=game.headers)
-            n_puzzles += 1
-    game_id += 1
-    n_positions += n
-
-log(
-    Color.MAGENTA,
-    "\nGenerated %d puzzles from %d positions in %d games" % (n_puzzles, n_positions, game_id)
-)
-AnalysisEngine.quit()
+            print_puzzle_pgn(puzzle)
+        AnalysisEngine.quit()
+        exit(0)
+
+
+    # load games from a PGN and scan them for puzzles
+
+    pgn_paths = pgn_file_paths(settings.pgn)
+    if not pgn_paths:
+        parser.error("no PGN files found for %s" % settings.pgn)
+    for pgn_path in pgn_paths:
+        if unsupported_reason(pgn_path):
+            parser.error(unsupported_reason(pgn_path))
+    if settings.book and not os.path.isfile(settings.book):
+        parser.error("%s doesn't exist" % settings.book)
+
+    n_positions = 0   # number of positions considered
+    n_puzzles = 0     # number of puzzles generated
+    n_games = 0       # number of games scanned
+    n_over_budget = 0 # number of candidates skipped or abandoned over budget
+
+    if settings.workers:
+        # each worker process scans and generates whole games with its own
+        # engine. Results are printed in the same order as the games. The
+        # workers spend the run budget from shared memory
+        run_budget = SharedBudget(run_limit)
+        workers = GameWorkers(
+            settings.workers,
+            engine_options,
+            scan_depth=settings.scan_limit,
+            search_depth=settings.search_limit,
+            scan_only=settings.scan_only,
+            cache_size=settings.cache_size,
+            analysis_db=settings.analysis_db,
+            analysis_db_size=settings.analysis_db_size,
+            syzygy_path=settings.syzygy_path,
+            log_level=log_level,
+            game_filter=game_filter(settings),
+            use_evals=settings.use_evals,
+            shallow_depth=settings.shallow_depth,
+            scan_margin=settings.scan_margin,
+            reverse_scan=settings.reverse_scan,
+            book_path=settings.book,
+            book_plies=settings.book_plies,
+            hash_policy=settings.clear_hash,
+            generate_options=generate_options(settings),
+            prefilter_mode=settings.prefilter,
+            candidate_limit=candidate_limit,
+            game_limit=game_limit,
+            run_budget=run_budget,
+        )
+        failed_games = [] # ids of the games given up on after crashes or errors
+        games = within_budget(read_game_pgns(settings, pgn_paths), run_budget)
+        for result in workers.process(games):
+            if result.counters:
+                AnalysisEngine.add_counters(result.counters)
+            if result.rejected:
+                continue
+            if result.failed:
+                failed_games.append(result.game_id)
+                continue
+            for puzzle_pgn in result.puzzle_pgns:
+                print_pgn(puzzle_pgn)
+                n_puzzles += 1
+            n_positions += result.n_positions
+            n_over_budget += result.n_over_budget
+            n_games += 1
+        log_summary(n_puzzles, n_positions, n_games, n_over_budget, failed_games)
+        return
+
+    log(Color.DIM, AnalysisEngine.name())
+    run_budget = run_limit.start()
+
+    if settings.pipeline and not settings.scan_only:
+        pipeline = PuzzlePipeline(
+            scan_depth=settings.scan_limit,
+            search_depth=settings.search_limit,
+            n_generators=n_engines - 1,
+            use_evals=settings.use_evals,
+            shallow_depth=settings.shallow_depth,
+            scan_margin=settings.scan_margin,
+            reverse_scan=settings.reverse_scan,
+            book=open_book(settings.book, settings.book_plies),
+            generate_options=generate_options(settings),
+            prefilter_mode=settings.prefilter,
+            run_budget=run_budget,
+            game_limit=game_limit,
+            candidate_limit=candidate_limit,
+        )
+        games = within_budget(read_games(settings, pgn_paths), run_budget)
+        for game_id, game, puzzles in pipeline.process(games):
+            for puzzle in puzzles:
+                if puzzle.is_complete():
+                    print_puzzle_pgn(puzzle, pgn_headers=game.headers)
+                    n_puzzles += 1
+            n_positions += len(puzzles)
+            n_over_budget += sum(puzzle.over_budget for puzzle in puzzles)
+            n_games += 1
+        log_summary(n_puzzles, n_positions, n_games, n_over_budget)
+        AnalysisEngine.quit()
+        return
+
+    book = open_book(settings.book, settings.book_plies)
+    executor = ThreadPoolExecutor(max_workers=settings.engines)
+    for game_id, game in within_budget(read_games(settings, pgn_paths), run_budget):
+        log(Color.MAGENTA, "\nGame index: %d" % game_id)
+        log(Color.DARK_BLUE, str(game))
+        budgets = [run_budget, game_limit.start()]
+        with AnalysisEngine.checkout(), AnalysisEngine.charging(budgets):
+            puzzles = find_puzzle_candidates(
+                game,
+                scan_depth=settings.scan_limit,
+                use_evals=settings.use_evals,
+                shallow_depth=settings.shallow_depth,
+                margin=settings.scan_margin,
+                reverse=settings.reverse_scan,
+                book=book,
+            )
+        puzzles = list(prefilter(puzzles, settings.prefilter))
+        n = len(puzzles)
+        log(Color.YELLOW, "# positions to consider: %d" % n)
+        n_games += 1
+        n_positions += n
+        if settings.scan_only:
+            continue
+        # candidates are generated concurrently, one per engine in the pool,
+        # most promising first if there's a budget. They're printed in the
+        # order they were found
+        candidates = CandidateQueue(puzzles, budgets)
+        generated = executor.map(
+            generate_candidate, [candidates] * n, [settings.search_limit] * n,
+            [generate_options(settings)] * n, [candidate_limit] * n
+        )
+        for i in sorted(i for i in generated if i is not None):
+            if puzzles[i].is_complete():
+                print_puzzle_pgn(puzzles[i], pgn_headers=game.headers)
+                n_puzzles += 1
+        n_over_budget += sum(puzzle.over_budget for puzzle in puzzles)
+
+    log_summary(n_puzzles, n_positions, n_games, n_over_budget)
+    executor.shutdown()
+    AnalysisEngine.quit()
+
+if __name__ == "__main__":
+    main()
@@ -1,84 +1,426 @@
-from typing import List, Optional, Union
+from typing import Dict, Iterator, List, Optional, Union
 from collections import namedtuple
+from contextlib import contextmanager
 import glob
+import queue
 import shutil
+import threading
+import time
 
-from chess.engine import SimpleEngine, Limit, Score, EngineTerminatedError, InfoDict
+from chess import Move
+from chess.engine import SimpleEngine, Score, EngineTerminatedError, InfoDict
 
 from puzzlemaker.fishnet import stockfish_command
+from puzzlemaker.analysis_cache import AnalysisCache
+from puzzlemaker.analysis_store import AnalysisStore
+from puzzlemaker.tablebase import Tablebase
+from puzzlemaker.budget import Budget
+from puzzlemaker.search_limit import SearchLimit, search_limit, reached_limit
 from puzzlemaker.logger import log
 from puzzlemaker.colors import Color
 from puzzlemaker.utils import sign
 
-AnalyzedMove = namedtuple("AnalyzedMove", ["move", "move_san", "score"])
+# when the hashtables of an engine are cleared: never, before scanning each
+# game, or before scanning each game and generating each puzzle
+HASH_POLICY_NEVER = "never"
+HASH_POLICY_GAME = "game"
+HASH_POLICY_PUZZLE = "puzzle"
+HASH_POLICIES = [HASH_POLICY_NEVER, HASH_POLICY_GAME, HASH_POLICY_PUZZLE]
+
+# UCI button that clears the hashtables of Stockfish
+CLEAR_HASH_OPTION = "Clear Hash"
+
+# (attribute of AnalysisEngine, counter) of the searches and lookups that
+# are added up across processes (see AnalysisEngine.counters)
+COUNTERS = [
+    ("stats", "searches"), ("stats", "nodes"), ("stats", "capped"),
+    ("cache", "hits"), ("cache", "misses"), ("cache", "time_saved"),
+    ("store", "hits"), ("store", "misses"),
+    ("tablebase", "hits"), ("tablebase", "misses"),
+]
+
+# pv - the principal variation starting with the move, if known
+# reached [SearchLimit] - the depth, nodes and time the search reached, if known
+AnalyzedMove = namedtuple("AnalyzedMove", ["move", "move_san", "score", "pv", "reached"],
+                          defaults=[None, None])
+
+
+class SearchStats(object):
+    """ Counts the searches run by the engines, and the searches that ran
+        out of nodes or time before their depth
+    """
+    def __init__(self):
+        self.searches = 0
+        self.nodes = 0
+        self.capped = 0
+        self._lock = threading.Lock()
+
+    def add(self, info: Union[List[InfoDict], InfoDict], capped=False):
+        with self._lock:
+            self.searches += 1
+            self.nodes += _searched_nodes(info)
+            if capped:
+                self.capped += 1
+
+    def __str__(self) -> str:
+        if self.capped:
+            return "%d searches (%d stopped before their depth), %d nodes" % (
+                self.searches, self.capped, self.nodes
+            )
+        return "%d searches, %d nodes" % (self.searches, self.nodes)
+
+
+class EnginePool(object):
+    """ A fixed number of analysis engines that can be checked out by
+        concurrent callers. Engines are started lazily and each one is
+        configured with the same options (e.g. Threads, Hash)
+    """
+    def __init__(self, size=1, options=None):
+        self.size = size
+        self.options = options or {}
+        self._name = None
+        self._engines: List[SimpleEngine] = []
+        self._idle: queue.Queue = queue.Queue()
+        self._lock = threading.Lock()
+
+    def _start_engine(self) -> SimpleEngine:
+        engine = SimpleEngine.popen_uci(_stockfish_command())
+        if self.options:
+            engine.configure(self.options)
+        if not self._name:
+            self._name = engine.id["name"]
+        return engine
+
+    def checkout(self, block=True) -> Optional[SimpleEngine]:
+        """ Blocks until an engine is available
+            Returns None instead of blocking if block is False
+        """
+        with self._lock:
+            if self._idle.empty() and len(self._engines) < self.size:
+                engine = self._start_engine()
+                self._engines.append(engine)
+                return engine
+        try:
+            return self._idle.get(block)
+        except queue.Empty:
+            return None
+
+    def checkin(self, engine: SimpleEngine):
+        with self._lock:
+            if engine not in self._engines:
+                # the pool was shut down while this engine was checked out
+                return
+        self._idle.put(engine)
+
+    def replace(self, engine: SimpleEngine) -> SimpleEngine:
+        """ Replaces a checked out engine that crashed with a new one
+        """
+        _quit_engine(engine)
+        with self._lock:
+            if engine in self._engines:
+                self._engines.remove(engine)
+            new_engine = self._start_engine()
+            self._engines.append(new_engine)
+        return new_engine
+
+    def name(self) -> str:
+        if not self._name:
+            engine = self.checkout()
+            self.checkin(engine)
+        return self._name
+
+    def quit(self):
+        with self._lock:
+            engines = self._engines
+            self._engines = []
+            self._idle = queue.Queue()
+        for engine in engines:
+            _quit_engine(engine)
 
 
 class AnalysisEngine(object):
     """ Light wrapper around chess.engine
+
+        Engines are kept in a pool. Each thread analyzes positions with the
+        engine it has checked out, so several threads can analyze at once
+
+        Results are cached, so positions analyzed more than once (e.g. by the
+        scan and then by puzzle generation) are only searched once. An
+        optional analysis store keeps results across runs
+
+        Engines keep their hashtables from one search to the next unless
+        the hash policy clears them (see HASH_POLICIES)
+
+        Positions covered by the optional Syzygy tablebase are probed
+        instead of searched
     """
-    engine: SimpleEngine = None
+    pool: EnginePool = EnginePool()
+    cache: AnalysisCache = AnalysisCache()
+    stats: SearchStats = SearchStats()
+    store: Optional[AnalysisStore] = None
+    tablebase: Optional[Tablebase] = None
+    hash_policy: str = HASH_POLICY_NEVER
+    _local = threading.local()
+
+    @staticmethod
+    def configure(size=1, options=None):
+        """ Replaces the engine pool with a pool of `size` engines
+            options [dict] - UCI options for each engine (e.g. Threads, Hash)
+        """
+        AnalysisEngine.quit()
+        AnalysisEngine.pool = EnginePool(size, options)
 
     @staticmethod
     def instance() -> SimpleEngine:
-        if not AnalysisEngine.engine:
-            AnalysisEngine.engine = SimpleEngine.popen_uci(_stockfish_command())
-        return AnalysisEngine.engine
+        """ The engine checked out by the current thread. A thread that
+            didn't check out an engine keeps the first one it's given
+        """
+        engine = getattr(AnalysisEngine._local, "engine", None)
+        if not engine:
+            engine = AnalysisEngine.pool.checkout()
+            AnalysisEngine._local.engine = engine
+        return engine
+
+    @staticmethod
+    @contextmanager
+    def checkout(block=True) -> Iterator[Optional[SimpleEngine]]:
+        """ Checks out an engine for the current thread and returns it to
+            the pool afterwards. If block is False and no engine is
+            available, yields None instead of waiting
+
+            with AnalysisEngine.checkout():
+                puzzle.generate(depth)
+        """
+        if getattr(AnalysisEngine._local, "engine", None):
+            yield AnalysisEngine._local.engine
+            return
+        pool = AnalysisEngine.pool
+        AnalysisEngine._local.engine = pool.checkout(block)
+        if not AnalysisEngine._local.engine:
+            yield None
+            return
+        try:
+            yield AnalysisEngine._local.engine
+        finally:
+            pool.checkin(AnalysisEngine._local.engine)
+            AnalysisEngine._local.engine = None
+
+    @staticmethod
+    @contextmanager
+    def charging(budgets: List[Budget]) -> Iterator[None]:
+        """ Spends the nodes searched by the current thread from these
+            budgets, on top of the budgets it's already charging
+
+            with AnalysisEngine.charging([game_budget]):
+                puzzle.generate(depth)
+        """
+        charged = getattr(AnalysisEngine._local, "budgets", [])
+        AnalysisEngine._local.budgets = charged + budgets
+        try:
+            yield
+        finally:
+            AnalysisEngine._local.budgets = charged
+
+    @staticmethod
+    def counters() -> Dict[str, float]:
+        """ The counters of the searches and of the cache, store and
+            tablebase lookups so far, e.g. {"cache.hits": 12, ...}
+        """
+        counters = {}
+        for name, counter in COUNTERS:
+            counted = getattr(AnalysisEngine, name)
+            if counted is not None:
+                counters["%s.%s" % (name, counter)] = getattr(counted, counter)
+        return counters
+
+    @staticmethod
+    def add_counters(counters: Dict[str, float]):
+        """ Adds the counters of another process (see counters()), e.g.
+            those of a worker process, to the counters of this one
+        """
+        for name, counter in COUNTERS:
+            counted = getattr(AnalysisEngine, name)
+            key = "%s.%s" % (name, counter)
+            if counted is not None and key in counters:
+                setattr(counted, counter, getattr(counted, counter) + counters[key])
+
+    @staticmethod
+    def exhausted_budget() -> Optional[Budget]:
+        """ A budget the current thread is charging that's exhausted, if any
+        """
+        for budget in getattr(AnalysisEngine._local, "budgets", []):
+            if budget.is_exhausted():
+                return budget
+        return None
 
     @staticmethod
     def name() -> str:
-        return AnalysisEngine.instance().id["name"]
+        engine = getattr(AnalysisEngine._local, "engine", None)
+        if engine:
+            return engine.id["name"]
+        return AnalysisEngine.pool.name()
 
     @staticmethod
     def quit():
-        if not AnalysisEngine.engine:
-            return
-        try:
-            AnalysisEngine.engine.quit()
-        except:
-            pass
-        AnalysisEngine.engine = None
+        AnalysisEngine._local.engine = None
+        AnalysisEngine.pool.quit()
 
     @staticmethod
-    def best_move(board, depth) -> AnalyzedMove:
-        info = AnalysisEngine._analyze(board, depth)
-        score = info["score"].white()
-        if not info.get("pv"):
-            return AnalyzedMove(None, None, score)
-        best_move = info["pv"][0]
-        return AnalyzedMove(best_move, board.san(best_move), score)
+    def new_game():
+        """ Called before scanning a game. Clears the hashtables of the
+            current thread's engine if the hash policy says so
+        """
+        if AnalysisEngine.hash_policy in [HASH_POLICY_GAME, HASH_POLICY_PUZZLE]:
+            AnalysisEngine.clear_hash()
 
     @staticmethod
-    def best_moves(board, depth, multipv=3) -> List[AnalyzedMove]:
-        best_moves = []
-        infos = AnalysisEngine._analyze(board, depth, multipv=multipv)
-        for info in infos:
-            move = info["pv"][0]
-            score = info["score"].white()
-            best_moves.append(AnalyzedMove(move, board.san(move), score))
-        return best_moves
+    def new_puzzle():
+        """ Called before generating a puzzle. Clears the hashtables of the
+            current thread's engine if the hash policy says so
+        """
+        if AnalysisEngine.hash_policy == HASH_POLICY_PUZZLE:
+            AnalysisEngine.clear_hash()
 
     @staticmethod
-    def evaluate_move(board, move, depth) -> AnalyzedMove:
-        info = AnalysisEngine._analyze(board, depth, root_moves=[move])
-        assert move == info["pv"][0]
-        score = info["score"].white()
-        return AnalyzedMove(move, board.san(move), score)
+    def clear_hash():
+        """ Clears the hashtables of the current thread's engine, if it
+            supports it (e.g. Stockfish's Clear Hash option)
+        """
+        engine = AnalysisEngine.instance()
+        if CLEAR_HASH_OPTION in engine.options:
+            engine.configure({CLEAR_HASH_OPTION: None})
+
+    @staticmethod
+    def best_move(board, limit, mate=None) -> AnalyzedMove:
+        """ limit - a depth or a SearchLimit
+            mate - also stop the search once a mate in this many moves is found
+        """
+        return _best_move(board, AnalysisEngine._analyze(board, limit, mate))
+
+    @staticmethod
+    def best_moves(board, limit, multipv=3) -> List[AnalyzedMove]:
+        return _best_moves(board, AnalysisEngine._analyze(board, limit, multipv=multipv))
+
+    @staticmethod
+    def evaluate_move(board, move, limit) -> AnalyzedMove:
+        info = AnalysisEngine._analyze(board, limit, root_moves=[move])
+        return _evaluated_move(board, move, info)
+
+    @staticmethod
+    def best_move_excluding(board, limit, excluded_moves, mate=None) -> Optional[AnalyzedMove]:
+        """ The best move other than the excluded ones, from a search
+            restricted to the other moves. None if there are no other moves
+        """
+        root_moves = _other_moves(board, excluded_moves)
+        if not root_moves:
+            return None
+        info = AnalysisEngine._analyze(board, limit, mate, root_moves=root_moves)
+        return _best_move(board, info)
+
+    @staticmethod
+    def score(board, limit) -> Score:
+        return AnalysisEngine.best_move(board, limit).score
+
+    @staticmethod
+    def _analyze(board, limit, mate=None, **kwargs) -> Union[List[InfoDict], InfoDict]:
+        info = AnalysisEngine._probe_tablebase(board, **kwargs)
+        if info is not None:
+            return info
+        limit = search_limit(limit)
+        if mate:
+            # a search that stopped at a mate isn't as deep as its depth,
+            # so it isn't cached
+            return AnalysisEngine._search(board, limit, mate, **kwargs)
+        key = AnalysisCache.key(board, AnalysisEngine.pool.name(), **kwargs)
+        info = AnalysisEngine._cached_analysis(key, limit)
+        if info is None:
+            start_time = time.time()
+            info = AnalysisEngine._search(board, limit, **kwargs)
+            AnalysisEngine._cache_analysis(key, limit, info, time.time() - start_time)
+        return info
 
     @staticmethod
-    def score(board, depth) -> Score:
-        return AnalysisEngine.best_move(board, depth).score
+    def _probe_tablebase(board, **kwargs) -> Optional[Union[List[InfoDict], InfoDict]]:
+        """ The tablebase result of a position, if it's covered
+        """
+        if AnalysisEngine.tablebase:
+            return AnalysisEngine.tablebase.analyse(board, **kwargs)
+        return None
+
+    @staticmethod
+    def _cached_analysis(key, limit: SearchLimit) -> Optional[Union[List[InfoDict], InfoDict]]:
+        """ Looks for a result in the in-memory cache, then in the analysis
+            store. Results from the store are cached with the depth they
+            were stored with
+        """
+        info = AnalysisEngine.cache.get(key, limit)
+        if info is None and AnalysisEngine.store:
+            entry = AnalysisEngine.store.get_entry(key, limit)
+            if entry is not None:
+                depth, info = entry
+                AnalysisEngine.cache.put(key, depth, info)
+        return info
 
     @staticmethod
-    def _analyze(board, depth, **kwargs) -> Union[List[InfoDict], InfoDict]:
+    def _cache_analysis(key, limit: SearchLimit, info, search_time):
+        """ Results are cached with the depth they're known to have
+            reached, which is less than the limit's depth if they ran out
+            of nodes or time first
+        """
+        depth = limit.reached_depth(info)
+        AnalysisEngine.cache.put(key, depth, info, search_time)
+        if AnalysisEngine.store:
+            AnalysisEngine.store.put(key, depth, info)
+
+    @staticmethod
+    def _search(board, limit: SearchLimit, mate=None, **kwargs) -> Union[List[InfoDict], InfoDict]:
         try:
-            info = AnalysisEngine.instance().analyse(board, Limit(depth=depth), **kwargs)
+            info = AnalysisEngine.instance().analyse(board, limit.engine_limit(mate), **kwargs)
         except EngineTerminatedError:
             log(Color.RED, "Analysis engine crashed... restarting")
-            AnalysisEngine.quit()
-            info = AnalysisEngine._analyze(board, depth, **kwargs)
+            AnalysisEngine._local.engine = AnalysisEngine.pool.replace(AnalysisEngine.instance())
+            return AnalysisEngine._search(board, limit, mate, **kwargs)
+        AnalysisEngine.stats.add(info, _stopped_before_depth(limit, info))
+        for budget in getattr(AnalysisEngine._local, "budgets", []):
+            budget.spend(_searched_nodes(info))
         return info
 
 
+def _best_move(board, info: InfoDict) -> AnalyzedMove:
+    score = info["score"].white()
+    if not info.get("pv"):
+        return AnalyzedMove(None, None, score, reached=reached_limit(info))
+    best_move = info["pv"][0]
+    return AnalyzedMove(best_move, board.san(best_move), score, info["pv"], reached_limit(info))
+
+def _best_moves(board, infos: List[InfoDict]) -> List[AnalyzedMove]:
+    best_moves = []
+    for info in infos:
+        move = info["pv"][0]
+        score = info["score"].white()
+        best_moves.append(AnalyzedMove(move, board.san(move), score, info["pv"], reached_limit(info)))
+    return best_moves
+
+def _other_moves(board, excluded_moves) -> List[Move]:
+    return [move for move in board.legal_moves if move not in excluded_moves]
+
+def _evaluated_move(board, move, info: InfoDict) -> AnalyzedMove:
+    assert move == info["pv"][0]
+    score = info["score"].white()
+    return AnalyzedMove(move, board.san(move), score, info["pv"], reached_limit(info))
+
+def _searched_nodes(info: Union[List[InfoDict], InfoDict]) -> int:
+    if isinstance(info, list):
+        info = info[0] if info else {}
+    return info.get("nodes", 0)
+
+def _stopped_before_depth(limit: SearchLimit, info: Union[List[InfoDict], InfoDict]) -> bool:
+    """ True if a search ran out of nodes or time before the limit's depth
+    """
+    return (limit.is_capped() and limit.depth is not None and
+            limit.reached_depth(info) < limit.depth)
+
+
 def ambiguous_best_move(scores: List[Score]) -> bool:
     """
     Looks at a list of candidate scores (best move first) to determine
@@ -128,6 +470,13 @@ def ambiguous_best_move(scores: List[Score]) -> bool:
     return False
 
 
+def _quit_engine(engine: SimpleEngine):
+    try:
+        engine.quit()
+    except:
+        pass
+
+
 def _stockfish_command() -> Optional[str]:
     cmd = stockfish_command()
     if shutil.which(cmd):
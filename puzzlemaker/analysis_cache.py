@@ -0,0 +1,78 @@
+from typing import Hashable, Iterable, Optional, Union
+from collections import OrderedDict, namedtuple
+import threading
+
+from chess import Board, Move
+from chess.polyglot import zobrist_hash
+
+from puzzlemaker.search_limit import SearchLimit, search_limit
+from puzzlemaker.constants import ANALYSIS_CACHE_SIZE
+
+CacheEntry = namedtuple("CacheEntry", ["depth", "info", "search_time"])
+
+
+class AnalysisCache(object):
+    """ Bounded LRU cache of engine analysis results
+
+        Results are keyed by position (Zobrist hash), multipv, root moves
+        and engine. A result searched to some depth also answers requests
+        for shallower depths, and a result that ran out of nodes or time
+        answers requests with the same or smaller budgets
+    """
+    def __init__(self, max_size=ANALYSIS_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.time_saved = 0.0     # seconds of engine time saved by cache hits
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(board: Board, engine_name: str, multipv: Optional[int] = None,
+            root_moves: Optional[Iterable[Move]] = None) -> Hashable:
+        if root_moves is not None:
+            root_moves = tuple(sorted(move.uci() for move in root_moves))
+        return (zobrist_hash(board), multipv, root_moves, engine_name)
+
+    def get(self, key: Hashable, limit: Union[int, SearchLimit]):
+        """ Returns a result that went as far as a search with this limit
+            (a depth or a SearchLimit), or None
+        """
+        limit = search_limit(limit)
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry or not limit.is_reached(entry.depth, entry.info):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.time_saved += entry.search_time
+            return entry.info
+
+    def put(self, key: Hashable, depth: int, info, search_time=0.0):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry.depth > depth:
+                # keep the deeper result
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = CacheEntry(depth, info, search_time)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> str:
+        lookups = self.hits + self.misses
+        hit_rate = 100.0 * self.hits / lookups if lookups else 0.0
+        return "%d hits, %d misses (%.1f%%), %.1fs of engine time saved" % (
+            self.hits, self.misses, hit_rate, self.time_saved
+        )
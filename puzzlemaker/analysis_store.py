@@ -0,0 +1,182 @@
+from typing import List, Optional, Tuple, Union
+import json
+import sqlite3
+import threading
+import time
+
+import chess
+from chess.engine import Cp, Mate, MateGiven, PovScore, Score, InfoDict
+
+from puzzlemaker.search_limit import SearchLimit, search_limit
+from puzzlemaker.constants import ANALYSIS_DB_SIZE
+
+# number of writes between checks of the database size
+EVICTION_INTERVAL = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analysis (
+    position INTEGER NOT NULL,
+    multipv INTEGER NOT NULL,
+    root_moves TEXT NOT NULL,
+    engine TEXT NOT NULL,
+    depth INTEGER NOT NULL,
+    info TEXT NOT NULL,
+    accessed REAL NOT NULL,
+    PRIMARY KEY (position, multipv, root_moves, engine)
+);
+CREATE INDEX IF NOT EXISTS analysis_accessed ON analysis (accessed);
+CREATE TABLE IF NOT EXISTS analysis_size (n INTEGER NOT NULL);
+INSERT INTO analysis_size SELECT (SELECT COUNT(*) FROM analysis)
+    WHERE NOT EXISTS (SELECT 1 FROM analysis_size);
+CREATE TRIGGER IF NOT EXISTS analysis_inserted AFTER INSERT ON analysis
+    BEGIN UPDATE analysis_size SET n = n + 1; END;
+CREATE TRIGGER IF NOT EXISTS analysis_deleted AFTER DELETE ON analysis
+    BEGIN UPDATE analysis_size SET n = n - 1; END;
+"""
+
+
+class AnalysisStore(object):
+    """ Persistent SQLite database of engine analysis, shared across runs
+
+        Stores the score and PV of each line, keyed the same way as the
+        in-memory AnalysisCache. Several processes can read and write the
+        same database. The least recently used analyses are evicted once
+        the database holds more than max_size analyses. Triggers keep
+        count of the analyses, so checking the size doesn't scan the table
+    """
+    def __init__(self, path, max_size=ANALYSIS_DB_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._n_writes = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        with self._connection() as db:
+            # in one transaction, so that processes opening a new database
+            # at the same time count its analyses once
+            db.executescript("BEGIN IMMEDIATE;" + SCHEMA + "COMMIT;")
+
+    def _connection(self) -> sqlite3.Connection:
+        """ One connection per thread
+        """
+        db = getattr(self._local, "db", None)
+        if not db:
+            db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    @staticmethod
+    def _row_key(key) -> Tuple[int, int, str, str]:
+        position, multipv, root_moves, engine = key
+        # SQLite integers are signed 64-bit
+        if position >= 2 ** 63:
+            position -= 2 ** 64
+        return position, multipv or 0, " ".join(root_moves or ()), engine
+
+    def get(self, key, limit: Union[int, SearchLimit]) -> Optional[Union[List[InfoDict], InfoDict]]:
+        """ Returns a result that went as far as a search with this limit
+            (a depth or a SearchLimit), or None
+        """
+        entry = self.get_entry(key, limit)
+        return entry[1] if entry else None
+
+    def get_entry(self, key, limit: Union[int, SearchLimit]
+                  ) -> Optional[Tuple[int, Union[List[InfoDict], InfoDict]]]:
+        """ Returns the depth a result is stored with and the result, if it
+            went as far as a search with this limit, or None
+        """
+        limit = search_limit(limit)
+        row_key = self._row_key(key)
+        db = self._connection()
+        row = db.execute(
+            "SELECT depth, info FROM analysis WHERE position = ? AND multipv = ? "
+            "AND root_moves = ? AND engine = ?", row_key
+        ).fetchone()
+        info = deserialize_info(row[1]) if row else None
+        if not row or not limit.is_reached(row[0], info):
+            with self._lock:
+                self.misses += 1
+            return None
+        db.execute(
+            "UPDATE analysis SET accessed = ? WHERE position = ? AND multipv = ? "
+            "AND root_moves = ? AND engine = ?", (time.time(),) + row_key
+        )
+        with self._lock:
+            self.hits += 1
+        return row[0], info
+
+    def put(self, key, depth: int, info: Union[List[InfoDict], InfoDict]):
+        db = self._connection()
+        db.execute(
+            "INSERT INTO analysis VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (position, multipv, root_moves, engine) DO UPDATE SET "
+            "depth = excluded.depth, info = excluded.info, accessed = excluded.accessed "
+            "WHERE excluded.depth >= analysis.depth",
+            self._row_key(key) + (depth, serialize_info(info), time.time())
+        )
+        with self._lock:
+            self._n_writes += 1
+            evict = self._n_writes % EVICTION_INTERVAL == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """ Deletes the least recently used analyses beyond max_size
+        """
+        db = self._connection()
+        n_rows = db.execute("SELECT n FROM analysis_size").fetchone()[0]
+        if n_rows > self.max_size:
+            db.execute(
+                "DELETE FROM analysis WHERE rowid IN "
+                "(SELECT rowid FROM analysis ORDER BY accessed LIMIT ?)",
+                (n_rows - self.max_size,)
+            )
+
+    def stats(self) -> str:
+        return "%d hits, %d misses" % (self.hits, self.misses)
+
+
+def serialize_info(info: Union[List[InfoDict], InfoDict]) -> str:
+    """ Keeps the parts of an analysis that puzzles are made from
+    """
+    def _serialize(info):
+        data = {"score": _score_str(info["score"])}
+        if info.get("pv"):
+            data["pv"] = [move.uci() for move in info["pv"]]
+        for k in ["depth", "nodes", "time"]:
+            if k in info:
+                data[k] = info[k]
+        return data
+    if isinstance(info, list):
+        return json.dumps([_serialize(i) for i in info])
+    return json.dumps(_serialize(info))
+
+def deserialize_info(data: str) -> Union[List[InfoDict], InfoDict]:
+    def _deserialize(data):
+        info = dict(data)
+        info["score"] = _parse_score(data["score"])
+        if "pv" in data:
+            info["pv"] = [chess.Move.from_uci(uci) for uci in data["pv"]]
+        return info
+    data = json.loads(data)
+    if isinstance(data, list):
+        return [_deserialize(d) for d in data]
+    return _deserialize(data)
+
+def _score_str(score: PovScore) -> str:
+    """ Score from white's point of view, e.g. +34, -120, #+3, #-0
+    """
+    return str(score.white())
+
+def _parse_score(score_str: str) -> PovScore:
+    if score_str.startswith("#+"):
+        moves = int(score_str[2:])
+        score: Score = Mate(moves) if moves else MateGiven
+    elif score_str.startswith("#-"):
+        score = Mate(-int(score_str[2:]))
+    else:
+        score = Cp(int(score_str))
+    return PovScore(score, chess.WHITE)
@@ -0,0 +1,221 @@
+from typing import AsyncIterator, List, Optional, Tuple, Union
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+import asyncio
+import time
+
+from chess.engine import popen_uci, Score, EngineTerminatedError, InfoDict, UciProtocol
+
+from puzzlemaker.logger import log
+from puzzlemaker.colors import Color
+from puzzlemaker.analysis_cache import AnalysisCache
+from puzzlemaker.search_limit import SearchLimit, search_limit
+from puzzlemaker.analysis import (
+    AnalysisEngine, AnalyzedMove, _best_move, _best_moves, _evaluated_move, _other_moves,
+    _stopped_before_depth, _stockfish_command,
+    HASH_POLICY_GAME, HASH_POLICY_PUZZLE, CLEAR_HASH_OPTION
+)
+
+# (transport, protocol) pair returned by chess.engine.popen_uci
+AsyncEngine = Tuple[asyncio.SubprocessTransport, UciProtocol]
+
+
+class AsyncEnginePool(object):
+    """ A fixed number of asyncio engines shared by the tasks of one event loop
+
+        The size of the pool limits how many positions are analyzed at once
+    """
+    def __init__(self, size=1, options=None):
+        self.size = size
+        self.options = options or {}
+        self._name = None
+        self._engines: List[AsyncEngine] = []
+        self._idle: asyncio.Queue = None
+
+    async def _start_engine(self) -> AsyncEngine:
+        transport, protocol = await popen_uci(_stockfish_command())
+        if self.options:
+            await protocol.configure(self.options)
+        if not self._name:
+            self._name = protocol.id["name"]
+        return transport, protocol
+
+    async def checkout(self) -> AsyncEngine:
+        """ Waits until an engine is available
+        """
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+        if self._idle.empty() and len(self._engines) < self.size:
+            # reserve the slot before starting the engine
+            self._engines.append(None)
+            engine = await self._start_engine()
+            self._engines[self._engines.index(None)] = engine
+            return engine
+        return await self._idle.get()
+
+    def checkin(self, engine: AsyncEngine):
+        if engine not in self._engines:
+            # the pool was shut down while this engine was checked out
+            return
+        self._idle.put_nowait(engine)
+
+    async def replace(self, engine: AsyncEngine) -> AsyncEngine:
+        """ Replaces a checked out engine that crashed with a new one
+        """
+        await _quit_engine(engine)
+        if engine in self._engines:
+            self._engines.remove(engine)
+        self._engines.append(None)
+        new_engine = await self._start_engine()
+        self._engines[self._engines.index(None)] = new_engine
+        return new_engine
+
+    async def name(self) -> str:
+        if not self._name:
+            self.checkin(await self.checkout())
+        return self._name
+
+    async def quit(self):
+        engines = [engine for engine in self._engines if engine]
+        self._engines = []
+        self._idle = None
+        for engine in engines:
+            await _quit_engine(engine)
+
+
+class AsyncAnalysisEngine(object):
+    """ asyncio version of AnalysisEngine
+
+        Each task analyzes positions with the engine it has checked out.
+        Tasks that didn't check out an engine borrow one for each search.
+        Results are shared with the AnalysisEngine cache and analysis store
+
+        await AsyncAnalysisEngine.configure(4, {'Threads': 1})
+        puzzles = await find_puzzle_candidates_async(game)
+        await asyncio.gather(*[p.generate_async(depth) for p in puzzles])
+    """
+    pool: AsyncEnginePool = AsyncEnginePool()
+    _engine: ContextVar = ContextVar("engine", default=None)
+
+    @staticmethod
+    async def configure(size=1, options=None):
+        """ Replaces the engine pool with a pool of `size` engines
+            options [dict] - UCI options for each engine (e.g. Threads, Hash)
+        """
+        await AsyncAnalysisEngine.quit()
+        AsyncAnalysisEngine.pool = AsyncEnginePool(size, options)
+
+    @staticmethod
+    @asynccontextmanager
+    async def checkout() -> AsyncIterator[UciProtocol]:
+        """ Checks out an engine for the current task and returns it to
+            the pool afterwards
+
+            async with AsyncAnalysisEngine.checkout():
+                await puzzle.generate_async(depth)
+        """
+        engine = AsyncAnalysisEngine._engine.get()
+        if engine:
+            yield engine[1]
+            return
+        pool = AsyncAnalysisEngine.pool
+        token = AsyncAnalysisEngine._engine.set(await pool.checkout())
+        try:
+            yield AsyncAnalysisEngine._engine.get()[1]
+        finally:
+            pool.checkin(AsyncAnalysisEngine._engine.get())
+            AsyncAnalysisEngine._engine.reset(token)
+
+    @staticmethod
+    async def name() -> str:
+        return await AsyncAnalysisEngine.pool.name()
+
+    @staticmethod
+    async def quit():
+        await AsyncAnalysisEngine.pool.quit()
+
+    @staticmethod
+    async def new_game():
+        """ asyncio version of AnalysisEngine.new_game()
+            Follows the hash policy of AnalysisEngine
+        """
+        if AnalysisEngine.hash_policy in [HASH_POLICY_GAME, HASH_POLICY_PUZZLE]:
+            await AsyncAnalysisEngine.clear_hash()
+
+    @staticmethod
+    async def new_puzzle():
+        """ asyncio version of AnalysisEngine.new_puzzle()
+        """
+        if AnalysisEngine.hash_policy == HASH_POLICY_PUZZLE:
+            await AsyncAnalysisEngine.clear_hash()
+
+    @staticmethod
+    async def clear_hash():
+        """ Clears the hashtables of the engine checked out by the current task
+        """
+        async with AsyncAnalysisEngine.checkout() as engine:
+            if CLEAR_HASH_OPTION in engine.options:
+                await engine.configure({CLEAR_HASH_OPTION: None})
+
+    @staticmethod
+    async def best_move(board, limit, mate=None) -> AnalyzedMove:
+        return _best_move(board, await AsyncAnalysisEngine._analyze(board, limit, mate))
+
+    @staticmethod
+    async def best_moves(board, limit, multipv=3) -> List[AnalyzedMove]:
+        infos = await AsyncAnalysisEngine._analyze(board, limit, multipv=multipv)
+        return _best_moves(board, infos)
+
+    @staticmethod
+    async def evaluate_move(board, move, limit) -> AnalyzedMove:
+        info = await AsyncAnalysisEngine._analyze(board, limit, root_moves=[move])
+        return _evaluated_move(board, move, info)
+
+    @staticmethod
+    async def best_move_excluding(board, limit, excluded_moves, mate=None) -> Optional[AnalyzedMove]:
+        root_moves = _other_moves(board, excluded_moves)
+        if not root_moves:
+            return None
+        info = await AsyncAnalysisEngine._analyze(board, limit, mate, root_moves=root_moves)
+        return _best_move(board, info)
+
+    @staticmethod
+    async def score(board, limit) -> Score:
+        return (await AsyncAnalysisEngine.best_move(board, limit)).score
+
+    @staticmethod
+    async def _analyze(board, limit, mate=None, **kwargs) -> Union[List[InfoDict], InfoDict]:
+        info = AnalysisEngine._probe_tablebase(board, **kwargs)
+        if info is not None:
+            return info
+        limit = search_limit(limit)
+        if mate:
+            return await AsyncAnalysisEngine._search(board, limit, mate, **kwargs)
+        key = AnalysisCache.key(board, await AsyncAnalysisEngine.name(), **kwargs)
+        info = AnalysisEngine._cached_analysis(key, limit)
+        if info is None:
+            start_time = time.time()
+            info = await AsyncAnalysisEngine._search(board, limit, **kwargs)
+            AnalysisEngine._cache_analysis(key, limit, info, time.time() - start_time)
+        return info
+
+    @staticmethod
+    async def _search(board, limit: SearchLimit, mate=None, **kwargs) -> Union[List[InfoDict], InfoDict]:
+        async with AsyncAnalysisEngine.checkout() as engine:
+            try:
+                info = await engine.analyse(board, limit.engine_limit(mate), **kwargs)
+            except EngineTerminatedError:
+                log(Color.RED, "Analysis engine crashed... restarting")
+                pool = AsyncAnalysisEngine.pool
+                AsyncAnalysisEngine._engine.set(await pool.replace(AsyncAnalysisEngine._engine.get()))
+                return await AsyncAnalysisEngine._search(board, limit, mate, **kwargs)
+        AnalysisEngine.stats.add(info, _stopped_before_depth(limit, info))
+        return info
+
+
+async def _quit_engine(engine: AsyncEngine):
+    transport, protocol = engine
+    try:
+        await protocol.quit()
+    except:
+        transport.close()
@@ -0,0 +1,187 @@
+from typing import List, Optional
+from collections import deque, namedtuple
+import multiprocessing
+import threading
+import time
+
+from chess.engine import Score
+
+from puzzlemaker.logger import log
+from puzzlemaker.colors import Color
+from puzzlemaker.utils import material_total, fullmove_string
+
+# swing (in cp) of a candidate whose score goes to or from a forced mate
+MATE_SWING = 10000
+
+
+class BudgetLimit(namedtuple("BudgetLimit", ["seconds", "nodes"], defaults=[None, None])):
+    """ How much work a candidate, a game or a whole run may take
+
+        seconds [float] - wall-clock time, None for no time limit
+        nodes [int] - engine nodes searched, None for no node limit
+    """
+    def is_limited(self) -> bool:
+        return self.seconds is not None or self.nodes is not None
+
+    def start(self) -> "Budget":
+        """ A budget with this limit that starts spending now
+        """
+        return Budget(self)
+
+    def __str__(self) -> str:
+        limits = []
+        if self.seconds is not None:
+            limits.append("%gs" % self.seconds)
+        if self.nodes is not None:
+            limits.append("%d nodes" % self.nodes)
+        return " or ".join(limits) or "no limit"
+
+
+class Budget(object):
+    """ The time and nodes spent on a candidate, a game or a whole run
+
+        Nodes are spent by the searches of the threads charging the budget
+        (see AnalysisEngine.charging). Budgets are checked between searches,
+        so a search that starts within the budget can overrun it. Capping
+        each search (e.g. --search-nodes) bounds how far
+    """
+    def __init__(self, limit: BudgetLimit):
+        self.limit = limit
+        self.nodes = 0
+        self._start_time = time.time()
+        self._lock = threading.Lock()
+
+    def spend(self, nodes: int):
+        with self._lock:
+            self.nodes += nodes
+
+    def elapsed(self) -> float:
+        return time.time() - self._start_time
+
+    def is_exhausted(self) -> bool:
+        if self.limit.seconds is not None and self.elapsed() >= self.limit.seconds:
+            return True
+        if self.limit.nodes is not None and self.nodes >= self.limit.nodes:
+            return True
+        return False
+
+    def __str__(self) -> str:
+        return "%.1fs, %d nodes of %s" % (self.elapsed(), self.nodes, self.limit)
+
+
+class SharedBudget(Budget):
+    """ A budget shared by several processes, e.g. the run budget of the
+        worker processes. Its nodes are kept in shared memory, so it has to
+        be handed to the processes as they start (e.g. in initargs)
+    """
+    def __init__(self, limit: BudgetLimit):
+        self._shared_nodes = multiprocessing.Value("q", 0)
+        super().__init__(limit)
+
+    @property
+    def nodes(self) -> int:
+        return self._shared_nodes.value
+
+    @nodes.setter
+    def nodes(self, nodes: int):
+        self._shared_nodes.value = nodes
+
+    def spend(self, nodes: int):
+        with self._shared_nodes.get_lock():
+            self._shared_nodes.value += nodes
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+class CandidateQueue(object):
+    """ The order in which the candidates of a game are generated
+
+        With a budget that's limited, the candidates most likely to become
+        puzzles are generated first (see candidate_priority), and the
+        candidates left once a budget is exhausted are skipped. Otherwise
+        they're generated in game order
+
+        Several threads can take candidates from the same queue. Without
+        a limited budget, candidates can be added as they're found
+    """
+    def __init__(self, puzzles, budgets: List[Budget]):
+        self.puzzles = puzzles
+        self.budgets = budgets
+        if any(budget.limit.is_limited() for budget in budgets):
+            order = prioritized(puzzles)
+        else:
+            order = range(len(puzzles))
+        self.skipped: List[int] = []
+        self._indices = deque(order)
+        self._lock = threading.Lock()
+
+    def add(self, puzzle):
+        """ Adds a candidate after the others, e.g. one found while the
+            first ones are being generated. Candidates added to a queue
+            with a limited budget aren't prioritized
+        """
+        with self._lock:
+            self.puzzles.append(puzzle)
+            self._indices.append(len(self.puzzles) - 1)
+
+    def next(self) -> Optional[int]:
+        """ The index of the next candidate to generate, None once there
+            are none left or a budget is exhausted
+        """
+        with self._lock:
+            if self._indices and any(budget.is_exhausted() for budget in self.budgets):
+                for i in self._indices:
+                    skip_candidate(self.puzzles[i])
+                self.skipped.extend(self._indices)
+                self._indices.clear()
+            if not self._indices:
+                return None
+            return self._indices.popleft()
+
+
+def skip_candidate(puzzle):
+    """ Marks a candidate that isn't generated because a budget is exhausted
+    """
+    puzzle.over_budget = True
+    log(Color.YELLOW, "Skipping candidate %s%s (swing: %d): over budget" % (
+        fullmove_string(puzzle.initial_board),
+        puzzle.initial_board.san(puzzle.initial_move),
+        candidate_swing(puzzle),
+    ))
+
+def prioritized(puzzles) -> List[int]:
+    """ The indexes of puzzle candidates, most promising first
+    """
+    priorities = [candidate_priority(puzzle) for puzzle in puzzles]
+    return sorted(range(len(puzzles)), key=lambda i: priorities[i], reverse=True)
+
+def candidate_priority(puzzle) -> tuple:
+    """ How likely a candidate is to become a puzzle: candidates that the
+        tactical prefilter found no motifs in last, then the largest swings
+        in the scan first, then those with the least material on the board,
+        whose lines are shorter and searched faster
+    """
+    return (
+        puzzle.tactical_motifs != [],
+        candidate_swing(puzzle),
+        -material_total(puzzle.initial_board),
+    )
+
+def candidate_swing(puzzle) -> int:
+    """ How much (in cp) the score changed with the candidate's initial
+        move in the scan, 0 if it's unknown
+    """
+    scan_analysis = puzzle.scan_analysis
+    if not scan_analysis or scan_analysis.initial_score is None:
+        return 0
+    return abs(_swing_cp(scan_analysis.played_move.score) - _swing_cp(scan_analysis.initial_score))
+
+def _swing_cp(score: Score) -> int:
+    return score.score(mate_score=MATE_SWING)
@@ -9,3 +9,36 @@ MIN_PLAYER_MOVES = 2
 
 # number of candidate moves to analyze for each puzzle position
 NUM_CANDIDATE_MOVES = 3
+
+# number of times a game is attempted before giving up when its worker crashes
+MAX_GAME_ATTEMPTS = 3
+
+# maximum number of games and candidate puzzles waiting between pipeline stages
+PIPELINE_QUEUE_SIZE = 8
+
+# maximum number of engine analyses kept in memory for reuse
+ANALYSIS_CACHE_SIZE = 20000
+
+# maximum number of engine analyses kept in a persistent analysis database
+ANALYSIS_DB_SIZE = 10000000
+
+# number of plies of the principal variation analyzed ahead of puzzle generation
+PREFETCH_PLIES = 4
+
+# search depth of the first pass of a two-stage scan (see --shallow-depth)
+SHALLOW_SCAN_DEPTH = 8
+
+# how far (in cp) shallow scan scores may be from the scan depth scores
+SCAN_MARGIN = 50
+
+# fraction of the nodes of a best move's search that the search of the other
+# moves may take (see --exclusion-search)
+EXCLUSION_NODES_RATIO = 0.5
+
+# first depth and depth step of progressive deepening (see --deepening)
+DEEPENING_START_DEPTH = 8
+DEEPENING_DEPTH_STEP = 2
+
+# number of depths in a row after which progressive deepening stops, either
+# because the best move didn't change or because it was always ambiguous
+DEEPENING_ITERATIONS = 3
@@ -0,0 +1,117 @@
+from typing import Iterable, Optional
+
+from chess.pgn import Headers
+
+# estimated game duration (base time + 40 increments) below which a
+# time control belongs to each category, like on Lichess
+TIME_CONTROL_CATEGORIES = [
+    (30, "ultrabullet"),
+    (180, "bullet"),
+    (480, "blitz"),
+    (1500, "rapid"),
+]
+
+
+class GameFilter(object):
+    """ Selects the games to scan for puzzles from their PGN headers, so
+        that the other games are skipped without parsing their moves
+
+        min_elo, max_elo [int] - rating range of both players
+        time_controls [list(str)] - accepted TimeControl values (e.g. 180+2)
+                                    or categories (e.g. blitz, correspondence)
+        variants [list(str)] - accepted variants (Standard if there's no Variant header)
+        terminations [list(str)] - accepted Termination values (e.g. Normal)
+        min_plies [int] - minimum number of moves (half-moves) in a game
+
+        Games without the headers a filter needs are rejected. The number of
+        moves is checked from the PlyCount header if there is one, otherwise
+        after reading the moves
+    """
+    def __init__(self, min_elo: Optional[int] = None, max_elo: Optional[int] = None,
+                 time_controls: Optional[Iterable[str]] = None,
+                 variants: Optional[Iterable[str]] = None,
+                 terminations: Optional[Iterable[str]] = None,
+                 min_plies=0):
+        self.min_elo = min_elo
+        self.max_elo = max_elo
+        self.time_controls = _lowercase_set(time_controls)
+        self.variants = _lowercase_set(variants)
+        self.terminations = _lowercase_set(terminations)
+        self.min_plies = min_plies
+
+    def is_active(self) -> bool:
+        return any([
+            self.min_elo is not None, self.max_elo is not None, self.time_controls,
+            self.variants, self.terminations, self.min_plies > 0,
+        ])
+
+    def check_headers(self, headers: Headers) -> Optional[str]:
+        """ Returns why a game is rejected based on its headers, None if it isn't
+        """
+        if self.min_elo is not None or self.max_elo is not None:
+            for elo_header in ["WhiteElo", "BlackElo"]:
+                elo = _int_header(headers, elo_header)
+                if elo is None:
+                    return "no %s" % elo_header
+                if self.min_elo is not None and elo < self.min_elo:
+                    return "%s %d" % (elo_header, elo)
+                if self.max_elo is not None and elo > self.max_elo:
+                    return "%s %d" % (elo_header, elo)
+        if self.time_controls:
+            time_control = headers.get("TimeControl", "")
+            category = time_control_category(time_control)
+            if time_control.lower() not in self.time_controls and category not in self.time_controls:
+                return "time control %s" % (time_control or "unknown")
+        if self.variants:
+            variant = headers.get("Variant", "Standard")
+            if variant.lower() not in self.variants:
+                return "variant %s" % variant
+        if self.terminations:
+            termination = headers.get("Termination", "")
+            if termination.lower() not in self.terminations:
+                return "termination %s" % (termination or "unknown")
+        if self.min_plies > 0:
+            n_plies = _int_header(headers, "PlyCount")
+            if n_plies is not None:
+                return self.check_plies(n_plies)
+        return None
+
+    def check_plies(self, n_plies: int) -> Optional[str]:
+        """ Returns why a game with this many moves is rejected, None if it isn't
+        """
+        if n_plies < self.min_plies:
+            return "%d plies" % n_plies
+        return None
+
+
+def time_control_category(time_control: str) -> Optional[str]:
+    """ The category of a PGN TimeControl value, e.g. blitz for 180+2
+        None if it can't be determined
+    """
+    if time_control == "-":
+        return "correspondence"
+    # only the first period of a multi-period time control (e.g. 40/7200:3600)
+    period = time_control.split(":")[0].split("/")[-1]
+    try:
+        if "+" in period:
+            base, increment = [int(t) for t in period.split("+")]
+        else:
+            base, increment = int(period), 0
+    except ValueError:
+        return None
+    duration = base + 40 * increment
+    for max_duration, category in TIME_CONTROL_CATEGORIES:
+        if duration < max_duration:
+            return category
+    return "classical"
+
+
+def _int_header(headers: Headers, name: str) -> Optional[int]:
+    try:
+        return int(headers.get(name, ""))
+    except ValueError:
+        return None
+
+
+def _lowercase_set(values: Optional[Iterable[str]]) -> set:
+    return {value.strip().lower() for value in values or []}
@@ -1,6 +1,9 @@
+from contextlib import contextmanager
+from typing import Iterator
 import re
 import sys
 import logging
+import threading
 
 from chess import Move, Board
 from chess.engine import Score
@@ -13,12 +16,39 @@ def configure_logging(level=logging.DEBUG):
     logging.basicConfig(format="%(message)s", level=level, stream=sys.stderr)
     logging.getLogger("chess").setLevel(logging.WARNING)
 
+# muted - the log messages of the thread are discarded (see muted())
+_local = threading.local()
+
+
 def log(color: str, message: str):
-    logging.debug(color + message + Color.ENDC)
+    if not getattr(_local, "muted", False):
+        logging.debug(color + message + Color.ENDC)
+
+def is_logging() -> bool:
+    """ False if log messages are discarded (e.g. with --quiet), so that
+        they don't need to be formatted
+    """
+    if getattr(_local, "muted", False):
+        return False
+    return logging.getLogger().isEnabledFor(logging.DEBUG)
+
+@contextmanager
+def muted() -> Iterator[None]:
+    """ Discards the log messages of the current thread, e.g. those of the
+        positions analyzed ahead of time by a PvPrefetcher
+    """
+    was_muted = getattr(_local, "muted", False)
+    _local.muted = True
+    try:
+        yield
+    finally:
+        _local.muted = was_muted
 
 def log_board(board: Board, unicode_pieces=True):
     """ Logs the fen string and board representation
     """
+    if not is_logging():
+        return
     log(Color.VIOLET, board.fen())
     w_color = Color.WHITE
     b_color = Color.DARK_GREY
@@ -43,6 +73,8 @@ def log_move(board: Board, move: Move, score: Score,
              show_uci=False, highlight=False):
     """ 23. Qe4     CP: 123
     """
+    if not is_logging():
+        return
     move_str = "%s%s" % (fullmove_string(board), board.san(move))
     log_str = "  %s" % move_str
     if show_uci:
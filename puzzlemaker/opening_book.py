@@ -0,0 +1,52 @@
+from typing import List, Optional
+
+from chess import Board, Move
+import chess.polyglot
+
+
+class OpeningBook(object):
+    """ The opening moves that aren't searched when scanning a game,
+        since theory positions are almost never puzzles
+
+        path [str] - a Polyglot book. A move is in book if the book has
+                     it for the position it's played from
+        plies [int] - the first plies of every game are in book
+
+        A game is in book until its first move that's neither
+    """
+    def __init__(self, path: Optional[str] = None, plies=0):
+        self.path = path
+        self.plies = plies
+        self._reader = chess.polyglot.open_reader(path) if path else None
+
+    def book_plies(self, board: Board, moves: List[Move]) -> int:
+        """ The number of opening moves of a game that are in book
+
+            board - the starting position of the game
+        """
+        board = board.copy(stack=False)
+        n_book_plies = 0
+        for move in moves:
+            if n_book_plies >= self.plies and not self._in_book(board, move):
+                break
+            board.push(move)
+            n_book_plies += 1
+        return n_book_plies
+
+    def _in_book(self, board: Board, move: Move) -> bool:
+        if not self._reader:
+            return False
+        return any(entry.move == move for entry in self._reader.find_all(board))
+
+    def close(self):
+        if self._reader:
+            self._reader.close()
+
+
+def open_book(path: Optional[str] = None, plies=0) -> Optional[OpeningBook]:
+    """ The opening book for a Polyglot book and/or a number of plies,
+        None if there's neither
+    """
+    if not path and plies <= 0:
+        return None
+    return OpeningBook(path, plies)
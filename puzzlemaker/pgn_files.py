@@ -0,0 +1,182 @@
+from typing import Any, Callable, Iterable, Iterator, List, Optional, TextIO, Tuple
+import bz2
+import glob
+import gzip
+import io
+import lzma
+import os
+import sys
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from puzzlemaker.pgn_index import PgnIndex
+
+# reads PGN from standard input
+STDIN = "-"
+
+COMPRESSED_EXTENSIONS = {
+    ".gz": gzip.open,
+    ".bz2": bz2.open,
+    ".xz": lzma.open,
+    ".lzma": lzma.open,
+}
+
+ZSTD_EXTENSIONS = (".zst", ".zstd")
+
+PGN_EXTENSIONS = (".pgn",) + tuple(".pgn" + ext for ext in COMPRESSED_EXTENSIONS) + tuple(
+    ".pgn" + ext for ext in ZSTD_EXTENSIONS
+)
+
+# Lichess dumps are compressed with windows larger than zstandard's default limit
+ZSTD_MAX_WINDOW_SIZE = 2 ** 31
+
+
+def pgn_file_paths(pgn: str) -> List[str]:
+    """ The PGN files to read for a --pgn argument: stdin ("-"), a file,
+        the PGN files in a directory or the files matching a glob
+    """
+    if pgn == STDIN:
+        return [STDIN]
+    if os.path.isdir(pgn):
+        return sorted(
+            os.path.join(pgn, filename) for filename in os.listdir(pgn)
+            if filename.lower().endswith(PGN_EXTENSIONS)
+        )
+    if glob.has_magic(pgn):
+        return sorted(path for path in glob.glob(pgn) if os.path.isfile(path))
+    return [pgn]
+
+
+def is_seekable(path: str) -> bool:
+    """ True if games can be read from any offset of the file, i.e. it's
+        an uncompressed file
+    """
+    return path != STDIN and not _is_compressed(path)
+
+
+def unsupported_reason(path: str) -> Optional[str]:
+    """ Why a PGN file can't be read, if it can't
+    """
+    if path.lower().endswith(ZSTD_EXTENSIONS) and zstandard is None:
+        return "reading %s needs the zstandard module (pip install zstandard)" % path
+    if path != STDIN and not os.path.isfile(path):
+        return "%s doesn't exist" % path
+    return None
+
+
+def open_pgn(path: str) -> TextIO:
+    """ Opens a PGN file for reading in text mode. Compressed files are
+        decompressed as they're read
+    """
+    if path == STDIN:
+        return io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8-sig", errors="replace")
+    extension = os.path.splitext(path)[1].lower()
+    if extension in COMPRESSED_EXTENSIONS:
+        return COMPRESSED_EXTENSIONS[extension](path, "rt", encoding="utf-8-sig", errors="replace")
+    if extension in ZSTD_EXTENSIONS:
+        if zstandard is None:
+            raise ValueError(unsupported_reason(path))
+        decompressor = zstandard.ZstdDecompressor(max_window_size=ZSTD_MAX_WINDOW_SIZE)
+        stream = decompressor.stream_reader(open(path, "rb"), closefd=True)
+        return io.TextIOWrapper(stream, encoding="utf-8-sig", errors="replace")
+    return open(path, "r")
+
+
+def read_pgn_games(paths: List[str],
+                   read_game: Callable[[TextIO], Any],
+                   skip_game: Callable[[TextIO], Any],
+                   start_index=0,
+                   end_index: Optional[int] = None,
+                   game_ids: Optional[Iterable[int]] = None) -> Iterator[Tuple[int, Any]]:
+    """ Yields (index, game) for the selected games of the PGN files in order
+        Games are counted across all the files, starting at 0
+
+        read_game - reads the next game from a PGN, None at the end of the file
+        skip_game - skips the next game of a PGN, falsy at the end of the file
+
+        Uncompressed files are indexed (see PgnIndex) so that the games that
+        aren't selected don't need to be read at all. Compressed files and
+        stdin are read in order, skipping the games that aren't selected
+    """
+    selected_ids = sorted(set(game_ids)) if game_ids else None
+    if selected_ids:
+        start_index = selected_ids[0]
+        end_index = selected_ids[-1] + 1
+    first_id = 0  # index of the first game of the current file
+    for path in paths:
+        if end_index is not None and first_id >= end_index:
+            return
+        if is_seekable(path) and (start_index > first_id or selected_ids):
+            index = PgnIndex.open(path)
+            with open_pgn(path) as pgn:
+                for local_id in _selected_local_ids(len(index), first_id, start_index,
+                                                    end_index, selected_ids):
+                    pgn.seek(index.offset(local_id))
+                    yield first_id + local_id, read_game(pgn)
+            first_id += len(index)
+            continue
+        selected = set(selected_ids) if selected_ids else None
+        game_id = first_id
+        with open_pgn(path) as pgn:
+            while end_index is None or game_id < end_index:
+                if game_id < start_index or (selected and game_id not in selected):
+                    if not skip_game(pgn):
+                        break
+                else:
+                    game = read_game(pgn)
+                    if game is None:
+                        break
+                    yield game_id, game
+                game_id += 1
+        first_id = game_id
+
+
+def _selected_local_ids(n_games, first_id, start_index, end_index, selected_ids) -> Iterable[int]:
+    """ The indexes within a file of its selected games
+    """
+    if selected_ids:
+        return [i - first_id for i in selected_ids if first_id <= i < first_id + n_games]
+    local_end = n_games if end_index is None else min(end_index - first_id, n_games)
+    return range(max(start_index - first_id, 0), local_end)
+
+
+def read_game_text(handle: TextIO) -> Optional[str]:
+    """ Reads the PGN text of the next game without parsing it. Like
+        chess.pgn.read_game(), a game ends at an empty line after its moves.
+        Returns None at the end of the file
+    """
+    lines = []
+    in_movetext = False
+    in_comment = False
+    for line in handle:
+        if not lines and not line.strip():
+            # empty lines before the game
+            continue
+        if not in_comment and not line.strip() and in_movetext:
+            break
+        lines.append(line)
+        if not line.startswith("[") and line.strip():
+            in_movetext = True
+        if in_movetext and not line.startswith("%"):
+            in_comment = _ends_in_comment(line, in_comment)
+    return "".join(lines) if lines else None
+
+
+def _ends_in_comment(line: str, in_comment: bool) -> bool:
+    for c in line:
+        if in_comment:
+            if c == "}":
+                in_comment = False
+        elif c == "{":
+            in_comment = True
+        elif c == ";":
+            break
+    return in_comment
+
+
+def _is_compressed(path: str) -> bool:
+    extension = os.path.splitext(path)[1].lower()
+    return extension in COMPRESSED_EXTENSIONS or extension in ZSTD_EXTENSIONS
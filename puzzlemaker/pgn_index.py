@@ -0,0 +1,115 @@
+from typing import BinaryIO, Optional
+from array import array
+import os
+import struct
+import sys
+
+import chess.pgn
+
+from puzzlemaker.logger import log
+from puzzlemaker.colors import Color
+
+# the index of games.pgn is kept next to it in games.pgn.idx
+INDEX_SUFFIX = ".idx"
+
+INDEX_MAGIC = b"PGNIDX02"
+
+# magic, size and modification time of the PGN, number of games
+INDEX_HEADER = struct.Struct("<8sQQQ")
+
+
+class PgnIndex(object):
+    """ Byte offsets of the games in a PGN file, so that any game can be
+        read without parsing the games before it
+
+        The index is built once by skipping through the games with
+        chess.pgn, so games are delimited (and counted) exactly as when the
+        PGN is read from the start, and saved next to the PGN. It's rebuilt
+        when the PGN changes
+    """
+    def __init__(self, pgn_path: str, offsets: array, pgn_size: int, pgn_mtime: int):
+        self.pgn_path = pgn_path
+        self.offsets = offsets
+        self.pgn_size = pgn_size
+        self.pgn_mtime = pgn_mtime
+
+    @staticmethod
+    def index_path(pgn_path: str) -> str:
+        return pgn_path + INDEX_SUFFIX
+
+    @staticmethod
+    def open(pgn_path: str) -> "PgnIndex":
+        """ Loads the index of a PGN, building and saving it if needed
+        """
+        index = PgnIndex.load(pgn_path)
+        if index is None:
+            log(Color.DIM, "Indexing %s..." % pgn_path)
+            index = PgnIndex.build(pgn_path)
+            try:
+                index.save()
+            except OSError as e:
+                log(Color.YELLOW, "Couldn't save the PGN index: %s" % e)
+        return index
+
+    @staticmethod
+    def build(pgn_path: str) -> "PgnIndex":
+        stat = os.stat(pgn_path)
+        offsets = array("Q")
+        with open(pgn_path, "rb") as pgn:
+            lines = _LineReader(pgn)
+            while True:
+                offset = lines.offset
+                if not chess.pgn.skip_game(lines):
+                    break
+                offsets.append(offset)
+        return PgnIndex(pgn_path, offsets, stat.st_size, stat.st_mtime_ns)
+
+    @staticmethod
+    def load(pgn_path: str) -> Optional["PgnIndex"]:
+        """ Loads a saved index. Returns None if there isn't one or if
+            the PGN changed after it was saved
+        """
+        try:
+            stat = os.stat(pgn_path)
+            with open(PgnIndex.index_path(pgn_path), "rb") as f:
+                header = f.read(INDEX_HEADER.size)
+                if len(header) < INDEX_HEADER.size:
+                    return None
+                magic, size, mtime, n_games = INDEX_HEADER.unpack(header)
+                if magic != INDEX_MAGIC or size != stat.st_size or mtime != stat.st_mtime_ns:
+                    return None
+                offsets = array("Q")
+                offsets.fromfile(f, n_games)
+        except (OSError, EOFError):
+            return None
+        if sys.byteorder == "big":
+            offsets.byteswap()
+        return PgnIndex(pgn_path, offsets, size, mtime)
+
+    def save(self):
+        offsets = array("Q", self.offsets)
+        if sys.byteorder == "big":
+            offsets.byteswap()
+        with open(PgnIndex.index_path(self.pgn_path), "wb") as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, self.pgn_size, self.pgn_mtime, len(offsets)))
+            offsets.tofile(f)
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def offset(self, game_id: int) -> int:
+        return self.offsets[game_id]
+
+
+class _LineReader(object):
+    """ Reads the lines of a PGN opened in binary mode for chess.pgn, and
+        keeps track of the byte offset of the next line
+    """
+    def __init__(self, pgn: BinaryIO):
+        self.pgn = pgn
+        self.offset = 0
+
+    def readline(self) -> str:
+        line = self.pgn.readline()
+        self.offset += len(line)
+        return line.decode("utf-8", errors="replace")
@@ -0,0 +1,141 @@
+from typing import List, Optional, TextIO
+import re
+
+from chess import Board, Move
+import chess.pgn
+from chess.pgn import BaseVisitor, Game, Headers, SKIP
+from chess.engine import Score, Cp, Mate
+
+from puzzlemaker.logger import log
+from puzzlemaker.colors import Color
+from puzzlemaker.game_filter import GameFilter
+
+# an evaluation embedded in a comment, e.g. [%eval 0.34], [%eval #-3] or [%eval 0.34,20]
+EVAL_REGEX = re.compile(r"\[%eval\s+(#)?([+-]?\d+(?:\.\d+)?)(?:,\d+)?\]")
+
+
+class MainlineGame(object):
+    """ The headers and mainline moves of a PGN game
+
+        Side variations and NAGs aren't kept, and comments are only kept
+        if they're needed. Can be scanned for puzzles like a chess.pgn.Game
+
+        headers [Headers] - the PGN headers of the game
+        moves [list(Move)] - the mainline moves
+        comments [list(str)] - the comment after each mainline move, if kept
+        errors [list(Exception)] - errors encountered while reading the game
+        rejected [str] - why the game filter rejected the game, if it did
+    """
+    def __init__(self, headers: Headers, board: Board):
+        self.headers = headers
+        self.starting_board = board.copy()
+        self.moves: List[Move] = []
+        self.comments: List[str] = []
+        self.errors: List[Exception] = []
+        self.rejected: Optional[str] = None
+
+    def board(self) -> Board:
+        """ The starting position of the game
+        """
+        return self.starting_board.copy()
+
+    def mainline_moves(self) -> List[Move]:
+        return self.moves
+
+    def to_game(self) -> Game:
+        game = Game.from_board(self.starting_board)
+        game.headers = Headers(self.headers)
+        node = game
+        for i, move in enumerate(self.moves):
+            node = node.add_variation(move)
+            if i < len(self.comments):
+                node.comment = self.comments[i]
+        return game
+
+    def __str__(self) -> str:
+        return str(self.to_game())
+
+
+class MainlineVisitor(BaseVisitor):
+    """ Reads the headers and mainline moves of a game into a MainlineGame,
+        skipping over side variations. The moves of games rejected by the
+        game filter aren't parsed at all
+    """
+    def __init__(self, keep_comments=False, game_filter: Optional[GameFilter] = None):
+        self.keep_comments = keep_comments
+        self.game_filter = game_filter
+        self.headers = Headers()
+        self.game: Optional[MainlineGame] = None
+        self.errors: List[Exception] = []
+        self.rejected: Optional[str] = None
+
+    def begin_headers(self) -> Headers:
+        return self.headers
+
+    def visit_header(self, tagname: str, tagvalue: str):
+        self.headers[tagname] = tagvalue
+
+    def end_headers(self):
+        if self.game_filter:
+            self.rejected = self.game_filter.check_headers(self.headers)
+            if self.rejected:
+                return SKIP
+
+    def visit_board(self, board: Board):
+        if self.game is None:
+            self.game = MainlineGame(self.headers, board)
+
+    def visit_move(self, board: Board, move: Move):
+        self.game.moves.append(move)
+        if self.keep_comments:
+            self.game.comments.append("")
+
+    def visit_comment(self, comment: str):
+        if self.keep_comments and self.game and self.game.moves:
+            if self.game.comments[-1]:
+                comment = self.game.comments[-1] + " " + comment
+            self.game.comments[-1] = comment
+
+    def begin_variation(self):
+        return SKIP
+
+    def visit_result(self, result: str):
+        if self.headers.get("Result", "*") == "*":
+            self.headers["Result"] = result
+
+    def end_game(self):
+        if self.game_filter and self.game and not self.rejected:
+            self.rejected = self.game_filter.check_plies(len(self.game.moves))
+
+    def handle_error(self, error: Exception):
+        log(Color.RED, "Error reading game: %s" % error)
+        self.errors.append(error)
+
+    def result(self) -> MainlineGame:
+        if self.game is None:
+            # the starting position couldn't be read
+            self.game = MainlineGame(self.headers, Board())
+        self.game.errors = self.errors
+        self.game.rejected = self.rejected
+        return self.game
+
+
+def parse_eval(comment: str) -> Optional[Score]:
+    """ The evaluation embedded in a move comment (from white's perspective),
+        if there is one
+    """
+    match = EVAL_REGEX.search(comment)
+    if not match:
+        return None
+    if match.group(1):
+        return Mate(int(match.group(2)))
+    return Cp(int(round(float(match.group(2)) * 100)))
+
+
+def read_mainline_game(handle: TextIO, keep_comments=False,
+                       game_filter: Optional[GameFilter] = None) -> Optional[MainlineGame]:
+    """ Reads the next game of a PGN like chess.pgn.read_game(), keeping
+        only what's needed to scan it for puzzles. Returns None at the end
+        of the file
+    """
+    return chess.pgn.read_game(handle, Visitor=lambda: MainlineVisitor(keep_comments, game_filter))
@@ -0,0 +1,174 @@
+from typing import Iterator, List, Optional, Tuple
+from collections import deque, namedtuple
+import queue
+import threading
+
+from chess.pgn import Game
+
+from puzzlemaker.logger import log
+from puzzlemaker.colors import Color
+from puzzlemaker.analysis import AnalysisEngine
+from puzzlemaker.puzzle import Puzzle
+from puzzlemaker.puzzle_finder import iter_puzzle_candidates
+from puzzlemaker.opening_book import OpeningBook
+from puzzlemaker.budget import Budget, BudgetLimit, CandidateQueue
+from puzzlemaker.tactics import prefilter
+from puzzlemaker.constants import PIPELINE_QUEUE_SIZE, SCAN_MARGIN
+
+GameScanned = namedtuple("GameScanned", ["game_id", "game", "puzzles"])
+CandidateDone = namedtuple("CandidateDone", ["game_id"])
+StageFailed = namedtuple("StageFailed", ["error"])
+
+# marks the end of the items in a queue
+DONE = None
+
+
+class PuzzlePipeline(object):
+    """ Parses, scans and generates puzzles in concurrent stages
+
+        parser thread    - reads games into a bounded queue
+        scan thread      - scans games with one engine and queues their
+                           candidate puzzles
+        generate threads - generate the queued candidates with the
+                           remaining engines in the pool
+
+        Bounded queues keep memory flat no matter how large the input is:
+        at most queue_size games are between the scan and the output, and
+        the stages wait while the caller is busy with the results
+
+        The candidates of each game go through a CandidateQueue, like in
+        serial mode. Without a limited run or game budget (from game_limit),
+        each candidate is queued as soon as it's found. With one, the most
+        promising candidates of a game are generated first, so they're
+        queued once the whole game is scanned, and the ones left once a
+        budget is exhausted are skipped
+    """
+    def __init__(self, scan_depth, search_depth, n_generators=1,
+                 queue_size=PIPELINE_QUEUE_SIZE, use_evals=False,
+                 shallow_depth=0, scan_margin=SCAN_MARGIN, reverse_scan=False,
+                 book: Optional[OpeningBook] = None, generate_options=None, prefilter_mode=None,
+                 run_budget: Optional[Budget] = None, game_limit=BudgetLimit(),
+                 candidate_limit=BudgetLimit()):
+        self.scan_depth = scan_depth
+        self.use_evals = use_evals
+        self.shallow_depth = shallow_depth
+        self.scan_margin = scan_margin
+        self.reverse_scan = reverse_scan
+        self.book = book
+        self.generate_options = generate_options or {}
+        self.prefilter_mode = prefilter_mode
+        self.search_depth = search_depth
+        self.n_generators = n_generators
+        self.run_budgets = [run_budget] if run_budget else []
+        self.game_limit = game_limit
+        self.candidate_limit = candidate_limit
+        self.game_budgets = {}   # game_id -> Budget
+        self.game_queue = queue.Queue(maxsize=queue_size)
+        self.candidate_queue = queue.Queue(maxsize=queue_size)
+        self.result_queue = queue.Queue(maxsize=queue_size)
+        # games scanned or being scanned whose results weren't returned yet
+        self.game_slots = threading.Semaphore(queue_size)
+
+    def _run_stage(self, target, *args):
+        def run():
+            try:
+                target(*args)
+            except BaseException as e:
+                self.result_queue.put(StageFailed(e))
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def _budgets(self, game_id) -> List[Budget]:
+        return self.run_budgets + [self.game_budgets[game_id]]
+
+    def _parse(self, games: Iterator[Tuple[int, Game]]):
+        for game_id, game in games:
+            self.game_queue.put((game_id, game))
+        self.game_queue.put(DONE)
+
+    def _scan(self):
+        with AnalysisEngine.checkout():
+            while True:
+                item = self.game_queue.get()
+                if item is DONE:
+                    break
+                game_id, game = item
+                self.game_slots.acquire()
+                log(Color.MAGENTA, "\nGame index: %d" % game_id)
+                log(Color.DARK_BLUE, str(game))
+                self.game_budgets[game_id] = self.game_limit.start()
+                budgets = self._budgets(game_id)
+                with AnalysisEngine.charging(budgets):
+                    found = prefilter(
+                        iter_puzzle_candidates(game, self.scan_depth, self.use_evals,
+                                               self.shallow_depth, self.scan_margin,
+                                               self.reverse_scan, self.book),
+                        self.prefilter_mode
+                    )
+                    if any(budget.limit.is_limited() for budget in budgets):
+                        candidates = CandidateQueue(list(found), budgets)
+                        for _ in candidates.puzzles:
+                            self.candidate_queue.put((game_id, candidates))
+                    else:
+                        candidates = CandidateQueue([], budgets)
+                        for puzzle in found:
+                            candidates.add(puzzle)
+                            self.candidate_queue.put((game_id, candidates))
+                puzzles = candidates.puzzles
+                log(Color.YELLOW, "# positions to consider: %d" % len(puzzles))
+                self.result_queue.put(GameScanned(game_id, game, puzzles))
+        for _ in range(self.n_generators):
+            self.candidate_queue.put(DONE)
+
+    def _generate(self):
+        with AnalysisEngine.checkout():
+            while True:
+                item = self.candidate_queue.get()
+                if item is DONE:
+                    break
+                # each queued item is one of the game's candidates, though
+                # not necessarily the one generated (see CandidateQueue)
+                game_id, candidates = item
+                i = candidates.next()
+                if i is not None:
+                    log(Color.MAGENTA, "\nConsidering position %d of game %d..." % (i+1, game_id))
+                    budget = self.candidate_limit.start()
+                    with AnalysisEngine.charging(candidates.budgets + [budget]):
+                        candidates.puzzles[i].generate(self.search_depth, budget=budget,
+                                                       **self.generate_options)
+                self.result_queue.put(CandidateDone(game_id))
+        self.result_queue.put(DONE)
+
+    def process(self, games: Iterator[Tuple[int, Game]]) -> Iterator[Tuple[int, Game, List[Puzzle]]]:
+        """ games - (game_id, game) pairs
+
+            Yields (game_id, game, generated puzzles) in the same order as
+            the games once all candidates of a game have been generated
+        """
+        self._run_stage(self._parse, games)
+        self._run_stage(self._scan)
+        for _ in range(self.n_generators):
+            self._run_stage(self._generate)
+        scanned = deque()   # games in scan order, waiting for their puzzles
+        n_done = {}         # game_id -> number of its candidates generated or skipped
+        n_running = self.n_generators
+        while n_running:
+            result = self.result_queue.get()
+            if result is DONE:
+                n_running -= 1
+            elif isinstance(result, StageFailed):
+                raise result.error
+            elif isinstance(result, GameScanned):
+                scanned.append(result)
+            else:
+                n_done[result.game_id] = n_done.get(result.game_id, 0) + 1
+            while scanned:
+                game_id, game, puzzles = scanned[0]
+                if n_done.get(game_id, 0) < len(puzzles):
+                    break
+                scanned.popleft()
+                n_done.pop(game_id, None)
+                self.game_budgets.pop(game_id, None)
+                yield game_id, game, puzzles
+                self.game_slots.release()
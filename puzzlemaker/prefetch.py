@@ -0,0 +1,98 @@
+from typing import Dict, List, Optional, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from chess import Board, Move
+from chess.polyglot import zobrist_hash
+
+from puzzlemaker.logger import muted
+from puzzlemaker.analysis import AnalysisEngine
+from puzzlemaker.puzzle_position import PuzzlePosition
+from puzzlemaker.constants import PREFETCH_PLIES
+
+
+class PvPrefetcher(object):
+    """ Analyzes the positions predicted by the principal variation of a
+        puzzle position before puzzle generation reaches them
+
+        Searches only run on engines that aren't checked out, so prefetching
+        never delays the puzzle's own searches. Predictions are thrown away
+        as soon as the puzzle leaves the principal variation
+
+        Predicted positions are analyzed like puzzle generation analyzes
+        them (see PuzzlePosition.analyze), with or without exclusion. With
+        deepening, the positions whose side to move is deepening_turn are
+        searched at increasing depths, once the puzzle knows which side it is
+    """
+    def __init__(self, depth, n_plies=PREFETCH_PLIES, deepening=False, exclusion=False):
+        self.depth = depth
+        self.n_plies = n_plies
+        self.deepening = deepening
+        self.exclusion = exclusion
+        # the side to move in the deepened positions, None until it's known
+        self.deepening_turn: Optional[bool] = None
+        self.hits = 0
+        self.misses = 0
+        # zobrist hash -> (analysis, whether it's deepened)
+        self._futures: Dict[int, Tuple[Future, bool]] = {}
+        self._executor = ThreadPoolExecutor(max_workers=max(1, AnalysisEngine.pool.size - 1))
+
+    def prefetch(self, board: Board, pv: Optional[List[Move]]):
+        """ Starts analyzing the positions along the principal variation from board
+            The first position is skipped since it's the next one the caller evaluates
+        """
+        board = board.copy(stack=False)
+        predicted = set()
+        for i, move in enumerate((pv or [])[:self.n_plies + 1]):
+            board.push(move)
+            key = zobrist_hash(board)
+            predicted.add(key)
+            deepening = self._deepens(board)
+            if i > 0 and self._futures.get(key, (None, deepening))[1] != deepening:
+                # predicted before the puzzle knew which positions are deepened
+                self._futures.pop(key)[0].cancel()
+            if i > 0 and key not in self._futures:
+                future = self._executor.submit(_analyze_position, board.copy(), self.depth,
+                                               deepening, self.exclusion)
+                self._futures[key] = (future, deepening)
+        for key in set(self._futures) - predicted:
+            # the line diverged from an earlier prediction
+            self._futures.pop(key)[0].cancel()
+
+    def _deepens(self, board: Board) -> bool:
+        return self.deepening and board.turn == self.deepening_turn
+
+    def result(self, board: Board, deepening=False) -> Optional[PuzzlePosition]:
+        """ The analysis of a predicted position. Waits for an analysis
+            that's already running. Returns None if the position wasn't
+            analyzed, or wasn't analyzed with the same deepening
+        """
+        future, deepened = self._futures.pop(zobrist_hash(board), (None, False))
+        position = None
+        if future and deepened != deepening:
+            future.cancel()
+        elif future and not future.cancel():
+            position = future.result()
+        if position:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return position
+
+    def close(self):
+        for future, _ in self._futures.values():
+            future.cancel()
+        self._futures = {}
+        self._executor.shutdown(wait=False)
+
+
+def _analyze_position(board: Board, depth, deepening=False,
+                      exclusion=False) -> Optional[PuzzlePosition]:
+    """ Same analysis as PuzzlePosition.evaluate() if a spare engine is
+        available. It isn't logged, since the puzzle may never get there
+    """
+    with AnalysisEngine.checkout(block=False) as engine, muted():
+        if not engine:
+            return None
+        position = PuzzlePosition(board, None)
+        position.analyze(depth, deepening, exclusion)
+        return position if position.candidate_moves else None
@@ -1,7 +1,9 @@
 from collections import namedtuple
-from typing import Optional
+from typing import List, Optional
 
-from chess import Move
+import chess
+from chess import Board, Move
+from chess.engine import Score, Mate
 import chess.pgn
 
 from puzzlemaker.puzzle_position import PuzzlePosition
@@ -9,9 +11,22 @@ from puzzlemaker.puzzle_exporter import PuzzleExporter
 from puzzlemaker.logger import log, log_board, log_move
 from puzzlemaker.colors import Color
 from puzzlemaker.analysis import AnalysisEngine, AnalyzedMove
+from puzzlemaker.async_analysis import AsyncAnalysisEngine
+from puzzlemaker.prefetch import PvPrefetcher
+from puzzlemaker.search_limit import search_limit
+from puzzlemaker.budget import Budget
+from puzzlemaker.tablebase import is_tablebase_win
 from puzzlemaker.utils import material_difference
 from puzzlemaker.constants import MIN_PLAYER_MOVES
 
+# analysis of a puzzle candidate from the game scan
+#   best_move [AnalyzedMove] - best move from the initial board, if known
+#   played_move [AnalyzedMove] - the initial move and the score after it
+#   depth [int or SearchLimit] - search limit of the scan
+#   initial_score [Score] - score of the initial board, if known
+ScanAnalysis = namedtuple("ScanAnalysis", ["best_move", "played_move", "depth", "initial_score"],
+                          defaults=[None])
+
 
 class Puzzle(object):
     """ initial_board [chess.Board]:
@@ -36,8 +51,25 @@ class Puzzle(object):
 
         check_ambiguity [Boolean]:
           if true, don't generate new positions when the best move is ambiguous
+
+        engine_name [str]:
+          name of the engine that generated the puzzle
+
+        scan_analysis [ScanAnalysis]:
+          analysis of the initial move from the game scan, if any
+          its best move is reused instead of searching again only if the
+          scan went at least as far as the puzzle search (e.g. a scan depth
+          of at least the search depth, which isn't the default)
+
+        tactical_motifs [list(str)]:
+          motifs found by the static prefilter before generation,
+          None if the candidate wasn't checked (see tactics.prefilter)
+
+        over_budget [Boolean]:
+          if true, the candidate was skipped or its generation abandoned
+          because a budget ran out, and the puzzle is incomplete
     """
-    def __init__(self, initial_board, initial_move=None):
+    def __init__(self, initial_board, initial_move=None, scan_analysis: ScanAnalysis = None):
         self.initial_score = None
         self.initial_board = initial_board.copy()
         self.initial_move = initial_move
@@ -45,30 +77,94 @@ class Puzzle(object):
         self.final_score = None
         self.positions = []
         self.analyzed_moves = []
+        self.engine_name = None
+        self.scan_analysis = scan_analysis
+        self.tactical_motifs = None
+        self.over_budget = False
 
     def _analyze_best_initial_move(self, depth) -> Move:
-        log(Color.BLACK, "Evaluating best initial move (depth %d)..." % depth)
-        best_move = AnalysisEngine.best_move(self.initial_board, depth)
+        best_move = self._scanned_best_initial_move(depth)
+        if not best_move:
+            log(Color.BLACK, "Evaluating best initial move (%s)..." % (search_limit(depth),))
+            best_move = AnalysisEngine.best_move(self.initial_board, depth)
+        return self._set_best_initial_move(best_move)
+
+    async def _analyze_best_initial_move_async(self, depth) -> Move:
+        best_move = self._scanned_best_initial_move(depth)
+        if not best_move:
+            log(Color.BLACK, "Evaluating best initial move (%s)..." % (search_limit(depth),))
+            best_move = await AsyncAnalysisEngine.best_move(self.initial_board, depth)
+        return self._set_best_initial_move(best_move)
+
+    def _scanned_best_initial_move(self, depth) -> Optional[AnalyzedMove]:
+        """ The best initial move found by the scan if it searched at least
+            as deep as the puzzle. A shallower scan's best move isn't reused,
+            since it may not be the best move at the puzzle's depth
+        """
+        scan_analysis = self.scan_analysis
+        if (not scan_analysis or not scan_analysis.best_move or
+                not search_limit(scan_analysis.depth).covers(search_limit(depth))):
+            return None
+        log(Color.BLACK, "Using best initial move from the scan (%s)" % (
+            search_limit(scan_analysis.depth),
+        ))
+        return scan_analysis.best_move
+
+    def _set_best_initial_move(self, best_move: AnalyzedMove) -> Move:
         if best_move.move:
             self.analyzed_moves.append(best_move)
             log_move(self.initial_board, best_move.move, best_move.score, show_uci=True)
         self.initial_score = best_move.score
         return best_move.move
 
-    def _analyze_initial_moves(self, depth):
-        """ get the score of the position before the initial move
-            also get the score of the position after the initial move
+    def _analyze_played_initial_move(self, best_move: Move, depth):
+        """ get the score of the position after the initial move
+            from the evaluation of the initial position
         """
-        best_move = self._analyze_best_initial_move(depth)
-        if not self.initial_move:
+        if not self._needs_played_initial_move(best_move):
+            return
+        analyzed_move = self._evaluated_played_initial_move()
+        if not analyzed_move:
+            log(Color.BLACK, "Evaluating played initial move (%s)..." % (search_limit(depth),))
+            analyzed_move = AnalysisEngine.evaluate_move(self.initial_board, self.initial_move, depth)
+        self._add_played_initial_move(analyzed_move)
+
+    async def _analyze_played_initial_move_async(self, best_move: Move, depth):
+        if not self._needs_played_initial_move(best_move):
             return
+        analyzed_move = self._evaluated_played_initial_move()
+        if not analyzed_move:
+            log(Color.BLACK, "Evaluating played initial move (%s)..." % (search_limit(depth),))
+            analyzed_move = await AsyncAnalysisEngine.evaluate_move(
+                self.initial_board, self.initial_move, depth
+            )
+        self._add_played_initial_move(analyzed_move)
+
+    def _needs_played_initial_move(self, best_move: Move) -> bool:
+        """ True if the played initial move needs to be evaluated
+        """
+        if not self.initial_move:
+            return False
         elif self.initial_move == best_move:
             log(Color.BLACK, "The move played was the best move")
-        else:
-            log(Color.BLACK, "Evaluating played initial move (depth %d)..." % depth)
-            analyzed_move = AnalysisEngine.evaluate_move(self.initial_board, self.initial_move, depth)
-            self.analyzed_moves.append(analyzed_move)
-            log_move(self.initial_board, self.initial_move, analyzed_move.score, show_uci=True)
+            return False
+        return True
+
+    def _evaluated_played_initial_move(self) -> Optional[AnalyzedMove]:
+        """ The score after the played initial move is the score of the
+            initial position, so it doesn't need a search of its own
+        """
+        score = self.initial_position.score
+        if score is None:
+            # no legal moves after the initial move. The scan's score of a
+            # finished game doesn't depend on the depth
+            return self.scan_analysis.played_move if self.scan_analysis else None
+        move_san = self.initial_board.san(self.initial_move)
+        return AnalyzedMove(self.initial_move, move_san, score)
+
+    def _add_played_initial_move(self, analyzed_move: AnalyzedMove):
+        self.analyzed_moves.append(analyzed_move)
+        log_move(self.initial_board, self.initial_move, analyzed_move.score, show_uci=True)
 
     def _set_initial_position(self):
         initial_move = self.initial_move
@@ -106,62 +202,234 @@ class Puzzle(object):
         """ Get the score of the final board position in the puzzle
             after the last move is made
         """
-        final_score = self.positions[-1].score
+        final_score = self._final_position_score(depth)
         if final_score:
             self.final_score = final_score
         else:
             self.final_score = AnalysisEngine.score(self.positions[-1].board, depth)
 
-    def generate(self, depth):
+    async def _calculate_final_score_async(self, depth):
+        final_score = self._final_position_score(depth)
+        if final_score:
+            self.final_score = final_score
+        else:
+            self.final_score = await AsyncAnalysisEngine.score(self.positions[-1].board, depth)
+
+    def _final_position_score(self, depth) -> Optional[Score]:
+        """ The score of the final position, if it was searched at the full
+            depth. A position rejected early by progressive deepening only
+            has the score of a shallower search, so that the puzzle isn't
+            categorized from it
+        """
+        position = self.positions[-1]
+        if position.rejected_early:
+            log(Color.BLACK, "Evaluating final position (%s)..." % (search_limit(depth),))
+            return None
+        return position.score
+
+    def _add_position(self, position: PuzzlePosition, is_player_move) -> bool:
+        """ Adds a position to the puzzle
+            Returns True if the puzzle can continue after this position
+        """
+        self.positions.append(position)
+        if position.is_final(is_player_move):
+            log_str = "Not going deeper: "
+            if position.is_ambiguous():
+                log_str += "ambiguous"
+                if position.rejected_early:
+                    log_str += " (rejected early)"
+            elif position.board.is_game_over():
+                log_str += "game over"
+            log(Color.YELLOW, log_str)
+            return False
+        log_str = "Going deeper..."
+        if is_player_move is not None:
+            if is_player_move:
+                if len(position.candidate_moves) == 1:
+                    log_str += " only one move"
+                else:
+                    log_str += " one clear best move"
+            else:
+                log_str += " not player move"
+        log(Color.DIM, log_str)
+        return True
+
+    def _find_mate_line(self, position: PuzzlePosition, is_player_move, depth) -> Optional[List[Move]]:
+        """ The moves from a position to checkmate if the player mates by
+            force, from the position's principal variation or else from a
+            search that stops at the mate
+        """
+        if not player_mates(position, is_player_move):
+            return None
+        line = mating_line(position.board, position.principal_variation())
+        if not line:
+            mate = abs(position.score.mate())
+            log(Color.BLACK, "Searching for the mating line (mate in %d)..." % mate)
+            line = mating_line(position.board, AnalysisEngine.best_move(position.board, depth, mate).pv)
+        return self._checked_mate_line(position, line)
+
+    async def _find_mate_line_async(self, position: PuzzlePosition, is_player_move,
+                                    depth) -> Optional[List[Move]]:
+        if not player_mates(position, is_player_move):
+            return None
+        line = mating_line(position.board, position.principal_variation())
+        if not line:
+            mate = abs(position.score.mate())
+            log(Color.BLACK, "Searching for the mating line (mate in %d)..." % mate)
+            best_move = await AsyncAnalysisEngine.best_move(position.board, depth, mate)
+            line = mating_line(position.board, best_move.pv)
+        return self._checked_mate_line(position, line)
+
+    def _checked_mate_line(self, position: PuzzlePosition, line: Optional[List[Move]]) -> Optional[List[Move]]:
+        """ The mating line if it starts with the position's best move
+        """
+        if not line or line[0] != position.best_move:
+            return None
+        log(Color.DIM, "Mating line: %s" % " ".join(move.uci() for move in line))
+        return line
+
+    def _evaluate_position(self, position: PuzzlePosition, depth,
+                           prefetcher: Optional[PvPrefetcher], deepening=False, exclusion=False):
+        """ Evaluates a position, using and then extending the prefetched analysis
+        """
+        if not prefetcher:
+            position.evaluate(depth, deepening=deepening, exclusion=exclusion)
+            return
+        position.evaluate(depth, prefetcher.result(position.board, deepening), deepening, exclusion)
+        prefetcher.prefetch(position.board, position.principal_variation())
+
+    def _log_result(self):
+        if self.is_complete():
+            log(Color.GREEN, "Puzzle is complete")
+        else:
+            log(Color.RED, "Puzzle incomplete")
+
+    def generate(self, depth, prefetch_plies=0, deepening=False, exclusion=False,
+                 mate_lines=False, budget: Optional[Budget] = None):
         """ Generate new positions for the puzzle until a final position is reached
+
+            depth - search depth, or a SearchLimit that can also cap the
+                    nodes and time of each search
+            prefetch_plies - number of plies of the engine's predicted line
+                             to analyze ahead of time on spare engines
+            deepening - search the positions where the player moves at
+                        increasing depths, so that the puzzle ends without a
+                        full depth search once the best move is ambiguous
+            exclusion - search only the best move and the next best move of
+                        each position. The other candidate moves are searched
+                        for the annotations once the puzzle is complete
+            mate_lines - once the player mates by force, follow the engine's
+                         mating line instead of searching each position.
+                         Only the player's moves are checked for other mates
+            budget - abandon the puzzle once this budget, or one the
+                     thread is charging (e.g. the game's), is exhausted.
+                     They're checked before each new position is searched
         """
+        prefetcher = None
+        if prefetch_plies > 0 and AnalysisEngine.pool.size > 1:
+            prefetcher = PvPrefetcher(depth, prefetch_plies, deepening, exclusion)
+        try:
+            self._generate(depth, prefetcher, deepening, exclusion, mate_lines, budget)
+        finally:
+            if prefetcher:
+                prefetcher.close()
+        if exclusion and self.is_complete():
+            for position in self.positions:
+                position.complete_candidate_moves(depth)
+        self._log_result()
+
+    def _generate(self, depth, prefetcher: Optional[PvPrefetcher], deepening=False,
+                  exclusion=False, mate_lines=False, budget: Optional[Budget] = None):
         log_board(self.initial_board)
-        self._analyze_initial_moves(depth)
+        AnalysisEngine.new_puzzle()
+        self.engine_name = AnalysisEngine.name()
+        best_move = self._analyze_best_initial_move(depth)
+        if prefetcher and not self.initial_move and self.analyzed_moves:
+            prefetcher.prefetch(self.initial_board, self.analyzed_moves[0].pv)
         self._set_initial_position()
         position = self.initial_position
-        position.evaluate(depth)
+        self._evaluate_position(position, depth, prefetcher, exclusion=exclusion)
+        self._analyze_played_initial_move(best_move, depth)
         self.player_moves_first = self._player_moves_first()
         is_player_move = not self.player_moves_first
-        while True:
-            self.positions.append(position)
-            if position.is_final(is_player_move):
-                log_str = "Not going deeper: "
-                if position.is_ambiguous():
-                    log_str += "ambiguous"
-                elif position.board.is_game_over():
-                    log_str += "game over"
-                log(Color.YELLOW, log_str)
+        if prefetcher:
+            # the positions after the ones that aren't player moves are deepened
+            prefetcher.deepening_turn = (position.board.turn if is_player_move
+                                         else not position.board.turn)
+        line = None
+        while self._add_position(position, is_player_move):
+            exhausted = budget if budget and budget.is_exhausted() else None
+            exhausted = exhausted or AnalysisEngine.exhausted_budget()
+            if exhausted:
+                log(Color.YELLOW, "Out of budget: %s" % exhausted)
+                self.over_budget = True
                 break
+            if mate_lines and not line:
+                line = self._find_mate_line(position, is_player_move, depth)
+            next_position = PuzzlePosition(position.board, position.best_move)
+            if line:
+                score = mate_score_after(position.score, position.board)
+                line = line[1:]
+                next_position.evaluate_mate_line(depth, line, score, not is_player_move,
+                                                 position.candidate_moves[0].reached)
             else:
-                log_str = "Going deeper..."
-                if is_player_move is not None:
-                    if is_player_move:
-                        if len(position.candidate_moves) == 1:
-                            log_str += " only one move"
-                        else:
-                            log_str += " one clear best move"
-                    else:
-                        log_str += " not player move"
-                log(Color.DIM, log_str)
-            position = PuzzlePosition(position.board, position.best_move)
-            position.evaluate(depth)
+                self._evaluate_position(next_position, depth, prefetcher,
+                                        deepening and not is_player_move, exclusion)
+            position = next_position
             is_player_move = not is_player_move
         self._calculate_final_score(depth)
-        if self.is_complete():
-            log(Color.GREEN, "Puzzle is complete")
-        else:
-            log(Color.RED, "Puzzle incomplete")
+
+    async def generate_async(self, depth, deepening=False, exclusion=False, mate_lines=False):
+        """ asyncio version of generate()
+            All positions of the puzzle are analyzed by the same engine
+        """
+        async with AsyncAnalysisEngine.checkout():
+            log_board(self.initial_board)
+            await AsyncAnalysisEngine.new_puzzle()
+            self.engine_name = await AsyncAnalysisEngine.name()
+            best_move = await self._analyze_best_initial_move_async(depth)
+            self._set_initial_position()
+            position = self.initial_position
+            await position.evaluate_async(depth, exclusion=exclusion)
+            await self._analyze_played_initial_move_async(best_move, depth)
+            self.player_moves_first = self._player_moves_first()
+            is_player_move = not self.player_moves_first
+            line = None
+            while self._add_position(position, is_player_move):
+                if mate_lines and not line:
+                    line = await self._find_mate_line_async(position, is_player_move, depth)
+                next_position = PuzzlePosition(position.board, position.best_move)
+                if line:
+                    score = mate_score_after(position.score, position.board)
+                    line = line[1:]
+                    await next_position.evaluate_mate_line_async(
+                        depth, line, score, not is_player_move, position.candidate_moves[0].reached
+                    )
+                else:
+                    await next_position.evaluate_async(
+                        depth, deepening and not is_player_move, exclusion
+                    )
+                position = next_position
+                is_player_move = not is_player_move
+            await self._calculate_final_score_async(depth)
+            if exclusion and self.is_complete():
+                for position in self.positions:
+                    await position.complete_candidate_moves_async(depth)
+        self._log_result()
 
     def to_pgn(self, pgn_headers=None) -> chess.pgn.Game:
         return PuzzleExporter(self).to_pgn(pgn_headers)
 
     def category(self) -> Optional[str]:
         """ Mate     - win by checkmate
+            Endgame  - win an endgame the tablebases score as won
             Material - gain a material advantage
             Equalize - equalize a losing position
         """
         if self.final_score.is_mate():
             return "Mate"
+        if is_tablebase_win(self.final_score):
+            return "Endgame"
         initial_cp = self.initial_score.score()
         final_cp = self.final_score.score()
         if initial_cp is not None and final_cp is not None:
@@ -191,6 +459,8 @@ class Puzzle(object):
             return "Black"
         initial_cp = self.initial_score.score()
         final_cp = self.final_score.score()
+        if is_tablebase_win(self.final_score):
+            return "White" if final_cp > 0 else "Black"
         if initial_cp is not None and final_cp is not None:
             # evaluation change favors white
             if final_cp - initial_cp > 100:
@@ -213,8 +483,11 @@ class Puzzle(object):
 
     def is_complete(self) -> bool:
         """ Verify that this sequence of moves represents a complete puzzle
-            Incomplete if too short or if the puzzle could not be categorized
+            Incomplete if too short, if the puzzle could not be categorized
+            or if it ran out of budget
         """
+        if self.over_budget:
+            return False
         n_player_moves = 1 if self.player_moves_first else 0
         n_player_moves += int((len(self.positions) - 1) / 2)
         if n_player_moves < MIN_PLAYER_MOVES:
@@ -222,3 +495,38 @@ class Puzzle(object):
         if self.category():
             return True
         return False
+
+
+def player_mates(position: PuzzlePosition, is_player_move) -> bool:
+    """ True if the position's score is a forced mate by the player
+    """
+    if not position.is_mate() or position.score.mate() == 0:
+        return False
+    player_color = position.board.turn if is_player_move else not position.board.turn
+    white_mates = position.score.mate() > 0
+    return white_mates == (player_color == chess.WHITE)
+
+def mating_line(board: Board, pv: Optional[List[Move]]) -> Optional[List[Move]]:
+    """ The moves of a principal variation up to checkmate
+        None if it doesn't end in checkmate
+    """
+    board = board.copy(stack=False)
+    for i, move in enumerate(pv or []):
+        if not board.is_legal(move):
+            return None
+        board.push(move)
+        if board.is_checkmate():
+            return pv[:i + 1]
+    return None
+
+def mate_score_after(score: Score, board: Board) -> Score:
+    """ The score of a mating line after the side to move plays its next
+        move. Scores are from white's perspective, and the number of moves
+        to mate only goes down after the mating side moves
+    """
+    mate = score.mate()
+    if board.turn == chess.WHITE and mate > 0:
+        return Mate(mate - 1)
+    elif board.turn == chess.BLACK and mate < 0:
+        return Mate(mate + 1)
+    return score
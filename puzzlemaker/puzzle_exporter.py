@@ -1,7 +1,6 @@
 import chess
 from chess.pgn import Game
 
-from puzzlemaker.analysis import AnalysisEngine
 from puzzlemaker.version import __version__
 
 
@@ -54,7 +53,7 @@ class PuzzleExporter(object):
         puzzle_winner = self.puzzle.winner()
         if puzzle_winner:
             game.headers['PuzzleWinner'] = puzzle_winner
-        game.headers['PuzzleEngine'] = AnalysisEngine.name()
+        game.headers['PuzzleEngine'] = self.puzzle.engine_name
         game.headers['PuzzleMakerVersion'] = __version__
         return game
 
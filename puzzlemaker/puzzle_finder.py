@@ -1,69 +1,322 @@
-from typing import List
+from typing import AsyncIterator, Iterable, Iterator, List, Optional, Set, Tuple, Union
 
-from chess import Board
+from chess import Board, Move
 from chess.pgn import Game
 from chess.engine import Score, Cp
 
 from puzzlemaker.logger import log, log_move
 from puzzlemaker.colors import Color
-from puzzlemaker.analysis import AnalysisEngine
-from puzzlemaker.puzzle import Puzzle
+from puzzlemaker.analysis import AnalysisEngine, AnalyzedMove
+from puzzlemaker.async_analysis import AsyncAnalysisEngine
+from puzzlemaker.puzzle import Puzzle, ScanAnalysis
+from puzzlemaker.pgn_reader import MainlineGame, parse_eval
+from puzzlemaker.opening_book import OpeningBook
+from puzzlemaker.search_limit import search_limit
 from puzzlemaker.utils import sign, material_total, material_count
-from puzzlemaker.constants import SCAN_DEPTH
+from puzzlemaker.constants import SCAN_DEPTH, SCAN_MARGIN
 
 
-def find_puzzle_candidates(game: Game, scan_depth=SCAN_DEPTH) -> List[Puzzle]:
+def find_puzzle_candidates(game: Union[Game, MainlineGame], scan_depth=SCAN_DEPTH,
+                           use_evals=False, shallow_depth=0,
+                           margin=SCAN_MARGIN, reverse=False,
+                           book: Optional[OpeningBook] = None) -> List[Puzzle]:
     """ finds puzzle candidates from a chess game 
     """
-    log(Color.DIM, "Scanning game for puzzles (depth: %d)..." % scan_depth)
+    return list(iter_puzzle_candidates(
+        game, scan_depth, use_evals, shallow_depth, margin, reverse, book
+    ))
+
+def iter_puzzle_candidates(game: Union[Game, MainlineGame], scan_depth=SCAN_DEPTH,
+                           use_evals=False, shallow_depth=0,
+                           margin=SCAN_MARGIN, reverse=False,
+                           book: Optional[OpeningBook] = None) -> Iterator[Puzzle]:
+    """ yields puzzle candidates from a chess game as soon as they're found
+
+        use_evals - use the [%eval] comments of the game instead of
+                    searching the positions that have one
+        scan_depth - search depth, or a SearchLimit that can also cap the
+                     nodes and time of each search
+        shallow_depth - if set, every ply is first searched at this depth
+                        and only the plies around the swings it finds
+                        (with a margin in cp) are searched at scan_depth
+        reverse - search the positions from the end of the game to the
+                  start, so that the engine's hashtables already hold the
+                  positions that follow each one. The same candidates are
+                  yielded in the same order, once the whole game is searched
+        book - the opening moves of the game that are in this book aren't
+               searched and keep an even score. The position before the
+               first move out of book is still searched
+
+        The scan ends once a budget the thread is charging (e.g. the
+        game's) is exhausted, with the candidates found so far
+    """
+    AnalysisEngine.new_game()
+    _log_scan(scan_depth, shallow_depth, reverse)
+    moves = list(game.mainline_moves())
+    n_book_plies = _book_plies(game, moves, book)
+    known_scores = _known_scores(game, use_evals, n_book_plies)
+    shallow_moves = confirmed = deep_plies = None
+    if _is_two_stage(scan_depth, shallow_depth):
+        shallow_limit = search_limit(scan_depth).at_depth(shallow_depth)
+        shallow_moves = [None] * len(moves)
+        for i, next_board in _boards_after(game.board(), moves, _scan_order(len(moves), reverse)):
+            if _scan_over_budget():
+                return
+            shallow_moves[i] = (_known_move(known_scores, i) or
+                                AnalysisEngine.best_move(next_board, shallow_limit))
+        confirmed = swings_to_confirm(game.board(), moves, shallow_moves, margin)
+        deep_plies = _deep_plies(confirmed)
+    scanned_moves = {}
+    if reverse:
+        plies = _plies_to_scan(known_scores, deep_plies, _scan_order(len(moves), reverse))
+        for i, next_board in _boards_after(game.board(), moves, plies):
+            if _scan_over_budget():
+                return
+            scanned_moves[i] = AnalysisEngine.best_move(next_board, scan_depth)
     prev_score = Cp(0)
-    puzzles = []
-    i = 0
-    node = game
-    while not node.is_end():
-        next_node = node.variation(0)
-        next_board = next_node.board()
-        cur_score = AnalysisEngine.best_move(next_board, scan_depth).score
-        board = node.board()
-        highlight_move = False
-        if should_investigate(prev_score, cur_score, board):
-            highlight_move = True
-            puzzle = Puzzle(
+    prev_best_move = None
+    board = game.board()
+    for i, move in enumerate(moves):
+        cur_best_move = _known_move(known_scores, i) or scanned_moves.get(i)
+        if cur_best_move is None:
+            if deep_plies is None or i in deep_plies:
+                if _scan_over_budget():
+                    return
+                board.push(move)
+                cur_best_move = AnalysisEngine.best_move(board, scan_depth)
+                board.pop()
+            else:
+                cur_best_move = shallow_moves[i]
+        cur_score = cur_best_move.score
+        highlight_move = (i >= n_book_plies and (confirmed is None or i in confirmed) and
+                          should_investigate(prev_score, cur_score, board))
+        log_move(board, move, cur_score, highlight=highlight_move)
+        if highlight_move:
+            yield Puzzle(
                 board,
-                next_node.move,
+                move,
+                _scan_analysis(board, move, prev_best_move, prev_score, cur_score, scan_depth)
             )
-            puzzles.append(puzzle)
-        log_move(board, next_node.move, cur_score, highlight=highlight_move)
+        board.push(move)
         prev_score = cur_score
-        node = next_node
-        i += 1
-    return puzzles
+        prev_best_move = cur_best_move
+
+async def find_puzzle_candidates_async(game: Union[Game, MainlineGame], scan_depth=SCAN_DEPTH,
+                                       use_evals=False, shallow_depth=0,
+                                       margin=SCAN_MARGIN, reverse=False,
+                           book: Optional[OpeningBook] = None) -> List[Puzzle]:
+    """ asyncio version of find_puzzle_candidates()
+        The whole game is scanned by the same engine
+    """
+    async with AsyncAnalysisEngine.checkout():
+        return [puzzle async for puzzle in aiter_puzzle_candidates(
+            game, scan_depth, use_evals, shallow_depth, margin, reverse, book
+        )]
 
-def should_investigate(a: Score, b: Score, board: Board) -> bool:
+async def aiter_puzzle_candidates(game: Union[Game, MainlineGame], scan_depth=SCAN_DEPTH,
+                                  use_evals=False, shallow_depth=0,
+                                  margin=SCAN_MARGIN, reverse=False,
+                                  book: Optional[OpeningBook] = None) -> AsyncIterator[Puzzle]:
+    """ asyncio version of iter_puzzle_candidates()
+    """
+    await AsyncAnalysisEngine.new_game()
+    _log_scan(scan_depth, shallow_depth, reverse)
+    moves = list(game.mainline_moves())
+    n_book_plies = _book_plies(game, moves, book)
+    known_scores = _known_scores(game, use_evals, n_book_plies)
+    shallow_moves = confirmed = deep_plies = None
+    if _is_two_stage(scan_depth, shallow_depth):
+        shallow_limit = search_limit(scan_depth).at_depth(shallow_depth)
+        shallow_moves = [None] * len(moves)
+        for i, next_board in _boards_after(game.board(), moves, _scan_order(len(moves), reverse)):
+            shallow_moves[i] = (_known_move(known_scores, i) or
+                                await AsyncAnalysisEngine.best_move(next_board, shallow_limit))
+        confirmed = swings_to_confirm(game.board(), moves, shallow_moves, margin)
+        deep_plies = _deep_plies(confirmed)
+    scanned_moves = {}
+    if reverse:
+        plies = _plies_to_scan(known_scores, deep_plies, _scan_order(len(moves), reverse))
+        for i, next_board in _boards_after(game.board(), moves, plies):
+            scanned_moves[i] = await AsyncAnalysisEngine.best_move(next_board, scan_depth)
+    prev_score = Cp(0)
+    prev_best_move = None
+    board = game.board()
+    for i, move in enumerate(moves):
+        cur_best_move = _known_move(known_scores, i) or scanned_moves.get(i)
+        if cur_best_move is None:
+            if deep_plies is None or i in deep_plies:
+                board.push(move)
+                cur_best_move = await AsyncAnalysisEngine.best_move(board, scan_depth)
+                board.pop()
+            else:
+                cur_best_move = shallow_moves[i]
+        cur_score = cur_best_move.score
+        highlight_move = (i >= n_book_plies and (confirmed is None or i in confirmed) and
+                          should_investigate(prev_score, cur_score, board))
+        log_move(board, move, cur_score, highlight=highlight_move)
+        if highlight_move:
+            yield Puzzle(
+                board,
+                move,
+                _scan_analysis(board, move, prev_best_move, prev_score, cur_score, scan_depth)
+            )
+        board.push(move)
+        prev_score = cur_score
+        prev_best_move = cur_best_move
+
+def swings_to_confirm(board: Board, moves: List[Move], shallow_moves: List[AnalyzedMove],
+                      margin=SCAN_MARGIN) -> Set[int]:
+    """ the plies whose shallow scores show a swing that could be worth
+        investigating at the full scan depth
+
+        board - the starting position of the game
+    """
+    board = board.copy()
+    confirmed = set()
+    prev_score = Cp(0)
+    for i, (move, analyzed_move) in enumerate(zip(moves, shallow_moves)):
+        if should_investigate(prev_score, analyzed_move.score, board, margin):
+            confirmed.add(i)
+        board.push(move)
+        prev_score = analyzed_move.score
+    return confirmed
+
+def _deep_plies(confirmed: Set[int]) -> Set[int]:
+    """ the plies searched at the full scan depth: the swings to confirm
+        and the plies before them
+    """
+    return confirmed | {i - 1 for i in confirmed if i > 0}
+
+def _plies_to_scan(known_scores: List[Optional[Score]], deep_plies: Optional[Set[int]],
+                   order: Iterable[int]) -> List[int]:
+    """ the plies searched at the full scan depth, in this order
+    """
+    return [i for i in order if _known_move(known_scores, i) is None and
+            (deep_plies is None or i in deep_plies)]
+
+def _boards_after(board: Board, moves: List[Move], plies: Iterable[int]) -> Iterator[Tuple[int, Board]]:
+    """ the board after each of these plies, in the order of the plies
+        (first to last or last to first). A single board is pushed and
+        popped from one ply to the next, so it must not be kept
+    """
+    n_pushed = 0
+    for i in plies:
+        while n_pushed < i + 1:
+            board.push(moves[n_pushed])
+            n_pushed += 1
+        while n_pushed > i + 1:
+            board.pop()
+            n_pushed -= 1
+        yield i, board
+
+def _scan_over_budget() -> bool:
+    """ True if a budget charged by the scan is exhausted
+    """
+    budget = AnalysisEngine.exhausted_budget()
+    if budget:
+        log(Color.YELLOW, "Out of budget, ending the scan: %s" % budget)
+    return budget is not None
+
+def _is_two_stage(scan_depth, shallow_depth) -> bool:
+    scan_depth = search_limit(scan_depth).depth
+    return 0 < shallow_depth and (scan_depth is None or shallow_depth < scan_depth)
+
+def _scan_order(n_plies: int, reverse=False) -> range:
+    """ the order in which the plies of a game are searched
+    """
+    if reverse:
+        return range(n_plies - 1, -1, -1)
+    return range(n_plies)
+
+def _log_scan(scan_depth, shallow_depth, reverse=False):
+    order = ", last move first" if reverse else ""
+    if _is_two_stage(scan_depth, shallow_depth):
+        log(Color.DIM, "Scanning game for puzzles (depth: %d, confirming at %s%s)..." % (
+            shallow_depth, search_limit(scan_depth), order
+        ))
+    else:
+        log(Color.DIM, "Scanning game for puzzles (%s%s)..." % (search_limit(scan_depth), order))
+
+def _known_move(known_scores: List[Optional[Score]], i: int) -> Optional[AnalyzedMove]:
+    """ the scan analysis of the board after ply i if it's known without
+        a search (see _known_scores)
+    """
+    if i < len(known_scores) and known_scores[i] is not None:
+        return AnalyzedMove(None, None, known_scores[i])
+    return None
+
+def _known_scores(game: Union[Game, MainlineGame], use_evals, n_book_plies) -> List[Optional[Score]]:
+    """ the score of the position after each ply that isn't searched: its
+        [%eval] if use_evals, or an even score while the game is in book.
+        The last book ply is searched, so that the first move out of book
+        is compared with an actual score
+    """
+    known_scores = _pgn_evals(game) if use_evals else []
+    n_skipped = max(n_book_plies - 1, 0)
+    known_scores += [None] * (n_skipped - len(known_scores))
+    for i in range(n_skipped):
+        if known_scores[i] is None:
+            known_scores[i] = Cp(0)
+    return known_scores
+
+def _book_plies(game: Union[Game, MainlineGame], moves: List[Move],
+                book: Optional[OpeningBook]) -> int:
+    """ the number of opening moves of the game that are in book
+    """
+    if not book:
+        return 0
+    n_book_plies = book.book_plies(game.board(), moves)
+    if n_book_plies:
+        log(Color.DIM, "%d plies in book" % n_book_plies)
+    return n_book_plies
+
+def _pgn_evals(game: Union[Game, MainlineGame]) -> List[Optional[Score]]:
+    """ the [%eval] of the position after each mainline move, if there is one
+    """
+    if isinstance(game, MainlineGame):
+        comments = game.comments
+    else:
+        comments = [node.comment for node in game.mainline()]
+    return [parse_eval(comment) for comment in comments]
+
+def _scan_analysis(board, move, best_move, prev_score, score, scan_depth) -> ScanAnalysis:
+    """ the scan's analysis of the board before the move (the previous
+        iteration) and of the board after the move. The best move is unknown
+        if the board before the move was scored from an [%eval]
+    """
+    if best_move and not best_move.move:
+        best_move = None
+    played_move = AnalyzedMove(move, board.san(move), score)
+    return ScanAnalysis(best_move, played_move, scan_depth, prev_score)
+
+def should_investigate(a: Score, b: Score, board: Board, margin=0) -> bool:
     """ determine if the difference between scores A and B
         makes the position worth investigating for a puzzle.
 
         A and B are normalized scores (scores from white's perspective)
+
+        margin - how much (in cp) to relax the thresholds, e.g. for scores
+                 from a shallow search that may be off by that much
     """
     a_cp = a.score()
     b_cp = b.score()
     if a_cp is not None and material_total(board) > 3:
         if b_cp is not None and material_count(board) > 6:
             # from an even position, the position changed by more than 1.1 cp
-            if abs(a_cp) < 110 and abs(b_cp - a_cp) >= 110:
+            if abs(a_cp) < 110 + margin and abs(b_cp - a_cp) >= 110 - margin:
                 return True
             # from a winning position, the position is now even
-            elif abs(a_cp) > 200 and abs(b_cp) < 110:
+            elif abs(a_cp) > 200 - margin and abs(b_cp) < 110 + margin:
                 return True
             # from a winning position, a player blundered into a losing position
-            elif abs(a_cp) > 200 and sign(b) != sign(a):
+            elif abs(a_cp) > 200 - margin and _signs_differ(a, b, margin):
                 return True
         elif b.is_mate():
             # from an even position, someone is getting checkmated
-            if abs(a_cp) < 110:
+            if abs(a_cp) < 110 + margin:
                 return True
             # from a major advantage, blundering and getting checkmated
-            elif sign(a) != sign(b):
+            elif _signs_differ(a, b, margin):
                 return True
     elif a.is_mate():
         if b.is_mate():
@@ -72,9 +325,17 @@ def should_investigate(a: Score, b: Score, board: Board) -> bool:
                 return True
         elif b_cp is not None:
             # blundering a mate threat into a major disadvantage
-            if sign(a) != sign(b):
+            if _signs_differ(a, b, margin):
                 return True
             # blundering a mate threat into an even position
-            if abs(b_cp) < 110:
+            if abs(b_cp) < 110 + margin:
                 return True
     return False
+
+def _signs_differ(a: Score, b: Score, margin=0) -> bool:
+    """ the scores have different signs, or could have within the margin
+    """
+    if sign(a) != sign(b):
+        return True
+    scores_cp = [abs(s.score()) for s in [a, b] if s.score() is not None]
+    return margin > 0 and min(scores_cp, default=margin + 1) <= margin
@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Optional
 from collections import namedtuple
 
 from chess import Board, Move
@@ -7,8 +7,15 @@ from chess.engine import Score
 from puzzlemaker.logger import log, log_board, log_move
 from puzzlemaker.colors import Color
 from puzzlemaker.analysis import AnalysisEngine, AnalyzedMove, ambiguous_best_move
+from puzzlemaker.async_analysis import AsyncAnalysisEngine
+from puzzlemaker.search_limit import SearchLimit, search_limit
 from puzzlemaker.utils import material_difference, material_count, fullmove_string
-from puzzlemaker.constants import NUM_CANDIDATE_MOVES
+from puzzlemaker.constants import NUM_CANDIDATE_MOVES, DEEPENING_START_DEPTH, DEEPENING_DEPTH_STEP
+from puzzlemaker.constants import DEEPENING_ITERATIONS, EXCLUSION_NODES_RATIO
+
+# why progressive deepening stopped before the full depth
+DEEPENING_STABLE = "stable"
+DEEPENING_REJECTED = "rejected"
 
 
 class PuzzlePosition(object):
@@ -19,6 +26,8 @@ class PuzzlePosition(object):
             best_move [Move] - the best move from the board position (after initial_move)
             score [Score] - the score for the board position (after initial_move)
             candidate_moves [List<AnalyzedMove>] - best candidate moves from this position
+            rejected_early [bool] - the best move was found ambiguous before
+                                    searching at the full depth (see evaluate())
         """
         self.initial_board: Board = initial_board.copy()
         self.initial_move: Move = initial_move
@@ -28,6 +37,7 @@ class PuzzlePosition(object):
         self.best_move: Move = None
         self.score: Score = None
         self.candidate_moves: List[AnalyzedMove] = []
+        self.rejected_early = False
 
     def _log_position(self):
         if self.initial_move:
@@ -48,33 +58,267 @@ class PuzzlePosition(object):
 
     def _calculate_best_move(self, depth):
         """ Find the best move from board position using multipv 1
+            Used when there's only one legal move
         """
-        log(Color.BLACK, "Evaluating best move (depth %d)..." % depth)
-        best_move = AnalysisEngine.best_move(self.board, depth)
+        log(Color.BLACK, "Evaluating best move (%s)..." % (search_limit(depth),))
+        self._set_best_move(AnalysisEngine.best_move(self.board, depth))
+
+    async def _calculate_best_move_async(self, depth):
+        log(Color.BLACK, "Evaluating best move (%s)..." % (search_limit(depth),))
+        self._set_best_move(await AsyncAnalysisEngine.best_move(self.board, depth))
+
+    def _set_best_move(self, best_move: AnalyzedMove):
         self.best_move = best_move.move
         self.score = best_move.score
-        if self._num_legal_moves() == 1:
-            self.candidate_moves = [best_move]
+        self.candidate_moves = [best_move]
         self._log_move(self.best_move, self.score)
+        self._log_reached()
+
+    def _calculate_candidate_moves(self, depth, exclusion=False):
+        """ Find the best move, its score and the other candidate moves
+            from board position
+        """
+        self._set_candidate_moves(self._search_candidate_moves(depth, exclusion))
+
+    async def _calculate_candidate_moves_async(self, depth, exclusion=False):
+        self._set_candidate_moves(await self._search_candidate_moves_async(depth, exclusion))
 
-    def _calculate_candidate_moves(self, depth):
-        """ Find the best move from board position using multipv 3
+    def _search_candidate_moves(self, depth, exclusion=False) -> List[AnalyzedMove]:
+        """ With exclusion, searches the best move and then the best of the
+            other moves, each with multipv 1, instead of the candidate moves
+            with multipv 3. That's all ambiguous_best_move() needs. The
+            search of the other moves is capped (see exclusion_limit())
         """
-        multipv = NUM_CANDIDATE_MOVES
-        log(Color.BLACK, "Evaluating best %d moves (depth %d)..." % (multipv, depth))
-        self.candidate_moves = AnalysisEngine.best_moves(self.board, depth, multipv)
+        if not exclusion:
+            multipv = NUM_CANDIDATE_MOVES
+            log(Color.BLACK, "Evaluating best %d moves (%s)..." % (multipv, search_limit(depth)))
+            return AnalysisEngine.best_moves(self.board, depth, multipv)
+        log(Color.BLACK, "Evaluating best move and next best move (%s)..." % (search_limit(depth),))
+        candidate_moves = [AnalysisEngine.best_move(self.board, depth)]
+        next_best_move = AnalysisEngine.best_move_excluding(
+            self.board, exclusion_limit(depth, candidate_moves[0].reached),
+            [candidate_moves[0].move]
+        )
+        if next_best_move:
+            candidate_moves.append(next_best_move)
+        return candidate_moves
+
+    async def _search_candidate_moves_async(self, depth, exclusion=False) -> List[AnalyzedMove]:
+        if not exclusion:
+            multipv = NUM_CANDIDATE_MOVES
+            log(Color.BLACK, "Evaluating best %d moves (%s)..." % (multipv, search_limit(depth)))
+            return await AsyncAnalysisEngine.best_moves(self.board, depth, multipv)
+        log(Color.BLACK, "Evaluating best move and next best move (%s)..." % (search_limit(depth),))
+        candidate_moves = [await AsyncAnalysisEngine.best_move(self.board, depth)]
+        next_best_move = await AsyncAnalysisEngine.best_move_excluding(
+            self.board, exclusion_limit(depth, candidate_moves[0].reached),
+            [candidate_moves[0].move]
+        )
+        if next_best_move:
+            candidate_moves.append(next_best_move)
+        return candidate_moves
+
+    def _set_candidate_moves(self, candidate_moves: List[AnalyzedMove]):
+        self.candidate_moves = candidate_moves
+        self.best_move = candidate_moves[0].move
+        self.score = candidate_moves[0].score
         for analyzed_move in self.candidate_moves:
             self._log_move(analyzed_move.move, analyzed_move.score)
+        self._log_reached()
+
+    def _log_reached(self):
+        """ How far the search of the best move went, which may be short of
+            its depth if it ran out of nodes or time
+        """
+        reached = self.candidate_moves[0].reached
+        if reached and reached.nodes is not None:
+            log(Color.DIM, "Reached depth %s, %d nodes" % (reached.depth, reached.nodes))
+
+    def _deepen_candidate_moves(self, depth, exclusion=False):
+        """ Searches the candidate moves at increasing depths. Positions whose
+            best move is ambiguous at every depth are rejected without a
+            search at the full depth (see _next_deepening_limit())
+        """
+        history = []
+        limit = self._next_deepening_limit(history, depth)
+        while limit is not None and limit != search_limit(depth):
+            history.append(self._search_candidate_moves(limit, exclusion))
+            limit = self._next_deepening_limit(history, depth)
+        if limit is not None:
+            self._calculate_candidate_moves(depth, exclusion)
+
+    async def _deepen_candidate_moves_async(self, depth, exclusion=False):
+        """ asyncio version of _deepen_candidate_moves()
+        """
+        history = []
+        limit = self._next_deepening_limit(history, depth)
+        while limit is not None and limit != search_limit(depth):
+            history.append(await self._search_candidate_moves_async(limit, exclusion))
+            limit = self._next_deepening_limit(history, depth)
+        if limit is not None:
+            await self._calculate_candidate_moves_async(depth, exclusion)
+
+    def _next_deepening_limit(self, history: List[List[AnalyzedMove]],
+                              depth) -> Optional[SearchLimit]:
+        """ The limit of the next search of progressive deepening after the
+            shallow searches so far: the next shallow depth, or the full
+            limit once the best move is stable or there are no shallower
+            depths left. None once the position is rejected
+
+            A stable best move still costs the shallow searches on top of
+            the one at the full depth, so deepening only saves time when
+            enough positions are rejected
+        """
+        reason = self._deepening_stop_reason(history, depth)
+        if reason == DEEPENING_REJECTED:
+            return None
+        shallow_limits = deepening_limits(depth)
+        if reason == DEEPENING_STABLE or len(history) >= len(shallow_limits):
+            return search_limit(depth)
+        return shallow_limits[len(history)]
+
+    def _deepening_stop_reason(self, history: List[List[AnalyzedMove]], depth) -> Optional[str]:
+        """ Why deepening stops after the depths searched so far, if it does
+            A rejected position keeps the analysis of the last depth
+        """
+        reason = deepening_stop_reason(history)
+        if reason == DEEPENING_REJECTED:
+            log(Color.YELLOW, "Ambiguous at %d depths in a row, not searching at %s" % (
+                len(history), search_limit(depth)
+            ))
+            self.rejected_early = True
+            self._set_candidate_moves(history[-1])
+        elif reason == DEEPENING_STABLE:
+            log(Color.DIM, "Same best move at %d depths in a row" % DEEPENING_ITERATIONS)
+        return reason
+
+    def evaluate(self, depth, prefetched: Optional["PuzzlePosition"] = None,
+                 deepening=False, exclusion=False):
+        """ depth - search depth, or a SearchLimit
+            prefetched - this position analyzed ahead of time the same way
+            (see PvPrefetcher), used instead of searching again
+            deepening - search at increasing depths first, so that ambiguous
+            positions can be rejected before the search at the full depth
+            exclusion - only search the best move and the next best move
+            (see complete_candidate_moves())
+        """
+        self._log_position()
+        if prefetched:
+            log(Color.BLACK, "Using prefetched analysis (%s)..." % (search_limit(depth),))
+            self.rejected_early = prefetched.rejected_early
+            self._set_candidate_moves(prefetched.candidate_moves)
+        else:
+            self.analyze(depth, deepening, exclusion)
+
+    def analyze(self, depth, deepening=False, exclusion=False):
+        """ Searches the best move and the candidate moves of the position
+            like evaluate(), without logging the position first
+        """
+        n_legal_moves = self._num_legal_moves()
+        if n_legal_moves == 0:
+            return
+        elif n_legal_moves == 1:
+            self._calculate_best_move(depth)
+        elif deepening:
+            self._deepen_candidate_moves(depth, exclusion)
+        else:
+            self._calculate_candidate_moves(depth, exclusion)
+
+    async def evaluate_async(self, depth, deepening=False, exclusion=False):
+        """ asyncio version of evaluate()
+        """
+        self._log_position()
+        n_legal_moves = self._num_legal_moves()
+        if n_legal_moves == 0:
+            return
+        elif n_legal_moves == 1:
+            await self._calculate_best_move_async(depth)
+        elif deepening:
+            await self._deepen_candidate_moves_async(depth, exclusion)
+        else:
+            await self._calculate_candidate_moves_async(depth, exclusion)
+
+    def evaluate_mate_line(self, depth, line: List[Move], score: Score, check_unique=False,
+                           reached: Optional[SearchLimit] = None):
+        """ Evaluates a position of a forced mate without searching for its
+            best move, which is the next move of the mating line
 
-    def evaluate(self, depth):
+            line - the moves from this position to checkmate
+            score - the score of this position along the mating line
+            check_unique - search the other moves for a mate that's as short,
+                           which would make the position ambiguous
+            reached - how far the search that found the mating line went,
+                      which caps the search of the other moves
+        """
         self._log_position()
-        if self._num_legal_moves() == 0:
+        n_legal_moves = self._num_legal_moves()
+        if n_legal_moves == 0:
             return
-        self._calculate_best_move(depth)
-        if not self.best_move:
+        log(Color.BLACK, "Following the mating line...")
+        candidate_moves = [AnalyzedMove(line[0], self.board.san(line[0]), score, line, reached)]
+        if check_unique and n_legal_moves > 1:
+            limit = exclusion_limit(depth, reached)
+            log(Color.BLACK, "Searching the other moves for a mate in %d (%s)..." % (
+                abs(score.mate()), limit
+            ))
+            next_best_move = AnalysisEngine.best_move_excluding(
+                self.board, limit, [line[0]], mate=abs(score.mate())
+            )
+            if next_best_move:
+                candidate_moves.append(next_best_move)
+        self._set_candidate_moves(candidate_moves)
+
+    async def evaluate_mate_line_async(self, depth, line: List[Move], score: Score,
+                                       check_unique=False, reached: Optional[SearchLimit] = None):
+        """ asyncio version of evaluate_mate_line()
+        """
+        self._log_position()
+        n_legal_moves = self._num_legal_moves()
+        if n_legal_moves == 0:
             return
-        if self._num_legal_moves() > 1:
-            self._calculate_candidate_moves(depth)
+        log(Color.BLACK, "Following the mating line...")
+        candidate_moves = [AnalyzedMove(line[0], self.board.san(line[0]), score, line, reached)]
+        if check_unique and n_legal_moves > 1:
+            limit = exclusion_limit(depth, reached)
+            log(Color.BLACK, "Searching the other moves for a mate in %d (%s)..." % (
+                abs(score.mate()), limit
+            ))
+            next_best_move = await AsyncAnalysisEngine.best_move_excluding(
+                self.board, limit, [line[0]], mate=abs(score.mate())
+            )
+            if next_best_move:
+                candidate_moves.append(next_best_move)
+        self._set_candidate_moves(candidate_moves)
+
+    def complete_candidate_moves(self, depth):
+        """ Searches the next best moves up to NUM_CANDIDATE_MOVES after an
+            exclusion search, for the annotations of an exported puzzle
+        """
+        while 0 < len(self.candidate_moves) < min(NUM_CANDIDATE_MOVES, self._num_legal_moves()):
+            excluded_moves = [analyzed_move.move for analyzed_move in self.candidate_moves]
+            next_best_move = AnalysisEngine.best_move_excluding(
+                self.board, exclusion_limit(depth, self.candidate_moves[0].reached), excluded_moves
+            )
+            if not next_best_move:
+                break
+            self.candidate_moves.append(next_best_move)
+
+    async def complete_candidate_moves_async(self, depth):
+        while 0 < len(self.candidate_moves) < min(NUM_CANDIDATE_MOVES, self._num_legal_moves()):
+            excluded_moves = [analyzed_move.move for analyzed_move in self.candidate_moves]
+            next_best_move = await AsyncAnalysisEngine.best_move_excluding(
+                self.board, exclusion_limit(depth, self.candidate_moves[0].reached), excluded_moves
+            )
+            if not next_best_move:
+                break
+            self.candidate_moves.append(next_best_move)
+
+    def principal_variation(self) -> Optional[List[Move]]:
+        """ The line the engine expects to be played from this position
+        """
+        if not self.candidate_moves:
+            return None
+        return self.candidate_moves[0].pv
 
     def is_mate(self) -> bool:
         return self.score and self.score.is_mate()
@@ -105,3 +349,46 @@ class PuzzlePosition(object):
         if is_player_move is not None and is_player_move and self.is_ambiguous():
             return True
         return False
+
+
+def deepening_limits(depth) -> List[SearchLimit]:
+    """ The shallower searches of progressive deepening before a search
+        with this limit (a depth or a SearchLimit). Their nodes and time
+        are capped like the full search. There are none without a depth limit
+    """
+    limit = search_limit(depth)
+    if limit.depth is None:
+        return []
+    return [limit.at_depth(shallow_depth) for shallow_depth in
+            range(DEEPENING_START_DEPTH, limit.depth, DEEPENING_DEPTH_STEP)]
+
+def exclusion_limit(depth, reached: Optional[SearchLimit]) -> SearchLimit:
+    """ The limit (from a depth or a SearchLimit) of a search restricted to
+        the moves other than a best move whose search went as far as reached.
+        Its nodes are capped at EXCLUSION_NODES_RATIO of the best move's,
+        as it only has to tell whether another move is about as good.
+        The limit is unchanged when the best move's nodes aren't known
+    """
+    limit = search_limit(depth)
+    if not reached or not reached.nodes:
+        return limit
+    nodes = max(1, int(reached.nodes * EXCLUSION_NODES_RATIO))
+    if limit.nodes is not None:
+        nodes = min(nodes, limit.nodes)
+    return limit._replace(nodes=nodes)
+
+def deepening_stop_reason(history: List[List[AnalyzedMove]]) -> Optional[str]:
+    """ Why progressive deepening can stop after searching the candidate
+        moves at these depths (shallowest first), None if it can't
+
+        DEEPENING_REJECTED - the best move was ambiguous at every depth
+        DEEPENING_STABLE - the best move was the same at the last depths
+    """
+    if len(history) < DEEPENING_ITERATIONS:
+        return None
+    if all(ambiguous_best_move([move.score for move in moves]) for moves in history):
+        return DEEPENING_REJECTED
+    best_moves = [moves[0].move for moves in history[-DEEPENING_ITERATIONS:]]
+    if all(move == best_moves[0] for move in best_moves):
+        return DEEPENING_STABLE
+    return None
@@ -0,0 +1,86 @@
+from typing import List, Optional, Union
+from collections import namedtuple
+
+from chess.engine import Limit, InfoDict
+
+
+class SearchLimit(namedtuple("SearchLimit", ["depth", "nodes", "time"], defaults=[None, None])):
+    """ How far the engine searches a position: to a depth, a number of
+        nodes and/or a number of seconds, whichever comes first
+
+        depth [int] - None for no depth limit
+        nodes [int] - None for no node limit
+        time [float] - None for no time limit
+
+        A plain depth (int) can be used wherever a SearchLimit is expected
+    """
+    def engine_limit(self, mate: Optional[int] = None) -> Limit:
+        return Limit(depth=self.depth, nodes=self.nodes, time=self.time, mate=mate)
+
+    def at_depth(self, depth: int) -> "SearchLimit":
+        """ The same limit with another depth, e.g. for a shallower search
+        """
+        return self._replace(depth=depth)
+
+    def is_capped(self) -> bool:
+        """ True if the search may stop before its depth
+        """
+        return self.nodes is not None or self.time is not None
+
+    def covers(self, other: "SearchLimit") -> bool:
+        """ True if a search with this limit goes at least as far as one
+            with the other limit
+        """
+        return all(
+            mine is None or (theirs is not None and mine >= theirs)
+            for mine, theirs in zip(self, other)
+        )
+
+    def is_reached(self, depth: int, info: Union[List[InfoDict], InfoDict]) -> bool:
+        """ True if a search result that went this deep went as far as a
+            search with this limit would
+        """
+        if isinstance(info, list):
+            info = info[0] if info else {}
+        if self.depth is not None and depth >= self.depth:
+            return True
+        if self.nodes is not None and info.get("nodes", 0) >= self.nodes:
+            return True
+        if self.time is not None and info.get("time", 0.0) >= self.time:
+            return True
+        return False
+
+    def reached_depth(self, info: Union[List[InfoDict], InfoDict]) -> int:
+        """ The depth a search with this limit is known to have reached,
+            which is the depth of the limit unless nodes or time ran out first
+        """
+        if isinstance(info, list):
+            info = info[0] if info else {}
+        if self.depth is not None and not self.is_capped():
+            return self.depth
+        reached = info.get("depth", 0)
+        return reached if self.depth is None else min(self.depth, reached)
+
+    def __str__(self) -> str:
+        limits = []
+        if self.depth is not None:
+            limits.append("depth %d" % self.depth)
+        if self.nodes is not None:
+            limits.append("%d nodes" % self.nodes)
+        if self.time is not None:
+            limits.append("%gs" % self.time)
+        return " or ".join(limits) or "no limit"
+
+
+def search_limit(limit: Union[int, SearchLimit]) -> SearchLimit:
+    """ A search limit from a plain depth or a SearchLimit
+    """
+    if isinstance(limit, SearchLimit):
+        return limit
+    return SearchLimit(limit)
+
+
+def reached_limit(info: InfoDict) -> SearchLimit:
+    """ How far a search went: its depth, nodes and time
+    """
+    return SearchLimit(info.get("depth"), info.get("nodes"), info.get("time"))
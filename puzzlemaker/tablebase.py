@@ -0,0 +1,160 @@
+from typing import List, Optional, Tuple, Union
+import os
+import threading
+
+import chess
+import chess.syzygy
+from chess import Board, Move
+from chess.engine import Cp, Mate, PovScore, Score, InfoDict
+
+# score (in cp) of a tablebase win that isn't a mate in one. Faster wins
+# (by distance to zeroing) score slightly higher
+TABLEBASE_WIN_SCORE = 10000
+
+# largest DTZ of a win under the fifty-move rule, so tablebase wins score
+# at least TABLEBASE_WIN_SCORE - MAX_DTZ
+MAX_DTZ = 100
+
+# number of plies of the principal variation of a probed move, which
+# follows the best moves by DTZ of both sides
+TABLEBASE_PV_PLIES = 8
+
+
+class Tablebase(object):
+    """ Syzygy endgame tablebases, probed instead of searching positions
+        with few enough pieces
+
+        Results have the same shape as the engine's analysis (see
+        SimpleEngine.analyse), so they're used like any other search.
+        Positions that need a missing table are left to the engine
+
+        path [str] - a directory of tables, or several separated by ":"
+                     (";" on Windows) like Stockfish's SyzygyPath option
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._tablebase = chess.syzygy.Tablebase()
+        for directory in path.split(os.pathsep):
+            self._tablebase.add_directory(directory)
+        self._lock = threading.Lock()
+        # largest number of pieces of a table, e.g. 4 for KQvKR
+        self.max_pieces = max(
+            (len(name) - 1 for name in self._tablebase.wdl), default=0
+        )
+
+    def covers(self, board: Board) -> bool:
+        """ True if the position may be in the tables
+        """
+        return (not board.castling_rights and
+                chess.popcount(board.occupied) <= self.max_pieces)
+
+    def analyse(self, board: Board, multipv: Optional[int] = None,
+                root_moves: Optional[List[Move]] = None,
+                **kwargs) -> Optional[Union[List[InfoDict], InfoDict]]:
+        """ The exact result of a position like the engine's analysis of it:
+            a list of the multipv best lines, or the best line if multipv
+            isn't given. Each line follows the best moves by DTZ of both
+            sides (see _principal_variation())
+
+            None if the position or one of the positions after a move isn't
+            covered by the tables
+        """
+        if not self.covers(board):
+            return None
+        moves = root_moves or list(board.legal_moves)
+        if not moves:
+            score = Mate(0) if board.is_checkmate() else Cp(0)
+            info = {"score": PovScore(score, board.turn), "depth": 0}
+            return [info] if multipv else info
+        scored_moves = self._scored_moves(board, moves)
+        with self._lock:
+            if scored_moves is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        infos = [{
+            "score": PovScore(score, board.turn),
+            "pv": self._principal_variation(board, move),
+            "depth": 0,
+        } for score, move in scored_moves[:multipv or 1]]
+        return infos if multipv else infos[0]
+
+    def _scored_moves(self, board: Board, moves: List[Move]) -> Optional[List[Tuple[Score, Move]]]:
+        """ The moves with their scores, best first. None if one of them
+            isn't covered by the tables
+        """
+        scored_moves = []
+        for move in moves:
+            score = self._move_score(board, move)
+            if score is None:
+                return None
+            scored_moves.append((score, move))
+        scored_moves.sort(key=lambda scored_move: scored_move[0], reverse=True)
+        return scored_moves
+
+    def _principal_variation(self, board: Board, move: Move) -> List[Move]:
+        """ A move followed by the best moves by DTZ of both sides, up to
+            TABLEBASE_PV_PLIES plies. The winning side zeroes the DTZ as
+            fast as it can and the losing side as slowly as it can, which
+            isn't necessarily the fastest mate (DTZ isn't DTM). Shorter
+            if the game ends or a position isn't covered by the tables
+        """
+        board = board.copy(stack=False)
+        pv = [move]
+        board.push(move)
+        while len(pv) < TABLEBASE_PV_PLIES and not board.is_game_over() and self.covers(board):
+            scored_moves = self._scored_moves(board, list(board.legal_moves))
+            if scored_moves is None:
+                break
+            _, best_move = scored_moves[0]
+            pv.append(best_move)
+            board.push(best_move)
+        return pv
+
+    def _move_score(self, board: Board, move: Move) -> Optional[Score]:
+        """ The score of a move for the side that plays it
+        """
+        board = board.copy(stack=False)
+        board.push(move)
+        if board.is_checkmate():
+            return Mate(1)
+        if board.is_insufficient_material() or board.is_stalemate():
+            return Cp(0)
+        wdl = self._tablebase.get_wdl(board)
+        if wdl is None:
+            return None
+        return tablebase_score(-wdl, self._tablebase.get_dtz(board, 0))
+
+    def stats(self) -> str:
+        return "%d hits, %d misses (up to %d pieces)" % (self.hits, self.misses, self.max_pieces)
+
+    def close(self):
+        self._tablebase.close()
+
+
+def missing_directories(path: str) -> List[str]:
+    """ The directories of a tablebase path that don't exist
+    """
+    return [directory for directory in path.split(os.pathsep) if not os.path.isdir(directory)]
+
+
+def tablebase_score(wdl: int, dtz: int) -> Score:
+    """ The score of a position for the side that just moved, from the WDL
+        of that side and the DTZ of the position. Cursed wins and blessed
+        losses are draws under the fifty-move rule
+    """
+    if wdl == 2:
+        return Cp(TABLEBASE_WIN_SCORE - abs(dtz))
+    elif wdl == -2:
+        return Cp(-TABLEBASE_WIN_SCORE + abs(dtz))
+    return Cp(0)
+
+
+def is_tablebase_win(score: Score) -> bool:
+    """ True if a score is a tablebase win or loss (see tablebase_score()),
+        as opposed to a mate or an engine score
+    """
+    cp = score.score()
+    return cp is not None and abs(cp) >= TABLEBASE_WIN_SCORE - MAX_DTZ
@@ -0,0 +1,186 @@
+from typing import Iterable, Iterator, List, Optional
+
+import chess
+from chess import Board, Move
+
+from puzzlemaker.logger import log
+from puzzlemaker.colors import Color
+from puzzlemaker.utils import fullmove_string
+
+# motifs of a position or of the move that led to it
+MATE_IN_ONE = "mate in one"
+MATE_THREAT = "mate threat"
+WINNING_CAPTURE = "winning capture"
+HANGING_PIECE = "hanging piece"
+SAFE_CHECK = "safe check"
+COMBINATION = "combination"
+UNEVEN_CAPTURE = "uneven capture"
+CHECK = "check"
+
+# what to do with candidates without any motif (see --prefilter)
+PREFILTER_DROP = "drop"
+PREFILTER_DEMOTE = "demote"
+PREFILTER_MODES = [PREFILTER_DROP, PREFILTER_DEMOTE]
+
+# piece values (in cp) for static exchange evaluation
+PIECE_VALUES = {
+    chess.PAWN: 100,
+    chess.KNIGHT: 300,
+    chess.BISHOP: 300,
+    chess.ROOK: 550,
+    chess.QUEEN: 900,
+    chess.KING: 20000,
+}
+
+
+def prefilter(puzzles: Iterable, mode: Optional[str]) -> Iterator:
+    """ Checks puzzle candidates for tactical motifs before they're generated
+
+        drop - yields only the candidates with motifs
+        demote - yields all candidates. Those without motifs are generated
+                 last when there's a budget (see candidate_priority)
+    """
+    for puzzle in puzzles:
+        if not mode or check_motifs(puzzle) or mode == PREFILTER_DEMOTE:
+            yield puzzle
+
+def check_motifs(puzzle) -> List[str]:
+    """ The tactical motifs of a candidate, also kept in the puzzle
+    """
+    puzzle.tactical_motifs = candidate_motifs(puzzle.initial_board, puzzle.initial_move)
+    move_str = fullmove_string(puzzle.initial_board)
+    if puzzle.initial_move:
+        move_str += puzzle.initial_board.san(puzzle.initial_move)
+    if puzzle.tactical_motifs:
+        log(Color.DIM, "Candidate %s: %s" % (move_str, ", ".join(puzzle.tactical_motifs)))
+    else:
+        log(Color.YELLOW, "Candidate %s: no tactical motifs" % move_str)
+    return puzzle.tactical_motifs
+
+def candidate_motifs(board: Board, move: Optional[Move] = None) -> List[str]:
+    """ The tactical motifs around a swing: the move that caused it, if
+        any, and the position after it. No motifs at all means the swing is
+        most likely positional, which seldom makes a puzzle
+    """
+    motifs = []
+    if move:
+        if board.is_capture(move) and see(board, move) != 0:
+            motifs.append(UNEVEN_CAPTURE)
+        board = board.copy(stack=False)
+        board.push(move)
+        if board.is_check():
+            motifs.append(CHECK)
+    return motifs + position_motifs(board)
+
+def position_motifs(board: Board) -> List[str]:
+    """ The tactical motifs of a position, for the side to move (mates,
+        material it can win, safe checks) and against it (threats it has
+        to answer)
+    """
+    motifs = []
+    checks = [move for move in board.legal_moves if _gives_check(board, move)]
+    if any(_is_mate(board, move) for move in checks):
+        motifs.append(MATE_IN_ONE)
+    if winning_captures(board):
+        motifs.append(WINNING_CAPTURE)
+    if any(_is_safe(board, move) for move in checks):
+        motifs.append(SAFE_CHECK)
+    forcing_moves = checks + [move for move in board.generate_legal_captures() if move not in checks]
+    if any(_wins_after_exchange(board, move) for move in forcing_moves):
+        motifs.append(COMBINATION)
+    if not board.is_check():
+        # what the opponent threatens if the side to move passes
+        threats = board.copy(stack=False)
+        threats.push(Move.null())
+        if any(_is_mate(threats, move) for move in threats.legal_moves):
+            motifs.append(MATE_THREAT)
+        if winning_captures(threats):
+            motifs.append(HANGING_PIECE)
+    return motifs
+
+def winning_captures(board: Board) -> List[Move]:
+    """ The captures of the side to move that win material by static
+        exchange evaluation
+    """
+    return [move for move in board.generate_legal_captures() if see(board, move) > 0]
+
+def see(board: Board, move: Move) -> int:
+    """ Static exchange evaluation of a capture: the material (in cp) the
+        side to move wins if both sides keep recapturing on the square with
+        their least valuable piece, as long as it pays off
+    """
+    gain = _captured_value(board, move)
+    board = board.copy(stack=False)
+    board.push(move)
+    return gain - _recapture_gain(board, move.to_square)
+
+def _recapture_gain(board: Board, square: int) -> int:
+    """ The material the side to move wins by recapturing on a square, or
+        0 if it's better off not recapturing
+    """
+    recaptures = list(board.generate_legal_captures(to_mask=chess.BB_SQUARES[square]))
+    if not recaptures:
+        return 0
+    move = min(recaptures, key=lambda move: PIECE_VALUES[board.piece_type_at(move.from_square)])
+    gain = _captured_value(board, move)
+    board.push(move)
+    gain -= _recapture_gain(board, square)
+    board.pop()
+    return max(0, gain)
+
+def _wins_after_exchange(board: Board, move: Move) -> bool:
+    """ True if a check or capture of the side to move, answered by the
+        opponent's cheapest capture of the piece, leads to a mate in one or
+        wins more material than it gave up (e.g. removing the guard of a
+        piece). After a check, another safe check also counts, since the
+        attack on the king goes on
+    """
+    gain = _captured_value(board, move) if board.is_capture(move) else 0
+    board = board.copy(stack=False)
+    board.push(move)
+    is_check = board.is_check()
+    replies = list(board.generate_legal_captures(to_mask=chess.BB_SQUARES[move.to_square]))
+    if replies:
+        gain -= PIECE_VALUES[board.piece_type_at(move.to_square)]
+    elif is_check and board.legal_moves.count() == 1:
+        # the opponent's only way out of check
+        replies = list(board.legal_moves)
+    else:
+        return False
+    board.push(min(replies, key=lambda reply: PIECE_VALUES[board.piece_type_at(reply.from_square)]))
+    checks = [reply for reply in board.legal_moves if _gives_check(board, reply)]
+    if any(_is_mate(board, reply) for reply in checks):
+        return True
+    if is_check and any(_is_safe(board, reply) for reply in checks):
+        return True
+    return any(gain + see(board, capture) > 0 for capture in winning_captures(board))
+
+def _captured_value(board: Board, move: Move) -> int:
+    if board.is_en_passant(move):
+        return PIECE_VALUES[chess.PAWN]
+    value = PIECE_VALUES[board.piece_type_at(move.to_square)]
+    if move.promotion:
+        value += PIECE_VALUES[move.promotion] - PIECE_VALUES[chess.PAWN]
+    return value
+
+def _gives_check(board: Board, move: Move) -> bool:
+    board.push(move)
+    is_check = board.is_check()
+    board.pop()
+    return is_check
+
+def _is_mate(board: Board, move: Move) -> bool:
+    board.push(move)
+    is_mate = board.is_checkmate()
+    board.pop()
+    return is_mate
+
+def _is_safe(board: Board, move: Move) -> bool:
+    """ True if the piece that moves can't be won afterwards
+    """
+    if board.is_capture(move):
+        return see(board, move) >= 0
+    board.push(move)
+    is_safe = _recapture_gain(board, move.to_square) == 0
+    board.pop()
+    return is_safe
@@ -0,0 +1,239 @@
+from typing import Iterator, Optional, Tuple
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.util import Finalize
+import io
+
+from puzzlemaker.logger import configure_logging, log
+from puzzlemaker.colors import Color
+from puzzlemaker.analysis import AnalysisEngine, HASH_POLICY_NEVER
+from puzzlemaker.puzzle_finder import find_puzzle_candidates
+from puzzlemaker.pgn_reader import read_mainline_game
+from puzzlemaker.game_filter import GameFilter
+from puzzlemaker.analysis_cache import AnalysisCache
+from puzzlemaker.analysis_store import AnalysisStore
+from puzzlemaker.tablebase import Tablebase
+from puzzlemaker.opening_book import open_book
+from puzzlemaker.budget import BudgetLimit, CandidateQueue, SharedBudget
+from puzzlemaker.tactics import prefilter
+from puzzlemaker.constants import MAX_GAME_ATTEMPTS, ANALYSIS_CACHE_SIZE, ANALYSIS_DB_SIZE
+from puzzlemaker.constants import SCAN_MARGIN
+
+# rejected - why the game filter rejected the game, if it did
+# n_over_budget - number of candidates skipped or abandoned over budget
+# failed - why the game was given up on, if it was
+# counters - the worker's search and lookup counters for the game
+#            (see AnalysisEngine.counters)
+GameResult = namedtuple("GameResult", ["game_id", "n_positions", "puzzle_pgns", "rejected",
+                                       "n_over_budget", "failed", "counters"],
+                        defaults=[None, 0, None, None])
+
+# settings of the current worker process
+_worker_settings = {}
+
+
+def _init_worker(engine_options, settings, log_level):
+    configure_logging(level=log_level)
+    AnalysisEngine.configure(1, engine_options)
+    AnalysisEngine.cache = AnalysisCache(settings["cache_size"])
+    AnalysisEngine.hash_policy = settings["hash_policy"]
+    if settings["analysis_db"]:
+        AnalysisEngine.store = AnalysisStore(settings["analysis_db"], settings["analysis_db_size"])
+    if settings["syzygy_path"]:
+        AnalysisEngine.tablebase = Tablebase(settings["syzygy_path"])
+    Finalize(None, AnalysisEngine.quit, exitpriority=10)
+    _worker_settings.update(settings)
+    _worker_settings["book"] = open_book(settings["book_path"], settings["book_plies"])
+
+
+def _process_game(game_id: int, game_pgn: str) -> GameResult:
+    """ Scans a game for puzzle candidates and generates puzzles from them
+        The result has the searches and lookups of the game, since those of
+        the worker process aren't seen by the main process
+    """
+    counters = AnalysisEngine.counters()
+    result = _scan_and_generate(game_id, game_pgn)
+    game_counters = {key: count - counters[key] for key, count in AnalysisEngine.counters().items()}
+    return result._replace(counters=game_counters)
+
+def _scan_and_generate(game_id: int, game_pgn: str) -> GameResult:
+    game = read_mainline_game(
+        io.StringIO(game_pgn),
+        keep_comments=_worker_settings["use_evals"],
+        game_filter=_worker_settings["game_filter"],
+    )
+    if game.rejected:
+        log(Color.DIM, "Skipping game %d: %s" % (game_id, game.rejected))
+        return GameResult(game_id, 0, [], game.rejected)
+    log(Color.MAGENTA, "\nGame index: %d" % game_id)
+    log(Color.DARK_BLUE, game_pgn)
+    budgets = [_worker_settings["run_budget"], _worker_settings["game_limit"].start()]
+    with AnalysisEngine.charging(budgets):
+        puzzles = find_puzzle_candidates(
+            game,
+            scan_depth=_worker_settings["scan_depth"],
+            use_evals=_worker_settings["use_evals"],
+            shallow_depth=_worker_settings["shallow_depth"],
+            margin=_worker_settings["scan_margin"],
+            reverse=_worker_settings["reverse_scan"],
+            book=_worker_settings["book"],
+        )
+    puzzles = list(prefilter(puzzles, _worker_settings["prefilter_mode"]))
+    n = len(puzzles)
+    log(Color.YELLOW, "# positions to consider: %d" % n)
+    puzzle_pgns = []
+    if _worker_settings["scan_only"]:
+        return GameResult(game_id, n, puzzle_pgns)
+    # the most promising candidates first if there's a run or game budget
+    candidates = CandidateQueue(puzzles, budgets)
+    generated = []
+    i = candidates.next()
+    while i is not None:
+        log(Color.MAGENTA, "\nConsidering position %d of %d..." % (i+1, n))
+        budget = _worker_settings["candidate_limit"].start()
+        with AnalysisEngine.charging(budgets + [budget]):
+            puzzles[i].generate(_worker_settings["search_depth"], budget=budget,
+                                **_worker_settings["generate_options"])
+        generated.append(i)
+        i = candidates.next()
+    for i in sorted(generated):
+        if puzzles[i].is_complete():
+            log(Color.MAGENTA, "NEW PUZZLE GENERATED\n")
+            puzzle_pgns.append(puzzles[i].to_pgn(pgn_headers=game.headers))
+    n_over_budget = sum(puzzle.over_budget for puzzle in puzzles)
+    return GameResult(game_id, n, puzzle_pgns, n_over_budget=n_over_budget)
+
+
+class GameWorkers(object):
+    """ Scans and generates puzzles from games in worker processes,
+        each with its own engine
+
+        Results are returned in the same order as the games. If a worker
+        crashes, the games that were in progress are retried one at a time,
+        so that only the game that crashes a worker on its own is charged
+        an attempt. Games are given up on after MAX_GAME_ATTEMPTS
+
+        Each game gets a budget of game_limit and each of its candidates
+        one of candidate_limit (see CandidateQueue). The run budget is
+        shared by all the workers, so it has to be a SharedBudget
+    """
+    def __init__(self, n_workers, engine_options, scan_depth, search_depth,
+                 scan_only=False, cache_size=ANALYSIS_CACHE_SIZE,
+                 analysis_db=None, analysis_db_size=ANALYSIS_DB_SIZE, syzygy_path=None,
+                 log_level=None,
+                 game_filter: Optional[GameFilter] = None, use_evals=False,
+                 shallow_depth=0, scan_margin=SCAN_MARGIN, reverse_scan=False,
+                 book_path=None, book_plies=0,
+                 hash_policy=HASH_POLICY_NEVER, generate_options=None, prefilter_mode=None,
+                 candidate_limit=BudgetLimit(), game_limit=BudgetLimit(),
+                 run_budget: Optional[SharedBudget] = None):
+        self.n_workers = n_workers
+        self.engine_options = engine_options
+        self.settings = {
+            "scan_depth": scan_depth,
+            "search_depth": search_depth,
+            "scan_only": scan_only,
+            "cache_size": cache_size,
+            "analysis_db": analysis_db,
+            "analysis_db_size": analysis_db_size,
+            "syzygy_path": syzygy_path,
+            "game_filter": game_filter,
+            "use_evals": use_evals,
+            "shallow_depth": shallow_depth,
+            "scan_margin": scan_margin,
+            "reverse_scan": reverse_scan,
+            "book_path": book_path,
+            "book_plies": book_plies,
+            "hash_policy": hash_policy,
+            "generate_options": generate_options or {},
+            "prefilter_mode": prefilter_mode,
+            "candidate_limit": candidate_limit,
+            "game_limit": game_limit,
+            "run_budget": run_budget or SharedBudget(BudgetLimit()),
+        }
+        self.log_level = log_level
+
+    def _executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self.n_workers,
+            initializer=_init_worker,
+            initargs=(self.engine_options, self.settings, self.log_level),
+        )
+
+    def process(self, games: Iterator[Tuple[int, str]]) -> Iterator[GameResult]:
+        """ games - (game_id, game_pgn) pairs
+        """
+        executor = self._executor()
+        max_pending = 2 * self.n_workers
+        pending = {}           # future -> (game_id, game_pgn, attempt)
+        suspects = deque()     # (game_id, game_pgn, attempt) of games to retry one at a time
+        game_ids = deque()     # game ids in the order results are returned
+        results = {}           # game_id -> GameResult
+        games = iter(games)
+        games_left = True
+
+        def submit(game_id, game_pgn, attempt):
+            future = executor.submit(_process_game, game_id, game_pgn)
+            pending[future] = (game_id, game_pgn, attempt)
+
+        def retry(game_id, game_pgn, attempt, alone=False):
+            if attempt >= MAX_GAME_ATTEMPTS:
+                log(Color.RED, "Giving up on game %d after %d attempts" % (game_id, attempt))
+                results[game_id] = GameResult(
+                    game_id, 0, [], failed="given up after %d attempts" % attempt
+                )
+            elif alone:
+                suspects.append((game_id, game_pgn, attempt + 1))
+            else:
+                log(Color.RED, "Retrying game %d..." % game_id)
+                submit(game_id, game_pgn, attempt + 1)
+
+        try:
+            while True:
+                if suspects:
+                    # a suspect runs alone, so a crash can only be its own
+                    if not pending:
+                        game_id, game_pgn, attempt = suspects.popleft()
+                        log(Color.RED, "Retrying game %d on its own..." % game_id)
+                        submit(game_id, game_pgn, attempt)
+                while not suspects and games_left and len(pending) < max_pending:
+                    try:
+                        game_id, game_pgn = next(games)
+                    except StopIteration:
+                        games_left = False
+                        break
+                    game_ids.append(game_id)
+                    submit(game_id, game_pgn, 1)
+                if not pending:
+                    break
+                n_running = len(pending)
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                crashed = []
+                for future in done:
+                    game_id, game_pgn, attempt = pending.pop(future)
+                    try:
+                        results[game_id] = future.result()
+                    except BrokenProcessPool:
+                        crashed.append((game_id, game_pgn, attempt))
+                    except Exception as e:
+                        log(Color.RED, "Game %d failed: %r" % (game_id, e))
+                        retry(game_id, game_pgn, attempt)
+                if crashed:
+                    # a worker died and took the process pool with it.
+                    # Restart the pool. If the game was running alone, it's
+                    # the one that crashed. Otherwise any of the games in
+                    # progress may have, and they're all retried one at a time
+                    log(Color.RED, "A worker process crashed... restarting workers")
+                    crashed += list(pending.values())
+                    pending.clear()
+                    executor.shutdown(wait=False)
+                    executor = self._executor()
+                    if n_running == 1:
+                        retry(*crashed[0], alone=True)
+                    else:
+                        suspects.extend(sorted(crashed))
+                while game_ids and game_ids[0] in results:
+                    yield results.pop(game_ids.popleft())
+        finally:
+            executor.shutdown()
@@ -14,6 +14,13 @@ def test(c, unit=False, integration=False):
     c.run(cmd, pty=True)
 
 
+@task
+def benchmark(c, depth=16):
+    """ Benchmark puzzle generation on a fixed set of positions
+    """
+    c.run("python3 benchmark.py --depth %d" % depth, pty=True)
+
+
 @task
 def type_check(c):
     """ Check types
@@ -0,0 +1,59 @@
+import asyncio
+import io
+import os
+import unittest
+
+import chess
+import chess.pgn
+
+from puzzlemaker.puzzle import Puzzle
+from puzzlemaker.puzzle_finder import find_puzzle_candidates_async
+from puzzlemaker.async_analysis import AsyncAnalysisEngine
+
+SEARCH_DEPTH = 12
+
+
+def pgn_file_path(pgn_filename) -> io.TextIOWrapper:
+    cur_dir = os.path.dirname(os.path.abspath(__file__))
+    return open(os.path.join(cur_dir, '..', 'fixtures', pgn_filename))
+
+
+class TestAsyncGeneration(unittest.TestCase):
+
+    def test_mate_in_3_is_complete(self):
+        # 1. Rxh7+ Kxh7 2. Rh1+ Kg7 3. Qh6#
+        board = chess.Board(
+            '3q1r1k/2p4p/1p1pBrp1/p2Pp3/2PnP3/5PP1/PP1Q2K1/5R1R w - - 1 0'
+        )
+        puzzle = Puzzle(board, board.parse_san('Rxh7+'))
+
+        async def generate():
+            await puzzle.generate_async(depth=SEARCH_DEPTH)
+            await AsyncAnalysisEngine.quit()
+
+        asyncio.run(generate())
+        self.assertTrue(puzzle.is_complete())
+        self.assertEqual(puzzle.category(), "Mate")
+        self.assertEqual(
+            [str(p.initial_move) for p in puzzle.positions],
+            ['h1h7', 'h8h7', 'f1h1', 'h7g7', 'd2h6']
+        )
+
+    def test_concurrent_scan_and_generation(self):
+        with pgn_file_path("carlsen-anand-blunder.wc2014.pgn") as f:
+            game = chess.pgn.read_game(f)
+
+        async def scan_and_generate():
+            await AsyncAnalysisEngine.configure(2, {'Threads': 1})
+            puzzles = await find_puzzle_candidates_async(game, scan_depth=6)
+            await asyncio.gather(*[p.generate_async(SEARCH_DEPTH) for p in puzzles])
+            await AsyncAnalysisEngine.configure()
+            return puzzles
+
+        puzzles = asyncio.run(scan_and_generate())
+        self.assertTrue(len(puzzles) > 0)
+        self.assertTrue(all(p.positions for p in puzzles))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import threading
+import unittest
+
+import chess
+
+from puzzlemaker.analysis import AnalysisEngine
+from puzzlemaker.puzzle import Puzzle
+
+
+class TestEnginePool(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self):
+        AnalysisEngine.configure(2, {'Threads': 1, 'Hash': 16})
+
+    @classmethod
+    def tearDownClass(self):
+        AnalysisEngine.configure()
+
+    def test_checkout_returns_engine_to_pool(self):
+        with AnalysisEngine.checkout() as engine:
+            self.assertIs(AnalysisEngine.instance(), engine)
+        with AnalysisEngine.checkout() as engine2:
+            self.assertIs(engine, engine2)
+
+    def test_concurrent_analysis(self):
+        engines = []
+        best_moves = []
+        boards = [
+            chess.Board(),
+            chess.Board('6k1/R4p2/1r3npp/2N5/P1b2P2/6P1/3r2BP/4R1K1 w - - 0 34'),
+        ]
+        barrier = threading.Barrier(len(boards))
+
+        def analyze(board):
+            with AnalysisEngine.checkout() as engine:
+                barrier.wait()
+                engines.append(engine)
+                best_moves.append(AnalysisEngine.best_move(board, 8).move)
+
+        threads = [threading.Thread(target=analyze, args=(b,)) for b in boards]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(set(engines)), 2)
+        self.assertTrue(all(best_moves))
+
+    def test_checkout_without_blocking(self):
+        with AnalysisEngine.checkout():
+            checked_out = []
+
+            def try_checkout():
+                with AnalysisEngine.checkout(block=False) as engine:
+                    checked_out.append(engine)
+                    with AnalysisEngine.checkout(block=False) as engine2:
+                        checked_out.append(engine2)
+
+            thread = threading.Thread(target=try_checkout)
+            thread.start()
+            thread.join()
+            self.assertIsNotNone(checked_out[0])
+            self.assertIs(checked_out[0], checked_out[1])
+
+    def test_prefetched_puzzle_is_complete(self):
+        board = chess.Board('3q1r1k/2p4p/1p1pBrp1/p2Pp3/2PnP3/5PP1/PP1Q2K1/5R1R w - - 1 0')
+        puzzle = Puzzle(board, board.parse_san('Rxh7+'))
+        with AnalysisEngine.checkout():
+            puzzle.generate(depth=12, prefetch_plies=4)
+        self.assertTrue(puzzle.is_complete())
+        self.assertEqual(puzzle.category(), "Mate")
+
+
+if __name__ == '__main__':
+    unittest.main()
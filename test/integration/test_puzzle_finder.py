@@ -35,3 +35,14 @@ class TestPuzzleFinder(unittest.TestCase):
                 and puzzle.initial_move.uci() == move):
                 found_blunder = True
         self.assertTrue(found_blunder)
+
+    def test_candidates_keep_scan_analysis(self):
+        with pgn_file_path("carlsen-anand-blunder.wc2014.pgn") as f:
+            game = chess.pgn.read_game(f)
+        puzzles = find_puzzle_candidates(game, scan_depth=6)
+        for puzzle in puzzles:
+            scan_analysis = puzzle.scan_analysis
+            self.assertEqual(scan_analysis.depth, 6)
+            self.assertEqual(scan_analysis.played_move.move, puzzle.initial_move)
+            if scan_analysis.best_move:
+                self.assertIn(scan_analysis.best_move.move, puzzle.initial_board.legal_moves)
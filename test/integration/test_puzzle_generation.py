@@ -36,6 +36,19 @@ class TestPuzzleIsComplete(unittest.TestCase):
         puzzle.generate(depth=SEARCH_DEPTH)
         self.assertFalse(puzzle.is_complete())
 
+    def test_exclusion_search(self):
+        board = chess.Board(
+            '6k1/R4p2/1r3npp/2N5/P1b2P2/6P1/3r2BP/4R1K1 w - - 0 34'
+        )
+        puzzle = Puzzle(board, board.parse_san('Rb7'))
+        puzzle.generate(depth=15, exclusion=True)
+        self.assertTrue(puzzle.is_complete())
+        self.assertEqual(puzzle.category(), "Material")
+        for position in puzzle.positions:
+            n_legal_moves = position.board.legal_moves.count()
+            if n_legal_moves > 1:
+                self.assertEqual(len(position.candidate_moves), min(3, n_legal_moves))
+
     def test_bishop_fork(self):
         # source https://lichess.org/training/61079
         # source game https://lichess.org/1n12OmvV
@@ -0,0 +1,93 @@
+from contextlib import contextmanager
+from unittest import mock
+import zlib
+
+from chess.engine import Cp, Mate, PovScore
+
+from puzzlemaker.analysis import AnalysisEngine
+from puzzlemaker.analysis_cache import AnalysisCache
+from puzzlemaker.utils import material_difference
+
+
+class FakeEngine(object):
+    """ Stands in for Stockfish in unit tests. Moves are scored by the
+        material they win, so searches are fast and deterministic. Ties
+        are broken by a hash of the move
+
+        searches - (fen, limit, multipv, root_moves) of each search
+    """
+    searches = []
+    options = {}
+
+    def __init__(self):
+        self.id = {"name": "Fake"}
+
+    @classmethod
+    def popen_uci(cls, command):
+        return cls()
+
+    def configure(self, options):
+        pass
+
+    def quit(self):
+        pass
+
+    def analyse(self, board, limit, multipv=None, root_moves=None, **kwargs):
+        FakeEngine.searches.append((board.fen(), limit, multipv, root_moves))
+        moves = sorted(root_moves or board.legal_moves, key=lambda move: -_move_score(board, move))
+        if not moves:
+            score = Mate(0) if board.is_checkmate() else Cp(0)
+            info = {"score": PovScore(score, board.turn), "depth": 0, "nodes": 0}
+            return [info] if multipv else info
+        depth = limit.depth or 1
+        infos = [{
+            "score": PovScore(_score(board, move), board.turn),
+            "pv": _pv(board, move),
+            "depth": depth,
+            "nodes": 2 ** depth,
+        } for move in moves[:multipv or 1]]
+        return infos if multipv else infos[0]
+
+
+@contextmanager
+def fake_engine(n_engines=1):
+    """ A pool of fake engines without an analysis cache
+    """
+    cache = AnalysisEngine.cache
+    with mock.patch("puzzlemaker.analysis.SimpleEngine", FakeEngine), \
+            mock.patch("puzzlemaker.analysis._stockfish_command", lambda: "fake"):
+        AnalysisEngine.configure(n_engines)
+        AnalysisEngine.cache = AnalysisCache(0)
+        FakeEngine.searches = []
+        try:
+            yield
+        finally:
+            AnalysisEngine.quit()
+            AnalysisEngine.cache = cache
+
+
+def _move_score(board, move) -> int:
+    board = board.copy(stack=False)
+    board.push(move)
+    if board.is_checkmate():
+        return 10000
+    material = material_difference(board) if not board.turn else -material_difference(board)
+    return int(100 * material) + zlib.crc32(move.uci().encode()) % 13
+
+def _score(board, move):
+    board = board.copy(stack=False)
+    board.push(move)
+    if board.is_checkmate():
+        return Mate(1)
+    board.pop()
+    return Cp(_move_score(board, move))
+
+def _pv(board, move, length=4):
+    board = board.copy(stack=False)
+    pv = [move]
+    board.push(move)
+    while len(pv) < length and not board.is_game_over():
+        reply = max(board.legal_moves, key=lambda reply: _move_score(board, reply))
+        pv.append(reply)
+        board.push(reply)
+    return pv
@@ -0,0 +1,64 @@
+import unittest
+
+from chess import Board, Move
+
+from puzzlemaker.analysis_cache import AnalysisCache
+
+
+class TestAnalysisCache(unittest.TestCase):
+
+    def test_deeper_result_answers_shallower_request(self):
+        cache = AnalysisCache()
+        key = cache.key(Board(), "engine")
+        cache.put(key, 16, "depth 16")
+        self.assertEqual(cache.get(key, 12), "depth 16")
+        self.assertEqual(cache.get(key, 16), "depth 16")
+        self.assertIsNone(cache.get(key, 22))
+        self.assertEqual(cache.hits, 2)
+        self.assertEqual(cache.misses, 1)
+
+    def test_keeps_deepest_result(self):
+        cache = AnalysisCache()
+        key = cache.key(Board(), "engine")
+        cache.put(key, 22, "depth 22")
+        cache.put(key, 16, "depth 16")
+        self.assertEqual(cache.get(key, 16), "depth 22")
+
+    def test_key_includes_search_options(self):
+        board = Board()
+        move = Move.from_uci("e2e4")
+        keys = [
+            AnalysisCache.key(board, "engine"),
+            AnalysisCache.key(board, "engine", multipv=3),
+            AnalysisCache.key(board, "engine", root_moves=[move]),
+            AnalysisCache.key(board, "other engine"),
+        ]
+        self.assertEqual(len(set(keys)), len(keys))
+        board.push(move)
+        self.assertNotIn(AnalysisCache.key(board, "engine"), keys)
+
+    def test_evicts_least_recently_used(self):
+        cache = AnalysisCache(max_size=2)
+        board = Board()
+        keys = []
+        for uci in ["e2e4", "d2d4", "c2c4"]:
+            board = Board()
+            board.push(Move.from_uci(uci))
+            keys.append(cache.key(board, "engine"))
+        cache.put(keys[0], 10, "e4")
+        cache.put(keys[1], 10, "d4")
+        cache.get(keys[0], 10)
+        cache.put(keys[2], 10, "c4")
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get(keys[1], 10))
+        self.assertEqual(cache.get(keys[0], 10), "e4")
+
+    def test_disabled_cache(self):
+        cache = AnalysisCache(max_size=0)
+        key = cache.key(Board(), "engine")
+        cache.put(key, 10, "result")
+        self.assertIsNone(cache.get(key, 10))
+
+
+if __name__ == '__main__':
+    unittest.main()
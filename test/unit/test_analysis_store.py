@@ -0,0 +1,98 @@
+import os
+import tempfile
+import unittest
+
+import chess
+from chess import Board, Move
+from chess.engine import Cp, Mate, MateGiven, PovScore
+
+from puzzlemaker.analysis import AnalysisEngine
+from puzzlemaker.analysis_cache import AnalysisCache
+from puzzlemaker.search_limit import search_limit
+from puzzlemaker.analysis_store import AnalysisStore, serialize_info, deserialize_info
+
+
+class TestAnalysisStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "analysis.db")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_serializing_scores(self):
+        for score in [Cp(0), Cp(34), Cp(-120), Mate(3), Mate(-2), Mate(0), MateGiven]:
+            info = {"score": PovScore(score, chess.BLACK), "depth": 12}
+            restored = deserialize_info(serialize_info(info))
+            self.assertEqual(restored["score"].white(), -score)
+            self.assertEqual(restored["depth"], 12)
+
+    def test_serializing_multipv_lines(self):
+        infos = [
+            {"score": PovScore(Cp(50), chess.WHITE), "pv": [Move.from_uci("e2e4"), Move.from_uci("e7e5")]},
+            {"score": PovScore(Cp(20), chess.WHITE), "pv": [Move.from_uci("d2d4")]},
+        ]
+        restored = deserialize_info(serialize_info(infos))
+        self.assertEqual([i["pv"] for i in restored], [i["pv"] for i in infos])
+        self.assertEqual([i["score"].white() for i in restored], [Cp(50), Cp(20)])
+
+    def test_analysis_is_kept_across_connections(self):
+        key = AnalysisCache.key(Board(), "engine", multipv=3)
+        info = [{"score": PovScore(Cp(30), chess.WHITE), "pv": [Move.from_uci("e2e4")]}]
+        AnalysisStore(self.path).put(key, 16, info)
+        store = AnalysisStore(self.path)
+        self.assertEqual(store.get(key, 14)[0]["pv"], info[0]["pv"])
+        self.assertIsNone(store.get(key, 22))
+        self.assertIsNone(store.get(AnalysisCache.key(Board(), "engine"), 10))
+        self.assertEqual((store.hits, store.misses), (1, 2))
+
+    def test_keeps_deepest_analysis(self):
+        key = AnalysisCache.key(Board(), "engine")
+        store = AnalysisStore(self.path)
+        store.put(key, 22, {"score": PovScore(Cp(30), chess.WHITE)})
+        store.put(key, 16, {"score": PovScore(Cp(10), chess.WHITE)})
+        self.assertEqual(store.get(key, 16)["score"].white(), Cp(30))
+
+    def test_evicts_least_recently_used(self):
+        store = AnalysisStore(self.path, max_size=2)
+        keys = []
+        for uci in ["e2e4", "d2d4", "c2c4"]:
+            board = Board()
+            board.push(Move.from_uci(uci))
+            keys.append(AnalysisCache.key(board, "engine"))
+            store.put(keys[-1], 10, {"score": PovScore(Cp(0), chess.WHITE)})
+        store.evict()
+        self.assertIsNone(store.get(keys[0], 10))
+        self.assertIsNotNone(store.get(keys[2], 10))
+
+    def test_counts_analyses(self):
+        store = AnalysisStore(self.path)
+        key = AnalysisCache.key(Board(), "engine")
+        store.put(key, 10, {"score": PovScore(Cp(0), chess.WHITE)})
+        store.put(key, 12, {"score": PovScore(Cp(0), chess.WHITE)})
+        store.put(AnalysisCache.key(Board(), "other engine"), 10, {"score": PovScore(Cp(0), chess.WHITE)})
+        db = store._connection()
+        self.assertEqual(db.execute("SELECT n FROM analysis_size").fetchone()[0], 2)
+        # a database from before analyses were counted
+        db.executescript("DROP TABLE analysis_size; DROP TRIGGER analysis_inserted;"
+                         "DROP TRIGGER analysis_deleted;")
+        db = AnalysisStore(self.path)._connection()
+        self.assertEqual(db.execute("SELECT n FROM analysis_size").fetchone()[0], 2)
+
+    def test_store_hits_are_cached_with_their_depth(self):
+        key = AnalysisCache.key(Board(), "engine")
+        store = AnalysisStore(self.path)
+        store.put(key, 14, {"score": PovScore(Cp(30), chess.WHITE), "depth": 14})
+        cache = AnalysisEngine.cache
+        AnalysisEngine.cache, AnalysisEngine.store = AnalysisCache(), store
+        try:
+            self.assertIsNotNone(AnalysisEngine._cached_analysis(key, search_limit(10)))
+            self.assertIsNotNone(AnalysisEngine.cache.get(key, 14))
+            self.assertIsNone(AnalysisEngine.cache.get(key, 16))
+        finally:
+            AnalysisEngine.cache, AnalysisEngine.store = cache, None
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+import multiprocessing
+import os
+import unittest
+
+import chess.pgn
+from chess import Board, Move
+from chess.engine import Cp, Mate
+
+from puzzlemaker.analysis import AnalysisEngine, AnalyzedMove
+from puzzlemaker.budget import (
+    BudgetLimit, CandidateQueue, SharedBudget, candidate_swing, prioritized
+)
+from puzzlemaker.pgn_files import read_pgn_games
+from puzzlemaker.pgn_reader import read_mainline_game
+from puzzlemaker.puzzle import Puzzle, ScanAnalysis
+from puzzlemaker.puzzle_finder import find_puzzle_candidates
+
+from test.unit.fake_engine import FakeEngine, fake_engine
+
+GAME_PGN = os.path.join(os.path.dirname(__file__), "..", "fixtures",
+                        "carlsen-anand-blunder.wc2014.pgn")
+# the candidate of the game that becomes the longest puzzle
+LONG_CANDIDATE = 4
+# the fake engine searches 2 ** depth nodes
+SCAN_DEPTH = 8
+SEARCH_DEPTH = 10
+
+# the position after 1. e4 e5 2. Nf3
+BOARD = Board("rnbqkbnr/pppp1ppp/8/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R b KQkq - 1 2")
+
+
+def candidate(board, uci, score_before, score_after):
+    move = Move.from_uci(uci)
+    played_move = AnalyzedMove(move, board.san(move), score_after)
+    return Puzzle(board, move, ScanAnalysis(None, played_move, 16, score_before))
+
+
+class TestBudget(unittest.TestCase):
+
+    def test_unlimited(self):
+        limit = BudgetLimit()
+        self.assertFalse(limit.is_limited())
+        budget = limit.start()
+        budget.spend(10 ** 9)
+        self.assertFalse(budget.is_exhausted())
+
+    def test_nodes(self):
+        budget = BudgetLimit(nodes=1000).start()
+        budget.spend(600)
+        self.assertFalse(budget.is_exhausted())
+        budget.spend(600)
+        self.assertTrue(budget.is_exhausted())
+
+    def test_time(self):
+        self.assertTrue(BudgetLimit(seconds=0).start().is_exhausted())
+        self.assertFalse(BudgetLimit(seconds=60).start().is_exhausted())
+
+    def test_limit_string(self):
+        self.assertEqual(str(BudgetLimit(30, 5000000)), "30s or 5000000 nodes")
+        self.assertEqual(str(BudgetLimit()), "no limit")
+
+    def test_shared_between_processes(self):
+        budget = SharedBudget(BudgetLimit(nodes=1000))
+        processes = [multiprocessing.Process(target=budget.spend, args=(300,)) for _ in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        self.assertEqual(budget.nodes, 1200)
+        self.assertTrue(budget.is_exhausted())
+
+
+class TestCandidatePriority(unittest.TestCase):
+
+    def setUp(self):
+        self.puzzles = [
+            candidate(BOARD, "b8c6", Cp(-30), Cp(200)),
+            candidate(BOARD, "d8g5", Cp(-30), Cp(900)),
+            candidate(BOARD, "f7f6", Cp(-30), Mate(3)),
+            candidate(BOARD, "g8f6", Cp(-30), Cp(200)),
+        ]
+        # fewer pieces on the board
+        endgame = Board("4k3/8/8/8/8/8/4P3/4K2R w K - 0 1")
+        self.puzzles[3] = candidate(endgame, "h1h8", Cp(-30), Cp(200))
+
+    def test_swing(self):
+        self.assertEqual(candidate_swing(self.puzzles[0]), 230)
+        self.assertGreater(candidate_swing(self.puzzles[2]), candidate_swing(self.puzzles[1]))
+        self.assertEqual(candidate_swing(Puzzle(BOARD, Move.from_uci("b8c6"))), 0)
+
+    def test_largest_swings_and_least_material_first(self):
+        self.assertEqual(prioritized(self.puzzles), [2, 1, 3, 0])
+
+    def test_game_order_without_a_budget(self):
+        candidates = CandidateQueue(self.puzzles, [BudgetLimit().start()])
+        order = []
+        i = candidates.next()
+        while i is not None:
+            order.append(i)
+            i = candidates.next()
+        self.assertEqual(order, [0, 1, 2, 3])
+
+    def test_candidates_added_in_game_order(self):
+        candidates = CandidateQueue([], [BudgetLimit().start()])
+        candidates.add(self.puzzles[2])
+        self.assertEqual(candidates.next(), 0)
+        self.assertIsNone(candidates.next())
+        candidates.add(self.puzzles[0])
+        self.assertEqual(candidates.next(), 1)
+        self.assertEqual(candidates.puzzles, [self.puzzles[2], self.puzzles[0]])
+
+    def test_skips_candidates_once_over_budget(self):
+        budget = BudgetLimit(nodes=1000).start()
+        candidates = CandidateQueue(self.puzzles, [budget])
+        self.assertEqual(candidates.next(), 2)
+        budget.spend(1000)
+        self.assertIsNone(candidates.next())
+        self.assertEqual(candidates.skipped, [1, 3, 0])
+        self.assertTrue(self.puzzles[1].over_budget)
+        self.assertFalse(self.puzzles[1].is_complete())
+        self.assertFalse(self.puzzles[2].over_budget)
+
+
+class TestGameBudget(unittest.TestCase):
+
+    def setUp(self):
+        games = read_pgn_games([GAME_PGN], read_mainline_game, chess.pgn.skip_game)
+        _, self.game = next(games)
+
+    def test_ends_the_scan(self):
+        game_budget = BudgetLimit(nodes=5 * 2 ** SCAN_DEPTH).start()
+        with fake_engine(), AnalysisEngine.charging([game_budget]):
+            puzzles = find_puzzle_candidates(self.game, SCAN_DEPTH)
+            self.assertEqual(len(FakeEngine.searches), 5)
+        self.assertEqual(puzzles, [])
+
+    def test_abandons_a_long_candidate(self):
+        with fake_engine():
+            puzzle = find_puzzle_candidates(self.game, SCAN_DEPTH)[LONG_CANDIDATE]
+            FakeEngine.searches = []
+            puzzle.generate(SEARCH_DEPTH)
+            n_searches = len(FakeEngine.searches)
+        self.assertTrue(puzzle.is_complete())
+        with fake_engine():
+            puzzle = find_puzzle_candidates(self.game, SCAN_DEPTH)[LONG_CANDIDATE]
+            FakeEngine.searches = []
+            game_budget = BudgetLimit(nodes=2 ** SEARCH_DEPTH).start()
+            with AnalysisEngine.charging([game_budget]):
+                puzzle.generate(SEARCH_DEPTH)
+            self.assertLess(len(FakeEngine.searches), n_searches)
+        self.assertTrue(puzzle.over_budget)
+        self.assertFalse(puzzle.is_complete())
@@ -0,0 +1,112 @@
+import unittest
+
+from chess import Board, Move
+from chess.engine import Cp
+
+from puzzlemaker.analysis import AnalyzedMove
+from puzzlemaker.puzzle import Puzzle
+from puzzlemaker.puzzle_position import (
+    PuzzlePosition, deepening_stop_reason, DEEPENING_REJECTED, DEEPENING_STABLE
+)
+from puzzlemaker.search_limit import SearchLimit
+from puzzlemaker.constants import DEEPENING_ITERATIONS, DEEPENING_START_DEPTH, DEEPENING_DEPTH_STEP
+
+from test.unit.fake_engine import FakeEngine, fake_engine
+
+e4 = Move.from_uci("e2e4")
+d4 = Move.from_uci("d2d4")
+
+
+def candidate_moves(best_move, best_score, second_score):
+    return [
+        AnalyzedMove(best_move, None, Cp(best_score)),
+        AnalyzedMove(d4 if best_move == e4 else e4, None, Cp(second_score)),
+    ]
+
+
+class TestDeepening(unittest.TestCase):
+
+    def test_deepening_continues_at_first_depths(self):
+        history = [candidate_moves(e4, 300, 280)] * (DEEPENING_ITERATIONS - 1)
+        self.assertIsNone(deepening_stop_reason(history))
+
+    def test_rejecting_positions_ambiguous_at_every_depth(self):
+        history = [candidate_moves(e4, 300, 280)] * DEEPENING_ITERATIONS
+        self.assertEqual(deepening_stop_reason(history), DEEPENING_REJECTED)
+
+    def test_not_rejecting_positions_clear_at_some_depth(self):
+        history = [candidate_moves(e4, 500, 0)] + [candidate_moves(d4, 300, 280)] * DEEPENING_ITERATIONS
+        self.assertEqual(deepening_stop_reason(history), DEEPENING_STABLE)
+        history.append(candidate_moves(e4, 300, 280))
+        self.assertIsNone(deepening_stop_reason(history))
+
+    def test_stable_best_move(self):
+        history = [candidate_moves(e4, 500, 0)] * DEEPENING_ITERATIONS
+        self.assertEqual(deepening_stop_reason(history), DEEPENING_STABLE)
+
+
+class TestNextDeepeningLimit(unittest.TestCase):
+
+    def setUp(self):
+        self.position = PuzzlePosition(Board(), None)
+
+    def test_shallow_depths_first(self):
+        self.assertEqual(self.position._next_deepening_limit([], 22),
+                         SearchLimit(DEEPENING_START_DEPTH))
+        history = [candidate_moves(e4, 500, 0), candidate_moves(d4, 500, 0)]
+        self.assertEqual(self.position._next_deepening_limit(history, 22),
+                         SearchLimit(DEEPENING_START_DEPTH + 2 * DEEPENING_DEPTH_STEP))
+
+    def test_full_depth_once_stable(self):
+        history = [candidate_moves(e4, 500, 0)] * DEEPENING_ITERATIONS
+        self.assertEqual(self.position._next_deepening_limit(history, 22), SearchLimit(22))
+        self.assertFalse(self.position.rejected_early)
+
+    def test_full_depth_without_shallower_depths(self):
+        self.assertEqual(self.position._next_deepening_limit([], DEEPENING_START_DEPTH),
+                         SearchLimit(DEEPENING_START_DEPTH))
+
+    def test_rejected(self):
+        history = [candidate_moves(e4, 300, 280)] * DEEPENING_ITERATIONS
+        self.assertIsNone(self.position._next_deepening_limit(history, 22))
+        self.assertTrue(self.position.rejected_early)
+        self.assertEqual(self.position.best_move, e4)
+
+    def test_searches_of_a_stable_position(self):
+        # the shallow searches until the best move (exd5) is stable, then the full depth
+        position = PuzzlePosition(Board("4k3/8/8/3q4/4P3/8/8/4K3 w - - 0 1"), None)
+        with fake_engine():
+            position._deepen_candidate_moves(16)
+            depths = [limit.depth for _, limit, _, _ in FakeEngine.searches]
+        self.assertEqual(depths, [8, 10, 12, 16])
+
+
+class TestFinalScore(unittest.TestCase):
+
+    def final_position_puzzle(self, rejected_early):
+        puzzle = Puzzle(Board())
+        position = PuzzlePosition(Board(), e4)
+        position.candidate_moves = candidate_moves(d4, 300, 280)
+        position.score = Cp(300)
+        position.rejected_early = rejected_early
+        puzzle.positions = [position]
+        return puzzle
+
+    def test_final_position_searched_at_the_full_depth(self):
+        puzzle = self.final_position_puzzle(rejected_early=False)
+        with fake_engine():
+            puzzle._calculate_final_score(12)
+            self.assertEqual(FakeEngine.searches, [])
+        self.assertEqual(puzzle.final_score, Cp(300))
+
+    def test_final_position_rejected_early(self):
+        puzzle = self.final_position_puzzle(rejected_early=True)
+        with fake_engine():
+            puzzle._calculate_final_score(12)
+            self.assertEqual([(limit.depth, multipv) for _, limit, multipv, _ in FakeEngine.searches],
+                             [(12, None)])
+        self.assertNotEqual(puzzle.final_score, Cp(300))
+
+
+if __name__ == '__main__':
+    unittest.main()
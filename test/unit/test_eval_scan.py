@@ -0,0 +1,67 @@
+import io
+import unittest
+
+from puzzlemaker.analysis import AnalysisEngine, AnalyzedMove
+from puzzlemaker.pgn_reader import read_mainline_game
+from puzzlemaker.puzzle_finder import find_puzzle_candidates, swings_to_confirm
+from puzzlemaker.puzzle_finder import _boards_after, _pgn_evals
+
+# every move has an eval, so the scan doesn't need an engine
+EVAL_GAME = """[Event "Evals"]
+
+1. e4 { [%eval 0.3] } 1... e5 { [%eval 0.3] } 2. Qh5 { [%eval 0.1] }
+2... Nc6 { [%eval 0.2] } 3. Bc4 { [%eval 0.2] } 3... Nf6 { [%eval #1] } *
+"""
+
+
+class TestEvalScan(unittest.TestCase):
+
+    def test_scanning_with_evals(self):
+        searches = AnalysisEngine.stats.searches
+        game = read_mainline_game(io.StringIO(EVAL_GAME), keep_comments=True)
+        puzzles = find_puzzle_candidates(game, scan_depth=10, use_evals=True)
+        self.assertEqual(AnalysisEngine.stats.searches, searches)
+        self.assertEqual(len(puzzles), 1)
+        self.assertEqual(puzzles[0].initial_board.san(puzzles[0].initial_move), "Nf6")
+        self.assertIsNone(puzzles[0].scan_analysis.best_move)
+
+    def test_two_stage_scan_with_evals(self):
+        searches = AnalysisEngine.stats.searches
+        game = read_mainline_game(io.StringIO(EVAL_GAME), keep_comments=True)
+        puzzles = find_puzzle_candidates(game, scan_depth=10, use_evals=True, shallow_depth=4)
+        self.assertEqual(AnalysisEngine.stats.searches, searches)
+        self.assertEqual(len(puzzles), 1)
+        self.assertEqual(puzzles[0].initial_board.san(puzzles[0].initial_move), "Nf6")
+
+    def test_reverse_scan_with_evals(self):
+        game = read_mainline_game(io.StringIO(EVAL_GAME), keep_comments=True)
+        puzzles = find_puzzle_candidates(game, scan_depth=10, use_evals=True)
+        reversed_puzzles = find_puzzle_candidates(game, scan_depth=10, use_evals=True, reverse=True)
+        self.assertEqual(
+            [(p.initial_board.fen(), p.initial_move) for p in reversed_puzzles],
+            [(p.initial_board.fen(), p.initial_move) for p in puzzles],
+        )
+
+    def test_swings_to_confirm(self):
+        game = read_mainline_game(io.StringIO(EVAL_GAME), keep_comments=True)
+        moves = game.mainline_moves()
+        shallow_moves = [AnalyzedMove(None, None, score) for score in _pgn_evals(game)]
+        self.assertEqual(swings_to_confirm(game.board(), moves, shallow_moves, margin=0), {5})
+        self.assertEqual(swings_to_confirm(game.board(), moves, shallow_moves, margin=200),
+                         {0, 1, 2, 3, 4, 5})
+
+    def test_boards_after_each_ply(self):
+        game = read_mainline_game(io.StringIO(EVAL_GAME))
+        moves = game.mainline_moves()
+        fens = []
+        board = game.board()
+        for move in moves:
+            board.push(move)
+            fens.append(board.fen())
+        for plies in [range(len(moves)), range(len(moves) - 1, -1, -1), [1, 4, 5]]:
+            boards = [(i, board.fen()) for i, board in _boards_after(game.board(), moves, plies)]
+            self.assertEqual(boards, [(i, fens[i]) for i in plies])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+
+from chess import Board
+
+from puzzlemaker.puzzle_position import PuzzlePosition, exclusion_limit
+from puzzlemaker.search_limit import SearchLimit
+
+from test.unit.fake_engine import FakeEngine, fake_engine
+
+FENS = [
+    "6k1/R4p2/1r3npp/2N5/P1b2P2/6P1/3r2BP/4R1K1 w - - 0 34",
+    "r2n1rk1/1ppb2pp/1p1p4/3Ppq1n/2B3P1/2P4P/PP1N1P1K/R2Q1RN1 b - - 0 1",
+    "3q1r1k/2p4p/1p1pBrp1/p2Pp3/2PnP3/5PP1/PP1Q2K1/5R1R w - - 1 0",
+]
+DEPTH = 12
+
+
+class TestExclusionSearch(unittest.TestCase):
+
+    def test_same_candidate_moves_as_multipv(self):
+        with fake_engine():
+            for fen in FENS:
+                position = PuzzlePosition(Board(fen), None)
+                multipv = position._search_candidate_moves(DEPTH)
+                exclusion = position._search_candidate_moves(DEPTH, exclusion=True)
+                self.assertEqual([move.move for move in exclusion],
+                                 [move.move for move in multipv[:2]], fen)
+
+    def test_other_moves_search_is_capped(self):
+        with fake_engine():
+            position = PuzzlePosition(Board(FENS[0]), None)
+            best_move, _ = position._search_candidate_moves(DEPTH, exclusion=True)
+            self.assertEqual(len(FakeEngine.searches), 2)
+            _, limit, _, root_moves = FakeEngine.searches[1]
+        self.assertNotIn(best_move.move, root_moves)
+        self.assertEqual(limit.depth, DEPTH)
+        self.assertEqual(limit.nodes, best_move.reached.nodes // 2)
+
+    def test_exclusion_limit(self):
+        self.assertEqual(exclusion_limit(22, None), SearchLimit(22))
+        self.assertEqual(exclusion_limit(22, SearchLimit(22, 1000)), SearchLimit(22, 500))
+        self.assertEqual(exclusion_limit(SearchLimit(22, 300), SearchLimit(22, 1000)),
+                         SearchLimit(22, 300))
@@ -0,0 +1,78 @@
+import io
+import unittest
+
+from chess.pgn import Headers
+
+from puzzlemaker.game_filter import GameFilter, time_control_category
+from puzzlemaker.pgn_reader import read_mainline_game
+
+BLITZ_GAME = """[Event "Rated Blitz game"]
+[WhiteElo "1850"]
+[BlackElo "2010"]
+[TimeControl "180+2"]
+[Termination "Normal"]
+
+1. e4 e5 2. Nf3 Nc6 3. Bb5 a6 1-0
+"""
+
+
+class TestGameFilter(unittest.TestCase):
+
+    def headers(self, **kwargs):
+        headers = Headers()
+        headers.update(kwargs)
+        return headers
+
+    def test_time_control_categories(self):
+        self.assertEqual(time_control_category("15+0"), "ultrabullet")
+        self.assertEqual(time_control_category("60+0"), "bullet")
+        self.assertEqual(time_control_category("180+2"), "blitz")
+        self.assertEqual(time_control_category("300+5"), "rapid")
+        self.assertEqual(time_control_category("1800+20"), "classical")
+        self.assertEqual(time_control_category("40/7200:3600"), "classical")
+        self.assertEqual(time_control_category("-"), "correspondence")
+        self.assertIsNone(time_control_category("?"))
+
+    def test_elo_range(self):
+        game_filter = GameFilter(min_elo=1800, max_elo=2200)
+        self.assertIsNone(game_filter.check_headers(self.headers(WhiteElo="1850", BlackElo="2010")))
+        self.assertIsNotNone(game_filter.check_headers(self.headers(WhiteElo="1750", BlackElo="2010")))
+        self.assertIsNotNone(game_filter.check_headers(self.headers(WhiteElo="1850", BlackElo="2300")))
+        self.assertIsNotNone(game_filter.check_headers(self.headers(WhiteElo="?", BlackElo="2010")))
+
+    def test_time_controls_variants_and_terminations(self):
+        game_filter = GameFilter(time_controls=["blitz", "600+0"], variants=["Standard"],
+                                 terminations=["normal"])
+        headers = self.headers(TimeControl="180+2", Termination="Normal")
+        self.assertIsNone(game_filter.check_headers(headers))
+        headers["TimeControl"] = "600+0"
+        self.assertIsNone(game_filter.check_headers(headers))
+        headers["TimeControl"] = "60+0"
+        self.assertIsNotNone(game_filter.check_headers(headers))
+        headers["TimeControl"] = "180+2"
+        headers["Variant"] = "Atomic"
+        self.assertIsNotNone(game_filter.check_headers(headers))
+        del headers["Variant"]
+        headers["Termination"] = "Abandoned"
+        self.assertIsNotNone(game_filter.check_headers(headers))
+
+    def test_min_plies(self):
+        game_filter = GameFilter(min_plies=10)
+        self.assertIsNotNone(game_filter.check_headers(self.headers(PlyCount="3")))
+        self.assertIsNone(game_filter.check_headers(self.headers(PlyCount="30")))
+        self.assertIsNone(game_filter.check_headers(self.headers()))
+        self.assertIsNotNone(game_filter.check_plies(5))
+
+    def test_rejected_games_are_not_parsed(self):
+        game = read_mainline_game(io.StringIO(BLITZ_GAME), game_filter=GameFilter(min_elo=2000))
+        self.assertIsNotNone(game.rejected)
+        self.assertEqual(game.mainline_moves(), [])
+        game = read_mainline_game(io.StringIO(BLITZ_GAME), game_filter=GameFilter(min_plies=10))
+        self.assertEqual(game.rejected, "6 plies")
+        game = read_mainline_game(io.StringIO(BLITZ_GAME), game_filter=GameFilter(time_controls=["blitz"]))
+        self.assertIsNone(game.rejected)
+        self.assertEqual(len(game.mainline_moves()), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+
+from chess import Board, Move
+from chess.engine import Cp, Mate
+
+from puzzlemaker.analysis import AnalyzedMove
+from puzzlemaker.puzzle import mating_line, mate_score_after, player_mates
+from puzzlemaker.puzzle_position import PuzzlePosition
+
+# after 1. e4 f6, white mates with 2. d4 g5 3. Qh5#
+MATE_IN_2 = 'rnbqkbnr/ppppp1pp/5p2/8/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2'
+MATING_LINE = [Move.from_uci(uci) for uci in ["d2d4", "g7g5", "d1h5"]]
+
+
+def mate_position(score, last_move=None):
+    position = PuzzlePosition(Board(MATE_IN_2), last_move)
+    position.candidate_moves = [AnalyzedMove(MATING_LINE[0], "d4", score, MATING_LINE)]
+    position.score = score
+    return position
+
+
+class TestMateLines(unittest.TestCase):
+
+    def test_mating_line_stops_at_checkmate(self):
+        pv = MATING_LINE + [Move.from_uci("a2a3")]
+        self.assertEqual(mating_line(Board(MATE_IN_2), pv), MATING_LINE)
+
+    def test_pv_without_checkmate(self):
+        self.assertIsNone(mating_line(Board(MATE_IN_2), MATING_LINE[:2]))
+        self.assertIsNone(mating_line(Board(MATE_IN_2), None))
+
+    def test_pv_with_an_illegal_move(self):
+        pv = [MATING_LINE[0], Move.from_uci("e2e4")]
+        self.assertIsNone(mating_line(Board(MATE_IN_2), pv))
+
+    def test_mate_score_goes_down_after_the_mating_move(self):
+        board = Board(MATE_IN_2)
+        self.assertEqual(mate_score_after(Mate(2), board), Mate(1))
+        board.push(MATING_LINE[0])
+        self.assertEqual(mate_score_after(Mate(1), board), Mate(1))
+
+    def test_mate_score_for_black(self):
+        board = Board(MATE_IN_2)
+        self.assertEqual(mate_score_after(Mate(-2), board), Mate(-2))
+        board.push(MATING_LINE[0])
+        self.assertEqual(mate_score_after(Mate(-2), board), Mate(-1))
+
+    def test_player_mates(self):
+        self.assertTrue(player_mates(mate_position(Mate(2)), True))
+        self.assertFalse(player_mates(mate_position(Mate(2)), False))
+        self.assertTrue(player_mates(mate_position(Mate(-2)), False))
+        self.assertFalse(player_mates(mate_position(Cp(500)), True))
@@ -0,0 +1,86 @@
+import os
+import struct
+import tempfile
+import unittest
+
+from chess import Board, Move
+from chess.engine import Cp
+import chess.polyglot
+
+from puzzlemaker.opening_book import OpeningBook, open_book
+from puzzlemaker.puzzle_finder import _known_scores
+from puzzlemaker.pgn_reader import MainlineGame
+
+# 1. e4 e5 2. Nf3 Nc6 3. Bb5 a6
+MOVES = [Move.from_uci(uci) for uci in ["e2e4", "e7e5", "g1f3", "b8c6", "f1b5", "a7a6"]]
+
+
+def write_polyglot_book(path, moves):
+    """ A Polyglot book with one entry for each move of a line
+    """
+    board = Board()
+    entries = []
+    for move in moves:
+        raw_move = move.to_square | (move.from_square << 6)
+        entries.append((chess.polyglot.zobrist_hash(board), raw_move))
+        board.push(move)
+    with open(path, "wb") as f:
+        for key, raw_move in sorted(entries):
+            f.write(struct.pack(">QHHI", key, raw_move, 1, 0))
+
+
+class TestOpeningBook(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "book.bin")
+        write_polyglot_book(self.path, MOVES[:4])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_polyglot_book(self):
+        book = OpeningBook(self.path)
+        self.assertEqual(book.book_plies(Board(), MOVES), 4)
+        book.close()
+
+    def test_game_leaves_book_at_first_move_not_in_it(self):
+        book = OpeningBook(self.path)
+        moves = [MOVES[0], Move.from_uci("c7c5")] + MOVES[2:]
+        self.assertEqual(book.book_plies(Board(), moves), 1)
+        book.close()
+
+    def test_first_plies(self):
+        self.assertEqual(OpeningBook(plies=3).book_plies(Board(), MOVES), 3)
+        self.assertEqual(OpeningBook(plies=10).book_plies(Board(), MOVES), len(MOVES))
+
+    def test_first_plies_and_polyglot_book(self):
+        book = OpeningBook(self.path, plies=2)
+        self.assertEqual(book.book_plies(Board(), MOVES), 4)
+        moves = [MOVES[0], Move.from_uci("c7c5")] + MOVES[2:]
+        self.assertEqual(book.book_plies(Board(), moves), 2)
+        book.close()
+
+    def test_no_book(self):
+        self.assertIsNone(open_book())
+        self.assertIsNotNone(open_book(plies=8))
+
+
+class TestBookScores(unittest.TestCase):
+
+    def setUp(self):
+        self.game = MainlineGame({}, Board())
+        self.game.moves = MOVES
+
+    def test_book_plies_keep_an_even_score(self):
+        # the last book ply is searched
+        self.assertEqual(_known_scores(self.game, False, 4), [Cp(0)] * 3)
+        self.assertEqual(_known_scores(self.game, False, 1), [])
+        self.assertEqual(_known_scores(self.game, False, 0), [])
+
+    def test_evals_are_kept_in_book(self):
+        self.game.comments = ["[%eval 0.3]", "", "", "[%eval 0.5]", "", ""]
+        self.assertEqual(
+            _known_scores(self.game, True, 3),
+            [Cp(30), Cp(0), None, Cp(50), None, None]
+        )
@@ -0,0 +1,96 @@
+import bz2
+import gzip
+import io
+import lzma
+import os
+import tempfile
+import unittest
+
+import chess.pgn
+
+from puzzlemaker.pgn_files import pgn_file_paths, open_pgn, read_game_text, read_pgn_games
+
+FIXTURES = ["5-22-duskbreaker.pgn", "carlsen-anand-blunder.wc2014.pgn", "wtharvey.pgn"]
+
+
+def fixture_text(pgn_filename) -> str:
+    cur_dir = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(cur_dir, '..', 'fixtures', pgn_filename)) as f:
+        return f.read()
+
+
+def read_headers(pgn):
+    headers = chess.pgn.read_headers(pgn)
+    return headers and headers["Event"]
+
+def read_first_move(pgn):
+    game = chess.pgn.read_game(pgn)
+    return game and game.board().san(game.variations[0].move)
+
+
+class TestPgnFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.games = [fixture_text(filename).strip() + "\n\n" for filename in FIXTURES]
+        self.paths = []
+        for i, opener in enumerate([open, gzip.open, bz2.open, lzma.open]):
+            extension = ["", ".gz", ".bz2", ".xz"][i]
+            path = os.path.join(self.tmp_dir.name, "%d.pgn%s" % (i, extension))
+            with opener(path, "wt") as f:
+                f.write("".join(self.games))
+            self.paths.append(path)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def events(self):
+        return [chess.pgn.read_headers(io.StringIO(game))["Event"] for game in self.games]
+
+    def test_pgn_file_paths(self):
+        self.assertEqual(pgn_file_paths(self.tmp_dir.name), self.paths)
+        self.assertEqual(pgn_file_paths(os.path.join(self.tmp_dir.name, "*.pgn.?z")), [self.paths[1], self.paths[3]])
+        self.assertEqual(pgn_file_paths("-"), ["-"])
+
+    def test_reading_compressed_files(self):
+        for path in self.paths:
+            with open_pgn(path) as pgn:
+                self.assertEqual(pgn.read(), "".join(self.games))
+
+    def test_reading_game_texts(self):
+        with open_pgn(self.paths[0]) as pgn:
+            for game in self.games:
+                self.assertEqual(read_game_text(pgn).strip(), game.strip())
+            self.assertIsNone(read_game_text(pgn))
+
+    def test_selecting_games_across_files(self):
+        events = self.events() * len(self.paths)
+        games = list(read_pgn_games(self.paths, read_headers, chess.pgn.skip_game))
+        self.assertEqual(games, list(enumerate(events)))
+        games = list(read_pgn_games(self.paths, read_headers, chess.pgn.skip_game, 2, 10))
+        self.assertEqual(games, list(enumerate(events))[2:10])
+        games = list(read_pgn_games(self.paths, read_headers, chess.pgn.skip_game, game_ids=[11, 1, 4]))
+        self.assertEqual(games, [(i, events[i]) for i in [1, 4, 11]])
+
+    def test_same_game_ids_with_and_without_an_index(self):
+        games = ['[Event "A"]\n\n1. e4 *\n\n', '1. d4 *\n\n', '[Event "C"]\n\n1. c4 *\n\n',
+                 '[Event "D"]\n\n1. Nf3 *\n\n']
+        paths = [os.path.join(self.tmp_dir.name, "tagless.pgn" + extension) for extension in ["", ".gz"]]
+        for path, opener in zip(paths, [open, gzip.open]):
+            with opener(path, "wt") as f:
+                f.write("".join(games))
+        for path in paths:
+            self.assertEqual(list(read_pgn_games([path], read_first_move, chess.pgn.skip_game, 2)),
+                             [(2, "c4"), (3, "Nf3")])
+            self.assertEqual(list(read_pgn_games([path], read_first_move, chess.pgn.skip_game,
+                                                 game_ids=[1])),
+                             [(1, "d4")])
+        # the games of a file after it are numbered the same way too
+        for path in paths:
+            self.assertEqual(list(read_pgn_games([path, self.paths[0]], read_headers,
+                                                 chess.pgn.skip_game, 4, 5)),
+                             [(4, self.events()[0])])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import tempfile
+import unittest
+
+import chess.pgn
+
+from puzzlemaker.pgn_index import PgnIndex
+
+
+def fixture_path(pgn_filename) -> str:
+    cur_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(cur_dir, '..', 'fixtures', pgn_filename)
+
+
+class TestPgnIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "games.pgn")
+        with open(self.path, "w") as pgn:
+            for filename in ["5-22-duskbreaker.pgn", "carlsen-anand-blunder.wc2014.pgn", "wtharvey.pgn"]:
+                with open(fixture_path(filename)) as f:
+                    pgn.write(f.read().strip() + "\n\n")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def read_all_games(self):
+        games = []
+        with open(self.path) as pgn:
+            while True:
+                game = chess.pgn.read_game(pgn)
+                if game is None:
+                    return games
+                games.append(game)
+
+    def test_indexes_every_game(self):
+        self.assertEqual(len(PgnIndex.build(self.path)), len(self.read_all_games()))
+
+    def test_reading_games_by_index(self):
+        games = self.read_all_games()
+        index = PgnIndex.build(self.path)
+        with open(self.path) as pgn:
+            for game_id in reversed(range(len(games))):
+                pgn.seek(index.offset(game_id))
+                self.assertEqual(str(chess.pgn.read_game(pgn)), str(games[game_id]))
+
+    def test_games_without_tags(self):
+        with open(self.path, "w") as pgn:
+            pgn.write('[Event "A"]\n\n1. e4 *\n\n1. d4 *\n\n\n[Event "C"]\n\n1. c4 *\n')
+        index = PgnIndex.build(self.path)
+        self.assertEqual(len(index), 3)
+        with open(self.path) as pgn:
+            pgn.seek(index.offset(1))
+            self.assertEqual(str(chess.pgn.read_game(pgn).mainline_moves()), "1. d4")
+
+    def test_index_is_saved_and_reused(self):
+        index = PgnIndex.open(self.path)
+        self.assertTrue(os.path.exists(PgnIndex.index_path(self.path)))
+        loaded = PgnIndex.load(self.path)
+        self.assertEqual(list(loaded.offsets), list(index.offsets))
+
+    def test_index_is_rebuilt_when_the_pgn_changes(self):
+        n_games = len(PgnIndex.open(self.path))
+        with open(self.path, "a") as pgn:
+            with open(fixture_path("wtharvey.pgn")) as f:
+                pgn.write(f.read())
+        self.assertIsNone(PgnIndex.load(self.path))
+        self.assertEqual(len(PgnIndex.open(self.path)), n_games + 1)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
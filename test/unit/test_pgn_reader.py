@@ -0,0 +1,74 @@
+import io
+import unittest
+
+import chess
+import chess.pgn
+from chess.engine import Cp, Mate
+
+from puzzlemaker.pgn_reader import read_mainline_game, parse_eval
+
+ANNOTATED_PGN = """[Event "Annotated"]
+[White "A"]
+[Black "B"]
+[Result "1-0"]
+
+1. e4 { [%eval 0.3] } 1... e5 (1... c5 { Sicilian } 2. Nf3 (2. c3) 2... d6) 2. Nf3 $1
+{ [%eval 0.25] } { [%clk 0:01:00] } 2... Nc6 3. Bb5 ?! 1-0
+
+[Event "From a position"]
+[FEN "6k1/5ppp/8/8/8/8/5PPP/R5K1 w - - 0 1"]
+[SetUp "1"]
+
+1. Ra8# 1-0
+"""
+
+
+class TestPgnReader(unittest.TestCase):
+
+    def read_games(self, reader, **kwargs):
+        games = []
+        pgn = io.StringIO(ANNOTATED_PGN)
+        while True:
+            game = reader(pgn, **kwargs)
+            if game is None:
+                return games
+            games.append(game)
+
+    def test_mainline_matches_full_game(self):
+        games = self.read_games(chess.pgn.read_game)
+        mainline_games = self.read_games(read_mainline_game)
+        self.assertEqual(len(mainline_games), len(games))
+        for game, mainline_game in zip(games, mainline_games):
+            self.assertEqual(list(mainline_game.mainline_moves()), list(game.mainline_moves()))
+            self.assertEqual(dict(mainline_game.headers), dict(game.headers))
+            self.assertEqual(mainline_game.board().fen(), game.board().fen())
+
+    def test_comments_are_only_kept_if_needed(self):
+        game = self.read_games(read_mainline_game)[0]
+        self.assertEqual(game.comments, [])
+        game = self.read_games(read_mainline_game, keep_comments=True)[0]
+        self.assertEqual(game.comments, ["[%eval 0.3]", "", "[%eval 0.25] [%clk 0:01:00]", "", ""])
+
+    def test_exported_game_has_no_variations(self):
+        game = self.read_games(read_mainline_game)[0].to_game()
+        self.assertTrue(all(len(node.variations) <= 1 for node in game.mainline()))
+        self.assertEqual(game.headers["White"], "A")
+
+    def test_parsing_evals(self):
+        self.assertEqual(parse_eval("[%eval 0.34]"), Cp(34))
+        self.assertEqual(parse_eval("[%eval -1.5] [%clk 0:01:00]"), Cp(-150))
+        self.assertEqual(parse_eval("[%eval 2.05,24]"), Cp(205))
+        self.assertEqual(parse_eval("[%eval #-3]"), Mate(-3))
+        self.assertEqual(parse_eval("[%eval #2]"), Mate(2))
+        self.assertIsNone(parse_eval("[%clk 0:01:00]"))
+        self.assertIsNone(parse_eval(""))
+
+    def test_illegal_moves_are_errors(self):
+        pgn = io.StringIO('[Event "Illegal"]\n\n1. e4 e5 2. Ke3 Nc6 *\n')
+        game = read_mainline_game(pgn)
+        self.assertEqual(len(game.errors), 1)
+        self.assertEqual(game.mainline_moves(), [chess.Move.from_uci("e2e4"), chess.Move.from_uci("e7e5")])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import os
+import threading
+import time
+import unittest
+from unittest import mock
+
+import chess.pgn
+
+from puzzlemaker.budget import BudgetLimit, prioritized
+from puzzlemaker.pgn_files import read_pgn_games
+from puzzlemaker.pgn_reader import read_mainline_game
+from puzzlemaker.pipeline import PuzzlePipeline
+from puzzlemaker.puzzle_finder import find_puzzle_candidates
+
+from test.unit.fake_engine import fake_engine
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "..", "fixtures")
+GAMES_PGNS = [
+    os.path.join(FIXTURES, "carlsen-anand-blunder.wc2014.pgn"),
+    os.path.join(FIXTURES, "wtharvey.pgn"),
+]
+SCAN_DEPTH = 8
+SEARCH_DEPTH = 10
+
+
+def read_games(n_games=2):
+    games = read_pgn_games(GAMES_PGNS, read_mainline_game, chess.pgn.skip_game)
+    return [game for _, game in zip(range(n_games), games)]
+
+def puzzle_pgns(game, puzzles):
+    return [puzzle.to_pgn(pgn_headers=game.headers) for puzzle in puzzles if puzzle.is_complete()]
+
+def run_pipeline(pipeline, games, timeout=60):
+    """ The pipeline's results, or its error. Fails instead of hanging
+    """
+    results = []
+    errors = []
+
+    def run():
+        try:
+            for game_id, game, puzzles in pipeline.process(games):
+                results.append((game_id, puzzle_pgns(game, puzzles)))
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        raise AssertionError("the pipeline didn't finish")
+    if errors:
+        raise errors[0]
+    return results
+
+
+class TestPuzzlePipeline(unittest.TestCase):
+
+    def test_same_output_as_serial_mode(self):
+        games = read_games()
+        with fake_engine():
+            serial = []
+            for game_id, game in games:
+                puzzles = find_puzzle_candidates(game, SCAN_DEPTH)
+                for puzzle in puzzles:
+                    puzzle.generate(SEARCH_DEPTH)
+                serial.append((game_id, puzzle_pgns(game, puzzles)))
+        self.assertTrue(any(pgns for _, pgns in serial))
+        with fake_engine(3):
+            pipeline = PuzzlePipeline(SCAN_DEPTH, SEARCH_DEPTH, n_generators=2, queue_size=1)
+            self.assertEqual(run_pipeline(pipeline, games), serial)
+
+    def test_stages_wait_for_a_slow_caller(self):
+        _, game = read_games(2)[1]
+        n_read = []
+
+        def games():
+            for game_id in range(20):
+                n_read.append(game_id)
+                yield game_id, game
+
+        with fake_engine(2):
+            pipeline = PuzzlePipeline(SCAN_DEPTH, SEARCH_DEPTH, queue_size=1)
+            results = pipeline.process(games())
+            next(results)
+            time.sleep(2)
+            self.assertLess(len(n_read), 10)
+            self.assertEqual([game_id for game_id, _, _ in results], list(range(1, 20)))
+
+    def test_generate_failure(self):
+        with fake_engine(2), mock.patch("puzzlemaker.puzzle.Puzzle.generate",
+                                        side_effect=RuntimeError("generate")):
+            pipeline = PuzzlePipeline(SCAN_DEPTH, SEARCH_DEPTH, queue_size=1)
+            with self.assertRaisesRegex(RuntimeError, "generate"):
+                run_pipeline(pipeline, read_games())
+
+    def test_parse_failure(self):
+        def games():
+            yield from read_games(1)
+            raise ValueError("parse")
+
+        with fake_engine(2):
+            pipeline = PuzzlePipeline(SCAN_DEPTH, SEARCH_DEPTH, queue_size=1)
+            with self.assertRaisesRegex(ValueError, "parse"):
+                run_pipeline(pipeline, games())
+
+    def test_most_promising_candidates_first_within_a_budget(self):
+        run_budget = BudgetLimit(nodes=10 ** 12).start()
+        generated = []
+
+        def generate(puzzle, depth, **kwargs):
+            generated.append(puzzle)
+            if len(generated) == 2:
+                run_budget.spend(10 ** 12)
+
+        with fake_engine(2), mock.patch("puzzlemaker.puzzle.Puzzle.generate", autospec=True,
+                                        side_effect=generate):
+            pipeline = PuzzlePipeline(SCAN_DEPTH, SEARCH_DEPTH, queue_size=1,
+                                      run_budget=run_budget)
+            results = list(pipeline.process(read_games()))
+        puzzles = results[0][2] + results[1][2]
+        self.assertGreater(len(results[0][2]), 2)
+        self.assertEqual(generated, [results[0][2][i] for i in prioritized(results[0][2])][:2])
+        self.assertEqual([puzzle.over_budget for puzzle in puzzles].count(False), 2)
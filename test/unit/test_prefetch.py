@@ -0,0 +1,75 @@
+import unittest
+from concurrent.futures import wait
+
+from chess import Board
+
+from puzzlemaker.analysis import AnalysisEngine
+from puzzlemaker.constants import NUM_CANDIDATE_MOVES, DEEPENING_START_DEPTH
+from puzzlemaker.prefetch import PvPrefetcher
+from puzzlemaker.puzzle import Puzzle
+
+from test.unit.fake_engine import FakeEngine, fake_engine
+
+FEN = "r2n1rk1/1ppb2pp/1p1p4/3Ppq1n/2B3P1/2P4P/PP1N1P1K/R2Q1RN1 b - - 0 1"
+DEPTH = 12
+
+
+def prefetched(prefetcher: PvPrefetcher, deepening=False):
+    """ Prefetches the line from FEN and returns the predicted position
+        after its first 2 moves with its analysis
+    """
+    board = Board(FEN)
+    pv = AnalysisEngine.best_move(board, DEPTH).pv
+    FakeEngine.searches = []
+    prefetcher.prefetch(board, pv)
+    wait([future for future, _ in prefetcher._futures.values()])
+    board.push(pv[0])
+    board.push(pv[1])
+    return board, prefetcher.result(board, deepening)
+
+def searched_depths(board, multipv=None):
+    return [limit.depth for fen, limit, search_multipv, _ in FakeEngine.searches
+            if fen == board.fen() and search_multipv == multipv]
+
+
+class TestPvPrefetcher(unittest.TestCase):
+
+    def test_same_analysis_as_evaluate(self):
+        with fake_engine(2):
+            prefetcher = PvPrefetcher(DEPTH, 2)
+            board, position = prefetched(prefetcher)
+            prefetcher.close()
+        self.assertEqual(len(position.candidate_moves), NUM_CANDIDATE_MOVES)
+        self.assertEqual(searched_depths(board, NUM_CANDIDATE_MOVES), [DEPTH])
+
+    def test_exclusion(self):
+        with fake_engine(2):
+            prefetcher = PvPrefetcher(DEPTH, 2, exclusion=True)
+            board, position = prefetched(prefetcher)
+            prefetcher.close()
+        self.assertEqual(len(position.candidate_moves), 2)
+        self.assertEqual(searched_depths(board, NUM_CANDIDATE_MOVES), [])
+
+    def test_deepening(self):
+        with fake_engine(2):
+            prefetcher = PvPrefetcher(DEPTH, 2, deepening=True)
+            prefetcher.deepening_turn = Board(FEN).turn
+            board, position = prefetched(prefetcher, deepening=True)
+            prefetcher.close()
+        self.assertIsNotNone(position)
+        self.assertEqual(searched_depths(board, NUM_CANDIDATE_MOVES)[0], DEEPENING_START_DEPTH)
+
+    def test_not_deepened_before_the_turn_is_known(self):
+        with fake_engine(2):
+            prefetcher = PvPrefetcher(DEPTH, 2, deepening=True)
+            board, position = prefetched(prefetcher, deepening=True)
+            prefetcher.close()
+        self.assertIsNone(position)
+        self.assertEqual(searched_depths(board, NUM_CANDIDATE_MOVES), [DEPTH])
+
+    def test_exclusion_search_with_prefetch(self):
+        with fake_engine(3):
+            puzzle = Puzzle(Board(FEN), None)
+            puzzle.generate(DEPTH, prefetch_plies=4, exclusion=True)
+        self.assertEqual([search for search in FakeEngine.searches
+                          if search[2] == NUM_CANDIDATE_MOVES], [])
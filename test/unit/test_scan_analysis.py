@@ -0,0 +1,43 @@
+import os
+import unittest
+
+import chess.pgn
+
+from puzzlemaker.pgn_files import read_pgn_games
+from puzzlemaker.pgn_reader import read_mainline_game
+from puzzlemaker.puzzle_finder import find_puzzle_candidates
+
+from test.unit.fake_engine import FakeEngine, fake_engine
+
+GAME_PGN = os.path.join(os.path.dirname(__file__), "..", "fixtures",
+                        "carlsen-anand-blunder.wc2014.pgn")
+
+
+def best_move_searches(puzzle, depth):
+    """ The searches for the best move of the puzzle's initial board
+    """
+    fen = puzzle.initial_board.fen()
+    return [search for search in FakeEngine.searches
+            if search[0] == fen and search[1].depth == depth and search[3] is None]
+
+
+class TestScanAnalysis(unittest.TestCase):
+
+    def setUp(self):
+        games = read_pgn_games([GAME_PGN], read_mainline_game, chess.pgn.skip_game)
+        _, self.game = next(games)
+
+    def test_best_move_of_a_scan_as_deep_as_the_search(self):
+        with fake_engine():
+            puzzle = find_puzzle_candidates(self.game, scan_depth=10)[0]
+            FakeEngine.searches = []
+            puzzle.generate(10)
+            self.assertEqual(best_move_searches(puzzle, 10), [])
+        self.assertEqual(puzzle.analyzed_moves[0], puzzle.scan_analysis.best_move)
+
+    def test_best_move_of_a_shallower_scan(self):
+        with fake_engine():
+            puzzle = find_puzzle_candidates(self.game, scan_depth=8)[0]
+            FakeEngine.searches = []
+            puzzle.generate(10)
+            self.assertEqual(len(best_move_searches(puzzle, 10)), 1)
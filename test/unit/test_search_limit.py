@@ -0,0 +1,68 @@
+import unittest
+
+from chess import Board
+
+from puzzlemaker.analysis_cache import AnalysisCache
+from puzzlemaker.puzzle_position import deepening_limits
+from puzzlemaker.search_limit import SearchLimit, search_limit, reached_limit
+
+
+class TestSearchLimit(unittest.TestCase):
+
+    def test_plain_depth(self):
+        self.assertEqual(search_limit(22), SearchLimit(22))
+        self.assertEqual(search_limit(SearchLimit(22, 5000000)), SearchLimit(22, 5000000))
+        self.assertFalse(search_limit(22).is_capped())
+        self.assertEqual(str(search_limit(22)), "depth 22")
+
+    def test_combined_limit(self):
+        limit = SearchLimit(22, 5000000, 1.5)
+        self.assertTrue(limit.is_capped())
+        self.assertEqual(str(limit), "depth 22 or 5000000 nodes or 1.5s")
+        engine_limit = limit.engine_limit(mate=3)
+        self.assertEqual(
+            (engine_limit.depth, engine_limit.nodes, engine_limit.time, engine_limit.mate),
+            (22, 5000000, 1.5, 3)
+        )
+
+    def test_covers(self):
+        self.assertTrue(search_limit(22).covers(search_limit(16)))
+        self.assertFalse(search_limit(16).covers(search_limit(22)))
+        # an unlimited number of nodes goes further than any number
+        self.assertTrue(search_limit(22).covers(SearchLimit(22, 1000)))
+        self.assertFalse(SearchLimit(22, 1000).covers(search_limit(22)))
+        self.assertTrue(SearchLimit(22, 2000).covers(SearchLimit(16, 1000)))
+
+    def test_is_reached(self):
+        limit = SearchLimit(22, 1000)
+        self.assertTrue(limit.is_reached(22, {"nodes": 10}))
+        self.assertTrue(limit.is_reached(14, {"nodes": 1000}))
+        self.assertFalse(limit.is_reached(14, {"nodes": 10}))
+        self.assertTrue(SearchLimit(None, time=0.5).is_reached(8, [{"time": 0.6}]))
+
+    def test_reached_depth(self):
+        self.assertEqual(search_limit(22).reached_depth({"depth": 30}), 22)
+        self.assertEqual(SearchLimit(22, 1000).reached_depth({"depth": 14}), 14)
+        self.assertEqual(SearchLimit(22, 1000).reached_depth({"depth": 30}), 22)
+        self.assertEqual(SearchLimit(None, 1000).reached_depth([{"depth": 14}]), 14)
+
+    def test_reached_limit(self):
+        self.assertEqual(reached_limit({"depth": 14, "nodes": 1000}), SearchLimit(14, 1000))
+
+    def test_deepening_limits_keep_the_budget(self):
+        limits = deepening_limits(SearchLimit(16, 1000))
+        self.assertTrue(limits)
+        self.assertTrue(all(limit.nodes == 1000 and limit.depth < 16 for limit in limits))
+        self.assertEqual(deepening_limits(SearchLimit(None, 1000)), [])
+
+
+class TestCappedCacheEntries(unittest.TestCase):
+
+    def test_result_that_ran_out_of_nodes(self):
+        cache = AnalysisCache()
+        key = cache.key(Board(), "engine")
+        cache.put(key, 14, {"depth": 14, "nodes": 1000})
+        self.assertIsNotNone(cache.get(key, SearchLimit(22, 1000)))
+        self.assertIsNotNone(cache.get(key, 12))
+        self.assertIsNone(cache.get(key, SearchLimit(22, 2000)))
+        self.assertIsNone(cache.get(key, 22))
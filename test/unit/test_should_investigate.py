@@ -141,6 +141,30 @@ class TestShouldInvestigate(unittest.TestCase):
         b = Cp(9)
         self.assertFalse(should_investigate(a, b, board))
 
+    def test_investigating_near_misses_with_margin(self):
+        score_changes = [
+            [0, 80],
+            [130, 230],
+            [180, 140],
+            [180, -20],
+        ]
+        for a, b in score_changes:
+            a = Cp(a)
+            b = Cp(b)
+            self.assertFalse(should_investigate(a, b, board))
+            self.assertTrue(should_investigate(a, b, board, margin=50))
+
+    def test_not_investigating_quiet_moves_with_margin(self):
+        score_changes = [
+            [0, 0],
+            [20, 30],
+            [300, 320],
+        ]
+        for a, b in score_changes:
+            a = Cp(a)
+            b = Cp(b)
+            self.assertFalse(should_investigate(a, b, board, margin=50))
+
 
 if __name__ == '__main__':
     unittest.main()
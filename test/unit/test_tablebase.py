@@ -0,0 +1,140 @@
+import os
+import tempfile
+import unittest
+
+import chess
+from chess import Board, Move
+from chess.engine import Cp, Mate
+
+from puzzlemaker.analysis import AnalysisEngine, ambiguous_best_move
+from puzzlemaker.puzzle import Puzzle
+from puzzlemaker.puzzle_position import PuzzlePosition
+from puzzlemaker.tablebase import (
+    Tablebase, tablebase_score, is_tablebase_win, TABLEBASE_WIN_SCORE, TABLEBASE_PV_PLIES
+)
+
+# a directory with at least the 3 and 4-piece Syzygy tables, e.g. from
+# https://tablebase.lichess.ovh/tables/standard/3-4-5/
+SYZYGY_PATH = os.environ.get("SYZYGY_PATH")
+
+
+class FakeTables(object):
+    """ Stands in for the KQvK tables: the side with the queen wins, in
+        fewer moves the closer the kings are
+    """
+    wdl = {"KQvK": None}
+
+    def get_wdl(self, board):
+        return 2 if board.pieces(chess.QUEEN, board.turn) else -2
+
+    def get_dtz(self, board, default=None):
+        distance = chess.square_distance(board.king(chess.WHITE), board.king(chess.BLACK))
+        return self.get_wdl(board) // 2 * distance
+
+
+class TestTablebaseScores(unittest.TestCase):
+
+    def test_wins_and_losses(self):
+        self.assertEqual(tablebase_score(2, 5), Cp(TABLEBASE_WIN_SCORE - 5))
+        self.assertEqual(tablebase_score(-2, -5), Cp(-TABLEBASE_WIN_SCORE + 5))
+
+    def test_faster_wins_score_higher(self):
+        self.assertGreater(tablebase_score(2, 3), tablebase_score(2, 11))
+        self.assertGreater(tablebase_score(-2, -11), tablebase_score(-2, -3))
+
+    def test_fifty_move_rule_draws(self):
+        self.assertEqual(tablebase_score(1, 101), Cp(0))
+        self.assertEqual(tablebase_score(-1, -101), Cp(0))
+        self.assertEqual(tablebase_score(0, 0), Cp(0))
+
+    def test_tablebase_wins(self):
+        self.assertTrue(is_tablebase_win(tablebase_score(2, 5)))
+        self.assertTrue(is_tablebase_win(tablebase_score(-2, -100)))
+        self.assertFalse(is_tablebase_win(Cp(900)))
+        self.assertFalse(is_tablebase_win(Mate(3)))
+
+    def test_tablebase_wins_are_categorized(self):
+        board = Board("8/8/8/3k4/8/8/8/KQ6 w - - 0 1")
+        puzzle = Puzzle(board, None)
+        position = PuzzlePosition(board, None)
+        position.score = tablebase_score(2, 5)
+        puzzle.positions = [position, PuzzlePosition(board, None)]
+        puzzle.initial_score = Cp(900)
+        puzzle.final_score = tablebase_score(2, 5)
+        self.assertEqual(puzzle.category(), "Endgame")
+        self.assertEqual(puzzle.winner(), "White")
+
+    def test_empty_tablebase(self):
+        with tempfile.TemporaryDirectory() as directory:
+            tablebase = Tablebase(directory)
+            board = Board("8/8/8/8/8/8/2kQ4/K7 b - - 0 1")
+            self.assertFalse(tablebase.covers(board))
+            self.assertIsNone(tablebase.analyse(board))
+
+
+class TestTablebaseLines(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.tablebase = Tablebase(self.directory.name)
+        self.tablebase._tablebase = FakeTables()
+        self.tablebase.max_pieces = 3
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_line_follows_the_best_moves_by_dtz(self):
+        board = Board("8/8/8/3k4/8/8/8/KQ6 w - - 0 1")
+        info = self.tablebase.analyse(board)
+        self.assertEqual(len(info["pv"]), TABLEBASE_PV_PLIES)
+        for move in info["pv"]:
+            scored_moves = self.tablebase._scored_moves(board, list(board.legal_moves))
+            self.assertEqual(move, scored_moves[0][1])
+            board.push(move)
+
+    def test_line_ends_with_the_game(self):
+        # the queen is hanging, and taking it draws
+        board = Board("8/8/8/8/8/8/2kQ4/K7 b - - 0 1")
+        info = self.tablebase.analyse(board)
+        self.assertEqual(info["pv"], [Move.from_uci("c2d2")])
+        self.assertEqual(info["score"].relative, Cp(0))
+
+
+@unittest.skipUnless(SYZYGY_PATH, "SYZYGY_PATH isn't set")
+class TestTablebaseProbes(unittest.TestCase):
+
+    def setUp(self):
+        self.tablebase = Tablebase(SYZYGY_PATH)
+        AnalysisEngine.tablebase = self.tablebase
+
+    def tearDown(self):
+        AnalysisEngine.tablebase = None
+        self.tablebase.close()
+
+    def test_positions_with_castling_rights_arent_covered(self):
+        self.assertFalse(self.tablebase.covers(Board("4k3/8/8/8/8/8/8/R3K3 w Q - 0 1")))
+
+    def test_winning_position(self):
+        board = Board("8/8/8/3k4/8/8/8/KQ6 w - - 0 1")
+        best_move = AnalysisEngine.best_move(board, 22)
+        self.assertGreater(best_move.score.score(), TABLEBASE_WIN_SCORE - 100)
+        self.assertEqual(len(best_move.pv), TABLEBASE_PV_PLIES)
+        for move in best_move.pv:
+            self.assertTrue(board.is_legal(move))
+            board.push(move)
+
+    def test_single_drawing_move(self):
+        # the queen is hanging, and taking it is the only move that doesn't lose
+        board = Board("8/8/8/8/8/8/2kQ4/K7 b - - 0 1")
+        best_moves = AnalysisEngine.best_moves(board, 22)
+        self.assertEqual(best_moves[0].move, Move.from_uci("c2d2"))
+        self.assertEqual(best_moves[0].score, Cp(0))
+        self.assertFalse(ambiguous_best_move([move.score for move in best_moves]))
+
+    def test_restricted_to_root_moves(self):
+        board = Board("8/8/8/8/8/8/2kQ4/K7 b - - 0 1")
+        move = Move.from_uci("c2b3")
+        evaluated_move = AnalysisEngine.evaluate_move(board, move, 22)
+        self.assertEqual(evaluated_move.move, move)
+        # scores are from white's perspective
+        self.assertGreater(evaluated_move.score.score(), TABLEBASE_WIN_SCORE - 100)
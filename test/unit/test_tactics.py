@@ -0,0 +1,95 @@
+import unittest
+
+from chess import Board, Move
+
+from puzzlemaker.budget import prioritized
+from puzzlemaker.puzzle import Puzzle
+from puzzlemaker.tactics import (
+    see, candidate_motifs, position_motifs, prefilter,
+    MATE_IN_ONE, MATE_THREAT, WINNING_CAPTURE, HANGING_PIECE, UNEVEN_CAPTURE, CHECK,
+    PREFILTER_DROP, PREFILTER_DEMOTE,
+)
+
+# (FEN, initial move) of the puzzles in the integration tests
+KNOWN_PUZZLES = [
+    ('6k1/R4p2/1r3npp/2N5/P1b2P2/6P1/3r2BP/4R1K1 w - - 0 34', 'Rb7'),
+    ('r1b3kr/ppp1Bp1p/1b6/n2P4/2p3q1/2Q2N2/P4PPP/RN2R1K1 w - - 1 0', None),
+    ('r2n1rk1/1ppb2pp/1p1p4/3Ppq1n/2B3P1/2P4P/PP1N1P1K/R2Q1RN1 b - - 0 1', 'Qxf2+'),
+    ('3q1r1k/2p4p/1p1pBrp1/p2Pp3/2PnP3/5PP1/PP1Q2K1/5R1R w - - 1 0', 'Rxh7+'),
+    ('r1b2r1k/ppp2p1p/8/P3p2p/2PqP3/3P1Q1P/6PK/5R2 b - - 3 21', 'Be6'),
+    ('3rr1k1/ppq2pp1/2p1b2p/8/3P2n1/2N3P1/PP3PBP/R2QR1K1 w - - 0 1', None),
+    ('1k6/p7/1p1prrB1/7P/4R3/2P3K1/PP3P2/8 b - - 0 1', None),
+    ('8/1p6/p3pk2/5nR1/8/P3rN2/1P3KP1/8 w - - 0 1', None),
+    ('6rk/p3qp2/1np5/2b1pP2/4P1nr/1BN2Q2/PP3P2/3R1K1R w - - 0 1', None),
+    ('r2qr3/2pp1pkp/b1p3p1/p7/P7/1PnBPQ2/2PN1PPP/R4RK1 w - - 0 1', None),
+]
+
+
+def puzzle(fen, move_san=None):
+    board = Board(fen)
+    return Puzzle(board, board.parse_san(move_san) if move_san else None)
+
+
+class TestStaticExchange(unittest.TestCase):
+
+    def test_even_exchange(self):
+        board = Board("rnbqkbnr/ppp1pppp/8/3p4/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2")
+        self.assertEqual(see(board, board.parse_san("exd5")), 0)
+
+    def test_free_pawn(self):
+        board = Board("4k3/8/8/3p4/4P3/8/8/4K3 w - - 0 1")
+        self.assertEqual(see(board, board.parse_san("exd5")), 100)
+
+    def test_defended_pawn(self):
+        board = Board("4k3/8/2p5/3p4/8/8/8/3QK3 w - - 0 1")
+        self.assertEqual(see(board, board.parse_san("Qxd5")), -800)
+
+
+class TestMotifs(unittest.TestCase):
+
+    def test_quiet_move(self):
+        self.assertEqual(candidate_motifs(Board(), Move.from_uci("e2e4")), [])
+
+    def test_mate_in_one(self):
+        self.assertIn(MATE_IN_ONE, position_motifs(Board("6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1")))
+
+    def test_mate_threat(self):
+        motifs = position_motifs(Board("6k1/5ppp/8/8/8/8/5PPP/3R2K1 b - - 0 1"))
+        self.assertEqual(motifs, [MATE_THREAT])
+
+    def test_hanging_piece(self):
+        motifs = position_motifs(Board("4k3/8/2p5/3p4/4P3/8/8/4K3 w - - 0 1"))
+        self.assertEqual(motifs, [HANGING_PIECE])
+
+    def test_capture_with_check(self):
+        board = Board('r2n1rk1/1ppb2pp/1p1p4/3Ppq1n/2B3P1/2P4P/PP1N1P1K/R2Q1RN1 b - - 0 1')
+        motifs = candidate_motifs(board, board.parse_san('Qxf2+'))
+        self.assertEqual(motifs[:2], [UNEVEN_CAPTURE, CHECK])
+        self.assertIn(WINNING_CAPTURE, motifs)
+
+    def test_known_puzzles(self):
+        for fen, move_san in KNOWN_PUZZLES:
+            board = Board(fen)
+            move = board.parse_san(move_san) if move_san else None
+            self.assertTrue(candidate_motifs(board, move), fen)
+
+
+class TestPrefilter(unittest.TestCase):
+
+    def setUp(self):
+        self.puzzles = [
+            puzzle(Board().fen(), "e4"),
+            puzzle('3q1r1k/2p4p/1p1pBrp1/p2Pp3/2PnP3/5PP1/PP1Q2K1/5R1R w - - 1 0', 'Rxh7+'),
+        ]
+
+    def test_no_prefilter(self):
+        self.assertEqual(list(prefilter(self.puzzles, None)), self.puzzles)
+        self.assertIsNone(self.puzzles[0].tactical_motifs)
+
+    def test_drop(self):
+        self.assertEqual(list(prefilter(self.puzzles, PREFILTER_DROP)), self.puzzles[1:])
+        self.assertEqual(self.puzzles[0].tactical_motifs, [])
+
+    def test_demote(self):
+        self.assertEqual(list(prefilter(self.puzzles, PREFILTER_DEMOTE)), self.puzzles)
+        self.assertEqual(prioritized(self.puzzles), [1, 0])
@@ -0,0 +1,72 @@
+import os
+import time
+import unittest
+from unittest import mock
+
+from puzzlemaker.analysis import AnalysisEngine
+from puzzlemaker.analysis_cache import AnalysisCache
+from puzzlemaker.budget import BudgetLimit, SharedBudget
+from puzzlemaker.constants import MAX_GAME_ATTEMPTS
+from puzzlemaker.workers import GameResult, GameWorkers, _worker_settings
+
+from test.unit.fake_engine import fake_engine
+
+GAME_PGN = os.path.join(os.path.dirname(__file__), "..", "fixtures",
+                        "carlsen-anand-blunder.wc2014.pgn")
+
+
+def process_game(game_id, game_pgn):
+    """ Stands in for _process_game without an engine. The game "crash"
+        kills its worker, the others take a moment to finish
+    """
+    if game_pgn == "crash":
+        os._exit(1)
+    time.sleep(0.2)
+    return GameResult(game_id, 1, [game_pgn])
+
+def spend_run_budget(game_id, game_pgn):
+    """ Stands in for _process_game, spending 100 nodes of the run budget
+    """
+    _worker_settings["run_budget"].spend(100)
+    return GameResult(game_id, 1, [game_pgn])
+
+
+class TestGameWorkers(unittest.TestCase):
+
+    def test_only_the_crashing_game_is_given_up(self):
+        games = [(0, "a"), (1, "crash"), (2, "b"), (3, "c")]
+        workers = GameWorkers(4, {}, scan_depth=16, search_depth=22, cache_size=0)
+        with mock.patch("puzzlemaker.workers._process_game", process_game):
+            results = list(workers.process(games))
+        self.assertEqual([result.game_id for result in results], [0, 1, 2, 3])
+        self.assertEqual([result.puzzle_pgns for result in results], [["a"], [], ["b"], ["c"]])
+        self.assertEqual([result.failed is not None for result in results],
+                         [False, True, False, False])
+        self.assertIn(str(MAX_GAME_ATTEMPTS), results[1].failed)
+
+    def test_workers_share_the_run_budget(self):
+        games = [(game_id, "game") for game_id in range(6)]
+        run_budget = SharedBudget(BudgetLimit(nodes=1000))
+        workers = GameWorkers(3, {}, scan_depth=16, search_depth=22, cache_size=0,
+                              run_budget=run_budget)
+        with mock.patch("puzzlemaker.workers._process_game", spend_run_budget):
+            results = list(workers.process(games))
+        self.assertEqual(len(results), 6)
+        self.assertEqual(run_budget.nodes, 600)
+
+    def test_workers_searches_are_counted(self):
+        with open(GAME_PGN) as pgn:
+            games = [(0, pgn.read())]
+        with fake_engine():
+            AnalysisEngine.cache = AnalysisCache(100)
+            counters = AnalysisEngine.counters()
+            workers = GameWorkers(1, {}, scan_depth=8, search_depth=10, cache_size=100)
+            results = list(workers.process(games))
+            for result in results:
+                AnalysisEngine.add_counters(result.counters)
+            searches = AnalysisEngine.stats.searches - counters["stats.searches"]
+            cache_misses = AnalysisEngine.cache.misses - counters["cache.misses"]
+        self.assertGreater(len(results[0].puzzle_pgns), 0)
+        self.assertEqual(results[0].counters["stats.searches"], searches)
+        self.assertGreater(searches, 0)
+        self.assertEqual(cache_misses, searches)